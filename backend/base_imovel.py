@@ -0,0 +1,235 @@
+"""Base materializada e versionada de imóveis (tlp.tlp_base_imovel).
+
+vw_uso_imovel_por_inscricao é uma pilha de views sobre as camadas raw/stg
+(ranking de CNAEs, classificação do imóvel) e custa caro a cada avaliação.
+A atualização grava uma nova versão da view em tlp_base_imovel; simulações e
+consultas leem a versão ATIVA, e cada simulação registra a versão que usou.
+
+A versão anterior é mantida (status SUBSTITUIDA) para que processamentos em
+andamento terminem sobre a mesma base; versões mais antigas são removidas.
+
+Atualização explícita:
+    POST /base/atualizar    (enfileira um job)
+    python -m base_imovel   (executa direto)
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import func, text
+
+COLUNAS_BASE = (
+    "codg_inscricao_lan",
+    "nome_contribuinte_lan",
+    "uso_classificado",
+    "atividade_considerada",
+    "tem_servico",
+    "tem_comercio",
+    "tem_industria",
+    "qtde_empresas_distintas",
+    "qtde_cnaes_distintos",
+)
+
+
+def versao_atual(db):
+    """Retorna a versão ATIVA da base (TlpBaseVersao) ou None se nunca foi gerada."""
+    from models import TlpBaseVersao
+
+    return db.query(TlpBaseVersao).filter(
+        TlpBaseVersao.status == 'ATIVA'
+    ).order_by(TlpBaseVersao.id_versao.desc()).first()
+
+
+def atualizar_base(db):
+    """Gera uma nova versão da base a partir de vw_uso_imovel_por_inscricao e a torna ATIVA.
+
+    Atualizações simultâneas são serializadas por advisory lock; se, ao obter o lock,
+    já houver uma versão ATIVA mais nova que a deste pedido, ela é retornada sem nova carga.
+    """
+    from models import TlpBaseVersao
+
+    versao = TlpBaseVersao(status='GERANDO')
+    db.add(versao)
+    db.commit()
+    db.refresh(versao)
+
+    try:
+        # Uma atualização por vez
+        db.execute(text("SELECT pg_advisory_xact_lock(hashtext('tlp.tlp_base_imovel'))"))
+
+        # Outra atualização, iniciada depois desta, pegou o lock antes e já ativou uma
+        # versão posterior a este pedido: usa essa versão em vez de substituí-la
+        anterior = versao_atual(db)
+        if anterior is not None and anterior.id_versao > versao.id_versao:
+            db.delete(versao)
+            db.commit()
+            return anterior
+
+        colunas = ", ".join(COLUNAS_BASE)
+        total = db.execute(
+            text(f"""
+                INSERT INTO tlp.tlp_base_imovel (id_versao, {colunas})
+                SELECT :id_versao, {colunas}
+                FROM tlp.vw_uso_imovel_por_inscricao
+            """),
+            {"id_versao": versao.id_versao}
+        ).rowcount
+
+        if anterior is not None:
+            anterior.status = 'SUBSTITUIDA'
+            # Mantém somente a versão anterior além da nova
+            db.execute(
+                text("DELETE FROM tlp.tlp_base_imovel WHERE id_versao < :id_anterior"),
+                {"id_anterior": anterior.id_versao}
+            )
+            db.execute(
+                text("""
+                    UPDATE tlp.tlp_base_versao SET status = 'SUBSTITUIDA'
+                    WHERE id_versao < :id_anterior AND status = 'ATIVA'
+                """),
+                {"id_anterior": anterior.id_versao}
+            )
+
+        versao.status = 'ATIVA'
+        versao.total_imoveis = total
+        versao.concluido_em = func.clock_timestamp()
+        db.commit()
+    except Exception:
+        db.rollback()
+        versao.status = 'ERRO'
+        db.commit()
+        raise
+
+    # Estatísticas atualizadas para o planner (fora da transação da carga)
+    db.execute(text("ANALYZE tlp.tlp_base_imovel"))
+    db.commit()
+
+    db.refresh(versao)
+    return versao
+
+
+def garantir_versao(db):
+    """Versão ATIVA da base, gerando a primeira se ainda não existir."""
+    return versao_atual(db) or atualizar_base(db)
+
+
+# Contagens por (uso, isento) em cache, por versão da base + estado da não incidência
+_CONTAGENS_MAX = 32
+_contagens_cache = OrderedDict()
+_contagens_lock = threading.Lock()
+
+
+def contagens_por_grupo(db, exercicio):
+    """Contagem de imóveis por (uso_classificado, isento por não incidência) no exercício.
+
+    Retorna (id_versao, grupos) com grupos = [(uso_classificado, isento, quantidade)].
+    O resultado fica em cache até mudar a versão da base ou a não incidência do exercício.
+    """
+    versao = versao_atual(db)
+    id_versao = versao.id_versao if versao else None
+
+    # Assinatura barata da não incidência do exercício (tabela pequena)
+    assinatura = tuple(db.execute(
+        text("""
+            SELECT COUNT(*), MAX(created_at)
+            FROM tlp.tlp_nao_incidencia
+            WHERE exercicio = :ex AND ativo = true
+        """),
+        {"ex": exercicio}
+    ).fetchone())
+    chave = (id_versao, exercicio, assinatura)
+
+    with _contagens_lock:
+        if chave in _contagens_cache:
+            _contagens_cache.move_to_end(chave)
+            return id_versao, _contagens_cache[chave]
+
+    # Sem versão materializada ainda: agrega direto da view
+    origem = "tlp.tlp_base_imovel b WHERE b.id_versao = :versao" if versao else "tlp.vw_uso_imovel_por_inscricao b"
+    grupos = [tuple(row) for row in db.execute(
+        text(f"""
+            SELECT b.uso_classificado, (i.codg_inscricao_lan IS NOT NULL) AS isento, COUNT(*)
+            FROM (SELECT b.codg_inscricao_lan, b.uso_classificado FROM {origem}) b
+            LEFT JOIN (
+                SELECT DISTINCT codg_inscricao_lan
+                FROM tlp.tlp_nao_incidencia
+                WHERE exercicio = :ex AND ativo = true
+            ) i ON i.codg_inscricao_lan = b.codg_inscricao_lan
+            GROUP BY 1, 2
+        """),
+        {"ex": exercicio, "versao": id_versao}
+    ).fetchall()]
+
+    with _contagens_lock:
+        _contagens_cache[chave] = grupos
+        while len(_contagens_cache) > _CONTAGENS_MAX:
+            _contagens_cache.popitem(last=False)
+    return id_versao, grupos
+
+
+# Imóveis por (versão da base, inscrição) em cache LRU; uma versão nunca muda depois de ATIVA
+_IMOVEIS_MAX = int(os.getenv("TLP_CACHE_IMOVEIS_MAX", "20000"))
+_imoveis_cache = OrderedDict()
+_imoveis_lock = threading.Lock()
+_imoveis_contadores = {"acertos": 0, "faltas": 0}
+_NAO_ENCONTRADO = object()
+
+
+def buscar_imoveis(db, inscricoes):
+    """Imóveis das inscrições na versão ATIVA da base, com uma única consulta `= ANY(:inscricoes)`.
+
+    Retorna (id_versao, {inscrição: dict com COLUNAS_BASE}); inscrições inexistentes ficam de fora.
+    Sem versão materializada ainda, consulta a view e não usa o cache.
+    """
+    versao = versao_atual(db)
+    id_versao = versao.id_versao if versao else None
+
+    encontrados, faltantes = {}, []
+    with _imoveis_lock:
+        for inscricao in dict.fromkeys(inscricoes):
+            chave = (id_versao, inscricao)
+            if id_versao is not None and chave in _imoveis_cache:
+                _imoveis_cache.move_to_end(chave)
+                _imoveis_contadores["acertos"] += 1
+                if _imoveis_cache[chave] is not _NAO_ENCONTRADO:
+                    encontrados[inscricao] = _imoveis_cache[chave]
+            else:
+                _imoveis_contadores["faltas"] += 1
+                faltantes.append(inscricao)
+
+    if not faltantes:
+        return id_versao, encontrados
+
+    origem = "tlp.tlp_base_imovel WHERE id_versao = :versao AND" if versao else "tlp.vw_uso_imovel_por_inscricao WHERE"
+    lidos = {
+        row.codg_inscricao_lan: dict(row._mapping)
+        for row in db.execute(
+            text(f"SELECT {', '.join(COLUNAS_BASE)} FROM {origem} codg_inscricao_lan = ANY(:inscricoes)"),
+            {"versao": id_versao, "inscricoes": faltantes}
+        )
+    }
+    encontrados.update(lidos)
+
+    if id_versao is not None:
+        with _imoveis_lock:
+            for inscricao in faltantes:
+                _imoveis_cache[(id_versao, inscricao)] = lidos.get(inscricao, _NAO_ENCONTRADO)
+            while len(_imoveis_cache) > _IMOVEIS_MAX:
+                _imoveis_cache.popitem(last=False)
+    return id_versao, encontrados
+
+
+def estatisticas_cache_imoveis():
+    with _imoveis_lock:
+        return {"entradas": len(_imoveis_cache), "max_entradas": _IMOVEIS_MAX, **_imoveis_contadores}
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    sessao = SessionLocal()
+    try:
+        nova = atualizar_base(sessao)
+        print(f"Base de imóveis atualizada: versão {nova.id_versao}, {nova.total_imoveis} imóveis")
+    finally:
+        sessao.close()
@@ -0,0 +1,15 @@
+"""Benchmarks de desempenho do backend TLP com bases sintéticas (de 10 mil a +1 milhão de inscrições).
+
+- gerador.py: preenche um Postgres local com N imóveis sintéticos atrás de
+  tlp.vw_uso_imovel_por_inscricao (determinístico pela semente), com um mix de
+  usos realista e registros de não incidência;
+- executar.py: para cada tamanho, mede processar_simulacao (engines python e
+  sql), /resultado, páginas profundas de /itens e consultas a /imoveis;
+- comparar.py: compara dois JSON de resultados (ex.: antes e depois de um commit).
+
+Executar a partir de backend/, com DATABASE_URL apontando para um banco local
+dedicado (o gerador recusa um banco cuja view não seja a sintética):
+
+    python -m benchmarks --tamanhos 10000,100000,1000000 --saida bench.json
+    python -m benchmarks.comparar bench_main.json bench.json
+"""
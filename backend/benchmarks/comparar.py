@@ -0,0 +1,67 @@
+"""Compara dois arquivos de resultados de `python -m benchmarks` (referência e atual).
+
+Casa os resultados por (tamanho, caso) e compara o `valor` (menor é melhor).
+Variação acima de --tolerancia é marcada como regressão, e o código de saída é 1
+se houver alguma, para uso em CI.
+
+    python -m benchmarks.comparar bench_main.json bench.json --tolerancia 0.15
+"""
+import argparse
+import json
+import sys
+
+
+def comparar(referencia, atual, tolerancia):
+    """Lista de {tamanho, caso, unidade, referencia, atual, variacao, situacao} dos casos presentes nos dois."""
+    anteriores = {(r["tamanho"], r["caso"]): r for r in referencia["resultados"]}
+    comparacoes = []
+    for r in atual["resultados"]:
+        anterior = anteriores.get((r["tamanho"], r["caso"]))
+        if anterior is None or not anterior["valor"]:
+            continue
+        variacao = r["valor"] / anterior["valor"] - 1
+        if variacao > tolerancia:
+            situacao = "REGRESSAO"
+        elif variacao < -tolerancia:
+            situacao = "MELHORA"
+        else:
+            situacao = "="
+        comparacoes.append({
+            "tamanho": r["tamanho"],
+            "caso": r["caso"],
+            "unidade": r["unidade"],
+            "referencia": anterior["valor"],
+            "atual": r["valor"],
+            "variacao": round(variacao, 4),
+            "situacao": situacao,
+        })
+    return comparacoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara dois resultados de benchmark")
+    parser.add_argument("referencia")
+    parser.add_argument("atual")
+    parser.add_argument("--tolerancia", type=float, default=0.10, help="variação aceita (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    with open(args.referencia, encoding="utf-8") as arquivo:
+        referencia = json.load(arquivo)
+    with open(args.atual, encoding="utf-8") as arquivo:
+        atual = json.load(arquivo)
+
+    print(f"referência: {referencia['ambiente'].get('commit')}  atual: {atual['ambiente'].get('commit')}")
+    comparacoes = comparar(referencia, atual, args.tolerancia)
+    print(f"{'tamanho':>9} {'caso':<34} {'referência':>12} {'atual':>12} {'variação':>9}")
+    for c in comparacoes:
+        print(f"{c['tamanho']:>9} {c['caso']:<34} {c['referencia']:>10} {c['unidade']:<2}"
+              f"{c['atual']:>10} {c['unidade']:<2}{c['variacao']:>+9.1%} {c['situacao']}")
+
+    regressoes = [c for c in comparacoes if c["situacao"] == "REGRESSAO"]
+    if regressoes:
+        print(f"{len(regressoes)} regressão(ões) acima de {args.tolerancia:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
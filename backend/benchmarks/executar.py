@@ -0,0 +1,282 @@
+"""Executa os benchmarks em cada tamanho de base e grava os resultados em JSON.
+
+Para cada tamanho: gera a base sintética (gerador.py) e mede
+
+- gerar_base: geração e materialização da base (tlp_base_imovel);
+- processar_simulacao[python|sql]: processamento completo, em segundos e linhas/s;
+- resultado e resultado[recalcular]: GET /simulacoes/{id}/resultado, lendo o resumo
+  gravado e agregando sobre os itens;
+- itens[p=X]: GET /simulacoes/{id}/itens?limit=100 na posição X da listagem (0 = primeira
+  página), com o cursor da linha correspondente;
+- imoveis[frio|quente] e imoveis/batch[frio|quente]: GET /imoveis/{inscricao} e
+  POST /imoveis/batch com 1000 inscrições, antes e depois de o cache LRU conter as chaves.
+
+Os endpoints passam pela aplicação inteira (TestClient: rotas, middlewares,
+serialização), sem rede. Cada resultado tem um `valor` (segundos ou p50 em ms,
+menor é melhor), que é o que comparar.py usa entre dois arquivos.
+
+    python -m benchmarks --tamanhos 10000,100000,1000000 --repeticoes 30 --saida bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+
+# Sem worker embutido: o processamento é chamado diretamente, sem concorrer com a fila
+os.environ.setdefault("TLP_WORKER_EMBUTIDO", "0")
+
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+import main as api
+from benchmarks.gerador import EXERCICIO_BENCH, gerar_base
+from database import SessionLocal, engine
+from particoes import remover_particao
+from processamento import ENGINES_PROCESSAMENTO, processar_simulacao
+from progresso import remover as remover_progresso
+from resumo import remover_resumo
+
+VERSAO_FORMATO = 1
+
+TAMANHOS_PADRAO = (10000, 100000, 1000000)
+PROFUNDIDADES_ITENS = (0.0, 0.5, 0.99)
+TAMANHO_PAGINA = 100
+TAMANHO_BATCH_IMOVEIS = 1000
+# Endpoints que agregam a base inteira a cada chamada: menos repetições
+MAX_REPETICOES_PESADAS = 5
+
+PARAMETROS_SIMULACAO = {
+    "exercicio": EXERCICIO_BENCH,
+    "descricao": "Benchmark",
+    "custo_tlp_base": 300000000,
+    "ipca_percentual": 4.5,
+    "subsidio_percentual": 10,
+    "limite_min_base": 50,
+    "limite_max_base": 600,
+    "limite_min_atualizado": 52.25,
+    "limite_max_atualizado": 627,
+}
+
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+def _resultado(tamanho, caso, valor, unidade, **detalhes):
+    return {"tamanho": tamanho, "caso": caso, "valor": round(valor, 3), "unidade": unidade, **detalhes}
+
+
+def _medir_requisicoes(tamanho, caso, requisicoes):
+    """Executa as requisições (funções sem argumentos) e resume as latências em ms; valor = p50."""
+    latencias = []
+    for requisitar in requisicoes:
+        inicio = time.perf_counter()
+        resposta = requisitar()
+        latencias.append((time.perf_counter() - inicio) * 1000)
+        if resposta.status_code != 200:
+            raise RuntimeError(f"{caso}: HTTP {resposta.status_code} {resposta.text[:200]}")
+    return _resultado(
+        tamanho, caso, _percentil(latencias, 50), "ms",
+        p95_ms=round(_percentil(latencias, 95), 3),
+        min_ms=round(min(latencias), 3),
+        max_ms=round(max(latencias), 3),
+        repeticoes=len(latencias),
+    )
+
+
+def _processar(client, tamanho, engine_processamento):
+    id_simulacao = client.post("/simulacoes", json=PARAMETROS_SIMULACAO).json()["id_simulacao"]
+    db = SessionLocal()
+    try:
+        inicio = time.perf_counter()
+        resposta = processar_simulacao(db, id_simulacao, engine=engine_processamento)
+        segundos = time.perf_counter() - inicio
+    finally:
+        db.close()
+
+    itens = resposta["itens_criados"]
+    detalhes = {"itens": itens, "linhas_por_segundo": round(itens / segundos, 1)}
+    if "pipeline" in resposta:
+        detalhes["estagios"] = {
+            nome: estagio["ocupado_segundos"] for nome, estagio in resposta["pipeline"]["estagios"].items()
+        }
+    return id_simulacao, _resultado(tamanho, f"processar_simulacao[{engine_processamento}]", segundos, "s", **detalhes)
+
+
+def _cursor_na_posicao(id_simulacao, posicao):
+    """Cursor de /itens que começa após a linha `posicao` da ordenação (OFFSET só na preparação)."""
+    with engine.connect() as conn:
+        linha = conn.execute(
+            text("""
+                SELECT tlp_calculada, id_item FROM tlp.tlp_simulacao_item
+                WHERE id_simulacao = :id
+                ORDER BY tlp_calculada DESC, id_item DESC
+                OFFSET :posicao LIMIT 1
+            """),
+            {"id": id_simulacao, "posicao": posicao}
+        ).fetchone()
+    return api.codificar_cursor(linha.tlp_calculada, linha.id_item)
+
+
+def _medir_leituras(client, tamanho, id_simulacao, itens, repeticoes):
+    url = f"/simulacoes/{id_simulacao}"
+    pesadas = min(repeticoes, MAX_REPETICOES_PESADAS)
+    resultados = [
+        _medir_requisicoes(tamanho, "resultado", [lambda: client.get(f"{url}/resultado")] * repeticoes),
+        _medir_requisicoes(
+            tamanho, "resultado[recalcular]", [lambda: client.get(f"{url}/resultado?recalcular=true")] * pesadas
+        ),
+    ]
+    for profundidade in PROFUNDIDADES_ITENS:
+        posicao = int(itens * profundidade)
+        caminho = f"{url}/itens?limit={TAMANHO_PAGINA}"
+        if posicao > 0:
+            caminho += f"&cursor={_cursor_na_posicao(id_simulacao, posicao - 1)}"
+        resultados.append(_medir_requisicoes(
+            tamanho, f"itens[p={profundidade}]", [lambda caminho=caminho: client.get(caminho)] * repeticoes
+        ))
+    return resultados
+
+
+def _medir_imoveis(client, tamanho, repeticoes, semente):
+    sorteio = random.Random(semente)
+    quantidade = min(tamanho, repeticoes + TAMANHO_BATCH_IMOVEIS * MAX_REPETICOES_PESADAS)
+    inscricoes = [f"{i:014d}" for i in sorteio.sample(range(1, tamanho + 1), quantidade)]
+    individuais = inscricoes[:repeticoes]
+    lotes = [
+        inscricoes[repeticoes + i * TAMANHO_BATCH_IMOVEIS:repeticoes + (i + 1) * TAMANHO_BATCH_IMOVEIS]
+        for i in range(MAX_REPETICOES_PESADAS)
+    ]
+    lotes = [lote for lote in lotes if lote]
+
+    def consultar(inscricao):
+        return lambda: client.get(f"/imoveis/{inscricao}")
+
+    def consultar_lote(lote):
+        return lambda: client.post("/imoveis/batch", json={"inscricoes": lote})
+
+    # Chaves ainda fora do cache LRU na primeira passada (frio), no cache na segunda (quente)
+    return [
+        _medir_requisicoes(tamanho, "imoveis[frio]", [consultar(i) for i in individuais]),
+        _medir_requisicoes(tamanho, "imoveis[quente]", [consultar(i) for i in individuais]),
+        _medir_requisicoes(tamanho, "imoveis/batch[frio]", [consultar_lote(lote) for lote in lotes]),
+        _medir_requisicoes(tamanho, "imoveis/batch[quente]", [consultar_lote(lote) for lote in lotes]),
+    ]
+
+
+def _remover_simulacao(id_simulacao):
+    from models import TlpSimulacao
+
+    db = SessionLocal()
+    try:
+        remover_particao(db, id_simulacao)
+        remover_resumo(db, id_simulacao)
+        remover_progresso(db, id_simulacao)
+        db.query(TlpSimulacao).filter(TlpSimulacao.id_simulacao == id_simulacao).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+def _ambiente():
+    def git(*argumentos):
+        try:
+            return subprocess.run(
+                ["git", *argumentos], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    with engine.connect() as conn:
+        versao_postgres = conn.execute(text("SHOW server_version")).scalar()
+    alteracoes = git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "alteracoes_locais": bool(alteracoes) if alteracoes is not None else None,
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "postgres": versao_postgres,
+    }
+
+
+def executar(tamanhos=TAMANHOS_PADRAO, engines=ENGINES_PROCESSAMENTO, repeticoes=30, semente=42):
+    """Roda todos os casos em cada tamanho. Retorna o documento JSON (dict) com ambiente e resultados."""
+    resultados = []
+    with TestClient(api.app) as client:
+        for tamanho in tamanhos:
+            print(f"Gerando base sintética com {tamanho} imóveis...")
+            base = gerar_base(tamanho, semente)
+            resultados.append(_resultado(tamanho, "gerar_base", base["segundos"], "s",
+                                         nao_incidencias=base["nao_incidencias"]))
+
+            simulacoes = {}
+            try:
+                for engine_processamento in engines:
+                    print(f"Processando simulação (engine={engine_processamento})...")
+                    id_simulacao, resultado = _processar(client, tamanho, engine_processamento)
+                    simulacoes[engine_processamento] = id_simulacao
+                    resultados.append(resultado)
+
+                # Leituras sobre a simulação do primeiro engine (os itens são os mesmos em ambos)
+                id_leitura = simulacoes[engines[0]]
+                print("Medindo /resultado, /itens e /imoveis...")
+                resultados += _medir_leituras(client, tamanho, id_leitura, base["imoveis"], repeticoes)
+                resultados += _medir_imoveis(client, tamanho, repeticoes, semente)
+            finally:
+                for id_simulacao in simulacoes.values():
+                    _remover_simulacao(id_simulacao)
+
+    return {
+        "versao_formato": VERSAO_FORMATO,
+        "gerado_em": datetime.now(timezone.utc).isoformat(),
+        "ambiente": _ambiente(),
+        "parametros": {
+            "tamanhos": list(tamanhos),
+            "engines": list(engines),
+            "repeticoes": repeticoes,
+            "semente": semente,
+        },
+        "resultados": resultados,
+    }
+
+
+def imprimir(documento):
+    print(f"{'tamanho':>9} {'caso':<34} {'valor':>12}  detalhes")
+    for r in documento["resultados"]:
+        detalhes = {k: v for k, v in r.items() if k not in ("tamanho", "caso", "valor", "unidade")}
+        print(f"{r['tamanho']:>9} {r['caso']:<34} {r['valor']:>10} {r['unidade']:<2} {detalhes}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do backend TLP sobre bases sintéticas")
+    parser.add_argument("--tamanhos", default=",".join(str(t) for t in TAMANHOS_PADRAO),
+                        help="quantidades de imóveis, separadas por vírgula")
+    parser.add_argument("--engines", default=",".join(ENGINES_PROCESSAMENTO))
+    parser.add_argument("--repeticoes", type=int, default=30, help="requisições por caso de leitura")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--saida", help="arquivo JSON de resultados")
+    args = parser.parse_args()
+
+    engines = tuple(e.strip() for e in args.engines.split(","))
+    invalidas = [e for e in engines if e not in ENGINES_PROCESSAMENTO]
+    if invalidas:
+        parser.error(f"engine inválida: {', '.join(invalidas)}")
+
+    documento = executar(
+        tuple(int(t) for t in args.tamanhos.split(",")), engines, args.repeticoes, args.semente
+    )
+    imprimir(documento)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            json.dump(documento, arquivo, ensure_ascii=False, indent=2)
+        print(f"Resultados gravados em {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Base sintética de imóveis para os benchmarks.
+
+Os imóveis ficam em tlp_bench.imovel_sintetico, e tlp.vw_uso_imovel_por_inscricao
+passa a ser uma view sobre essa tabela. Tudo é gerado no banco, com
+generate_series e hashes com semente (hashint8extended), sem passar linha pelo
+Python: o mesmo N e a mesma semente produzem sempre a mesma base, e 1 milhão de
+imóveis leva segundos.
+
+Depois de gerar, a base é materializada (atualizar_base) e a não incidência do
+exercício é substituída por uma amostra de PROPORCAO_NAO_INCIDENCIA das inscrições.
+
+    python -m benchmarks.gerador 1000000 --semente 42
+"""
+import argparse
+import time
+
+from sqlalchemy import text
+
+from base_imovel import atualizar_base
+from database import SessionLocal, engine
+from migracoes import aplicar_migracoes
+
+SCHEMA_BENCH = "tlp_bench"
+TABELA_SINTETICA = f"{SCHEMA_BENCH}.imovel_sintetico"
+
+EXERCICIO_BENCH = 2099
+
+# Proporção de cada uso_classificado (inclui valores sujos, como na view real)
+MIX_USOS = (
+    ("RESIDENCIAL", 0.78),
+    ("COMERCIO", 0.09),
+    ("SERVICO", 0.07),
+    ("INDUSTRIA", 0.02),
+    ("PUBLICO/FILANTROPICO", 0.02),
+    ("residencial", 0.01),
+    (None, 0.01),
+)
+PROPORCAO_NAO_INCIDENCIA = 0.01
+ORIGENS_SINTETICAS = ("JUDICIAL", "ADMINISTRATIVO", "LEI")
+
+
+class BaseNaoSintetica(Exception):
+    """O banco tem uma vw_uso_imovel_por_inscricao real; o gerador não a substitui."""
+
+
+def _preparar_view(conn):
+    """Remove a view sintética anterior ou a tabela vazia que a migração 1 criava em bancos antigos.
+
+    BaseNaoSintetica se a view for outra ou a tabela tiver dados.
+    """
+    atual = conn.execute(text("""
+        SELECT c.relkind, CASE WHEN c.relkind = 'v' THEN pg_get_viewdef(c.oid) END
+        FROM pg_class c
+        WHERE c.oid = to_regclass('tlp.vw_uso_imovel_por_inscricao')
+    """)).fetchone()
+    if atual is None:
+        return
+    relkind, definicao = atual
+    if relkind == 'v' and TABELA_SINTETICA in (definicao or ""):
+        conn.execute(text("DROP VIEW tlp.vw_uso_imovel_por_inscricao"))
+    elif relkind == 'r' and conn.execute(text("SELECT NOT EXISTS (SELECT 1 FROM tlp.vw_uso_imovel_por_inscricao)")).scalar():
+        conn.execute(text("DROP TABLE tlp.vw_uso_imovel_por_inscricao"))
+    else:
+        raise BaseNaoSintetica(
+            "tlp.vw_uso_imovel_por_inscricao tem dados que não são da base sintética: use um banco dedicado aos benchmarks"
+        )
+
+
+def _caso_uso():
+    """CASE que sorteia o uso pela faixa do hash (0..9999), conforme MIX_USOS."""
+    faixas, acumulado = [], 0.0
+    for uso, proporcao in MIX_USOS:
+        acumulado += proporcao
+        valor = "NULL" if uso is None else f"'{uso}'"
+        faixas.append(f"WHEN h < {round(acumulado * 10000)} THEN {valor}")
+    return "CASE " + " ".join(faixas) + " END"
+
+
+def gerar_base(n, semente=42, exercicio=EXERCICIO_BENCH, proporcao_nao_incidencia=PROPORCAO_NAO_INCIDENCIA):
+    """Gera N imóveis sintéticos, materializa a base e a não incidência. Retorna as contagens e a duração."""
+    aplicar_migracoes()
+    inicio = time.perf_counter()
+
+    with engine.begin() as conn:
+        _preparar_view(conn)
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA_BENCH}"))
+        conn.execute(text(f"DROP TABLE IF EXISTS {TABELA_SINTETICA}"))
+        conn.execute(text(f"""
+            CREATE TABLE {TABELA_SINTETICA} AS
+            SELECT lpad(i::text, 14, '0') AS codg_inscricao_lan,
+                   'CONTRIBUINTE SINTETICO ' || i AS nome_contribuinte_lan,
+                   uso AS uso_classificado,
+                   CASE uso WHEN 'COMERCIO' THEN 'COMERCIO VAREJISTA' WHEN 'SERVICO' THEN 'SERVICOS PRESTADOS'
+                            WHEN 'INDUSTRIA' THEN 'INDUSTRIA DE TRANSFORMACAO' END AS atividade_considerada,
+                   uso = 'SERVICO' AS tem_servico,
+                   uso = 'COMERCIO' AS tem_comercio,
+                   uso = 'INDUSTRIA' AS tem_industria,
+                   CASE WHEN uso IN ('COMERCIO', 'SERVICO', 'INDUSTRIA') THEN 1 + mod(h, 3) ELSE 0 END
+                       AS qtde_empresas_distintas,
+                   CASE WHEN uso IN ('COMERCIO', 'SERVICO', 'INDUSTRIA') THEN 1 + mod(h, 5) ELSE 0 END
+                       AS qtde_cnaes_distintos
+            FROM (
+                SELECT i, h, {_caso_uso()} AS uso
+                FROM (
+                    SELECT i, mod(abs(hashint8extended(i, :semente)), 10000)::integer AS h
+                    FROM generate_series(1, CAST(:n AS bigint)) AS i
+                ) sorteio
+            ) s
+        """), {"n": n, "semente": semente})
+        conn.execute(text(f"ALTER TABLE {TABELA_SINTETICA} ADD PRIMARY KEY (codg_inscricao_lan)"))
+        conn.execute(text(f"CREATE VIEW tlp.vw_uso_imovel_por_inscricao AS SELECT * FROM {TABELA_SINTETICA}"))
+
+    db = SessionLocal()
+    try:
+        versao = atualizar_base(db)
+        id_versao, total_imoveis = versao.id_versao, versao.total_imoveis
+
+        db.execute(text("DELETE FROM tlp.tlp_nao_incidencia WHERE exercicio = :ex"), {"ex": exercicio})
+        nao_incidencias = db.execute(text(f"""
+            INSERT INTO tlp.tlp_nao_incidencia
+                (id_nao_incidencia, codg_inscricao_lan, exercicio, motivo, origem, ativo, created_at)
+            SELECT gen_random_uuid(), codg_inscricao_lan, :ex, 'NAO INCIDENCIA SINTETICA',
+                   (CAST(:origens AS text[]))[1 + mod(h, 3)], true, now()
+            FROM (
+                SELECT codg_inscricao_lan,
+                       mod(abs(hashtextextended(codg_inscricao_lan, :semente + 1)), 10000)::integer AS h
+                FROM {TABELA_SINTETICA}
+            ) s
+            WHERE h < :limite
+        """), {
+            "ex": exercicio,
+            "semente": semente,
+            "origens": list(ORIGENS_SINTETICAS),
+            "limite": round(proporcao_nao_incidencia * 10000),
+        }).rowcount
+        db.commit()
+    finally:
+        db.close()
+
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE tlp.tlp_base_imovel"))
+        conn.execute(text("ANALYZE tlp.tlp_nao_incidencia"))
+
+    return {
+        "imoveis": total_imoveis,
+        "nao_incidencias": nao_incidencias,
+        "id_versao": id_versao,
+        "segundos": round(time.perf_counter() - inicio, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera a base sintética de imóveis dos benchmarks")
+    parser.add_argument("n", type=int, help="quantidade de imóveis")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--exercicio", type=int, default=EXERCICIO_BENCH)
+    args = parser.parse_args()
+    print(gerar_base(args.n, args.semente, args.exercicio))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Escrita em massa via COPY FROM STDIN (PostgreSQL).
+
+Substitui o INSERT parametrizado (executemany), que no psycopg2 custa uma ida
+ao banco por linha, por um único COPY por batch a partir de um buffer em memória.
+"""
+import io
+import uuid
+
+COLUNAS_SIMULACAO_ITEM = (
+    "id_item",
+    "id_simulacao",
+    "codg_inscricao_lan",
+    "nome_contribuinte",
+    "uso_classificado",
+    "atividade_considerada",
+    "fator_uso",
+    "tlp_bruta",
+    "tlp_calculada",
+    "nao_incidencia",
+    "motivo_nao_incidencia",
+)
+
+# Caracteres com significado especial no formato texto do COPY
+_ESCAPES_COPY = str.maketrans({
+    "\\": "\\\\",
+    "\t": "\\t",
+    "\n": "\\n",
+    "\r": "\\r",
+})
+
+
+def _valor_copy(valor):
+    """Converte um valor Python para o formato texto do COPY."""
+    if valor is None:
+        return "\\N"
+    if valor is True:
+        return "t"
+    if valor is False:
+        return "f"
+    if isinstance(valor, str):
+        return valor.translate(_ESCAPES_COPY)
+    return str(valor)
+
+
+def montar_buffer_copy(linhas):
+    """Serializa uma sequência de tuplas em um buffer texto pronto para o COPY."""
+    buffer = io.StringIO()
+    for linha in linhas:
+        buffer.write("\t".join(_valor_copy(v) for v in linha))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+def copiar_buffer(db, tabela, colunas, buffer):
+    """Executa COPY tabela (colunas) FROM STDIN com um buffer já serializado.
+
+    Usa a transação corrente da sessão e não faz commit: quem chama decide o limite da transação.
+    """
+    raw_conn = db.connection().connection
+    cursor = raw_conn.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {tabela} ({', '.join(colunas)}) FROM STDIN WITH (FORMAT text)",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+def copiar_linhas(db, tabela, colunas, linhas):
+    """Serializa e envia as linhas com um único COPY. Retorna a quantidade de linhas enviadas."""
+    linhas = list(linhas)
+    if not linhas:
+        return 0
+
+    copiar_buffer(db, tabela, colunas, montar_buffer_copy(linhas))
+    return len(linhas)
+
+
+def montar_buffer_itens_simulacao(id_simulacao, itens):
+    """Serializa itens calculados para o COPY de tlp.tlp_simulacao_item. Retorna (buffer, quantidade).
+
+    `itens` são tuplas na ordem de COLUNAS_SIMULACAO_ITEM sem as duas primeiras
+    colunas (id_item e id_simulacao), que são preenchidas aqui.
+    """
+    id_simulacao = str(id_simulacao)
+    linhas = [(str(uuid.uuid4()), id_simulacao) + tuple(item) for item in itens]
+    return montar_buffer_copy(linhas), len(linhas)
+
+
+def copiar_itens_simulacao(db, id_simulacao, itens):
+    """Grava itens calculados em tlp.tlp_simulacao_item via COPY."""
+    buffer, quantidade = montar_buffer_itens_simulacao(id_simulacao, itens)
+    if quantidade:
+        copiar_buffer(db, "tlp.tlp_simulacao_item", COLUNAS_SIMULACAO_ITEM, buffer)
+    return quantidade
@@ -0,0 +1,127 @@
+"""Cache em processo das listagens com ETag (GET /parametros, /simulacoes, /lotes, /lotes/ultimo/{exercicio}).
+
+Essas tabelas só mudam pelos poucos pontos de escrita do backend. Cada resposta é
+guardada já serializada, com um ETag (hash do corpo), por até CACHE_TTL segundos e
+no máximo CACHE_MAX_ENTRADAS entradas (LRU). Os pontos de escrita chamam
+invalidar_cache() com o grupo afetado após o commit; o TTL limita a defasagem
+quando a escrita acontece em outro processo (worker separado, `python -m worker`).
+
+Com If-None-Match igual ao ETag atual a resposta é 304, sem corpo e, num acerto
+de cache, sem consulta ao banco. Contadores de acertos/faltas por grupo em
+GET /cache/estatisticas.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+
+CACHE_TTL = float(os.getenv("TLP_CACHE_TTL_SEGUNDOS", "30"))
+CACHE_MAX_ENTRADAS = int(os.getenv("TLP_CACHE_MAX_ENTRADAS", "256"))
+
+CACHE_PARAMETROS = 'parametros'
+CACHE_SIMULACOES = 'simulacoes'
+CACHE_LOTES = 'lotes'
+
+
+class CacheRespostas:
+    """Respostas JSON serializadas por chave (grupo, ...), com TTL, limite de entradas e contadores.
+
+    Cada grupo tem uma geração, incrementada na invalidação: uma resposta calculada
+    antes de uma invalidação não é guardada depois dela.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_entradas=CACHE_MAX_ENTRADAS):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()  # chave -> (expira_em, corpo, etag)
+        self._geracoes = {}
+        self._contadores = {}
+        self._lock = threading.Lock()
+
+    def _contar(self, grupo, evento):
+        contadores = self._contadores.setdefault(
+            grupo, {"acertos": 0, "faltas": 0, "invalidacoes": 0, "descartes": 0}
+        )
+        contadores[evento] += 1
+
+    async def obter(self, chave, gerar):
+        """(corpo, etag) da chave; em falta, aguarda gerar() (corrotina) e serializa o resultado."""
+        grupo = chave[0]
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None and entrada[0] > agora:
+                self._entradas.move_to_end(chave)
+                self._contar(grupo, "acertos")
+                return entrada[1], entrada[2]
+            self._contar(grupo, "faltas")
+            geracao = self._geracoes.get(grupo, 0)
+
+        corpo = json.dumps(
+            jsonable_encoder(await gerar()), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+        etag = f'"{hashlib.sha1(corpo).hexdigest()}"'
+
+        with self._lock:
+            if self._geracoes.get(grupo, 0) == geracao:
+                self._entradas[chave] = (time.monotonic() + self.ttl, corpo, etag)
+                self._entradas.move_to_end(chave)
+                while len(self._entradas) > self.max_entradas:
+                    chave_antiga, _ = self._entradas.popitem(last=False)
+                    self._contar(chave_antiga[0], "descartes")
+        return corpo, etag
+
+    def invalidar(self, *grupos):
+        with self._lock:
+            for grupo in grupos:
+                self._geracoes[grupo] = self._geracoes.get(grupo, 0) + 1
+                self._contar(grupo, "invalidacoes")
+                for chave in [chave for chave in self._entradas if chave[0] == grupo]:
+                    del self._entradas[chave]
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                "ttl_segundos": self.ttl,
+                "max_entradas": self.max_entradas,
+                "entradas": len(self._entradas),
+                "grupos": {grupo: dict(contadores) for grupo, contadores in self._contadores.items()},
+            }
+
+
+_cache = CacheRespostas()
+
+
+def invalidar_cache(*grupos):
+    """Descarta as respostas dos grupos (CACHE_PARAMETROS, CACHE_SIMULACOES, CACHE_LOTES)."""
+    _cache.invalidar(*grupos)
+
+
+def estatisticas_cache():
+    return _cache.estatisticas()
+
+
+def _etag_confere(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etags = [valor.strip() for valor in if_none_match.split(",")]
+    return any((valor[2:] if valor.startswith("W/") else valor) == etag for valor in etags)
+
+
+async def resposta_em_cache(request, chave, gerar):
+    """Response JSON da chave (via cache), ou 304 se o If-None-Match do cliente confere com o ETag.
+
+    gerar: função assíncrona sem argumentos que consulta o banco em caso de falta.
+    """
+    corpo, etag = await _cache.obter(chave, gerar)
+    cabecalhos = {"ETag": etag, "Cache-Control": "no-cache"}  # no-cache: o navegador sempre revalida
+    if _etag_confere(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cabecalhos)
+    return Response(content=corpo, media_type="application/json", headers=cabecalhos)
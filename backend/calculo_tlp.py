@@ -0,0 +1,324 @@
+"""Kernel vetorizado do cálculo da TLP.
+
+Recebe um batch inteiro em colunas (arrays) e devolve os valores calculados
+também em colunas, prontos para a escrita em massa. Toda a aritmética monetária
+é feita em centavos inteiros (ponto fixo), sem Decimal nem float por linha:
+
+    tlp_bruta     = custo_final / total_imoveis × fator_uso
+    tlp_calculada = 0 se isento, senão tlp_bruta limitada a [limite_min, limite_max]
+
+O arredondamento é half-up para centavos, o mesmo que o PostgreSQL aplica ao
+gravar o valor exato em NUMERIC(18, 2).
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+
+# Fatores por tipo de uso
+FATORES_USO = {
+    'RESIDENCIAL': 1.0,
+    'SERVICO': 1.2,
+    'COMERCIO': 1.5,
+    'INDUSTRIA': 2.0,
+    'PUBLICO/FILANTROPICO': 0,
+    'PUBLICO': 0,
+    'FILANTROPICO': 0
+}
+FATOR_USO_PADRAO = 1.0
+USO_PADRAO = 'RESIDENCIAL'
+
+# Usos isentos por padrão (propriedade pública/filantrópica)
+USOS_ISENTOS = ('PUBLICO', 'FILANTROPICO', 'PUBLICO/FILANTROPICO')
+MOTIVO_USO_ISENTO = 'PROPRIEDADE PÚBLICA/FILANTRÓPICA'
+
+
+def para_centavos(valor):
+    """Converte um valor monetário (float, str ou Decimal) para centavos inteiros (half-up)."""
+    return int((Decimal(str(valor or 0)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def fator_centesimos(fator):
+    """Converte um fator de uso (ex.: 1.2) para centésimos inteiros (ex.: 120)."""
+    return para_centavos(fator)
+
+
+def centavos_para_texto(centavos):
+    """Formata um array de centavos como texto decimal ('1234.56'), para COPY ou JSON."""
+    return [f"{'-' if c < 0 else ''}{abs(c) // 100}.{abs(c) % 100:02d}" for c in np.asarray(centavos).tolist()]
+
+
+def parametros_do_snapshot(params):
+    """Extrai (custo_final, limite_min, limite_max) em centavos do parametros_snapshot."""
+    params = params or {}
+    custo_final = params.get('custo_final', 0) or params.get('custo_tlp_base', 0)
+    return (
+        para_centavos(custo_final),
+        para_centavos(params.get('limite_min_atualizado', 258)),
+        para_centavos(params.get('limite_max_atualizado', 1600.08)),
+    )
+
+
+def normalizar_uso(uso):
+    """Uso vazio/nulo vira RESIDENCIAL; comparação sempre em maiúsculas."""
+    return (uso or USO_PADRAO).upper()
+
+
+class TabelaIsencoes:
+    """Inscrições com não incidência no exercício, ordenadas para busca vetorizada."""
+
+    def __init__(self, isentas):
+        """`isentas` é um dict {codg_inscricao_lan: motivo}."""
+        codigos = sorted(isentas)
+        self.codigos = np.array(codigos, dtype=str)
+        self.motivos = np.array([isentas[c] for c in codigos], dtype=object)
+
+    def __len__(self):
+        return len(self.codigos)
+
+    def buscar(self, codigos):
+        """Retorna (mascara_isento, motivos) para um array de inscrições."""
+        n = len(codigos)
+        if len(self.codigos) == 0 or n == 0:
+            return np.zeros(n, dtype=bool), np.full(n, None, dtype=object)
+
+        posicoes = np.searchsorted(self.codigos, codigos)
+        posicoes = np.minimum(posicoes, len(self.codigos) - 1)
+        encontrado = self.codigos[posicoes] == codigos
+        motivos = np.where(encontrado, self.motivos[posicoes], None)
+        return encontrado, motivos
+
+
+class ResultadoLote:
+    """Colunas calculadas de um batch (todas com o mesmo comprimento)."""
+
+    __slots__ = ('codigos', 'usos', 'fator_centesimos', 'tlp_bruta_centavos',
+                 'tlp_calculada_centavos', 'nao_incidencia', 'motivos')
+
+    def __init__(self, codigos, usos, fator_centesimos, tlp_bruta_centavos,
+                 tlp_calculada_centavos, nao_incidencia, motivos):
+        self.codigos = codigos
+        self.usos = usos
+        self.fator_centesimos = fator_centesimos
+        self.tlp_bruta_centavos = tlp_bruta_centavos
+        self.tlp_calculada_centavos = tlp_calculada_centavos
+        self.nao_incidencia = nao_incidencia
+        self.motivos = motivos
+
+    def __len__(self):
+        return len(self.codigos)
+
+
+def calcular_tlp_bruta_centavos(custo_final_centavos, total_imoveis, fatores_centesimos):
+    """TLP bruta em centavos: round_half_up(custo × fator / (100 × total)), em inteiros exatos."""
+    numerador = np.asarray(fatores_centesimos, dtype=np.int64) * np.int64(custo_final_centavos)
+    denominador = np.int64(100 * total_imoveis)
+    return (2 * numerador + denominador) // (2 * denominador)
+
+
+class ClassificacaoLote:
+    """Colunas de um batch que não dependem dos parâmetros da simulação."""
+
+    __slots__ = ('codigos', 'usos', 'fator_centesimos', 'nao_incidencia', 'motivos')
+
+    def __init__(self, codigos, usos, fator_centesimos, nao_incidencia, motivos):
+        self.codigos = codigos
+        self.usos = usos
+        self.fator_centesimos = fator_centesimos
+        self.nao_incidencia = nao_incidencia
+        self.motivos = motivos
+
+    def __len__(self):
+        return len(self.codigos)
+
+
+def classificar_lote(codigos, usos, isencoes=None):
+    """Uso normalizado, fator, não incidência e motivo de um batch (independem dos parâmetros).
+
+    codigos: sequência de codg_inscricao_lan
+    usos: sequência de uso_classificado (pode conter None)
+    isencoes: TabelaIsencoes do exercício (opcional)
+    """
+    codigos = np.asarray(codigos, dtype=str)
+    n = len(codigos)
+
+    # Normalização e fator calculados uma vez por valor distinto de uso, não por linha
+    usos_brutos = np.array(['' if u is None else u for u in usos], dtype=str)
+    distintos, inverso = np.unique(usos_brutos, return_inverse=True)
+    usos_distintos = [normalizar_uso(u) for u in distintos.tolist()]
+    fatores_distintos = np.array(
+        [fator_centesimos(FATORES_USO.get(u, FATOR_USO_PADRAO)) for u in usos_distintos],
+        dtype=np.int64
+    )
+    isento_distinto = np.array([u in USOS_ISENTOS for u in usos_distintos], dtype=bool)
+
+    usos_norm = np.array(usos_distintos, dtype=object)[inverso] if n else np.array([], dtype=object)
+    fatores = fatores_distintos[inverso] if n else np.array([], dtype=np.int64)
+    isento_uso = isento_distinto[inverso] if n else np.array([], dtype=bool)
+
+    if isencoes is not None:
+        isento_cadastro, motivos = isencoes.buscar(codigos)
+    else:
+        isento_cadastro, motivos = np.zeros(n, dtype=bool), np.full(n, None, dtype=object)
+
+    # Uso público/filantrópico é isento; mantém o motivo cadastrado, se houver
+    sem_motivo = np.array([not m for m in motivos.tolist()], dtype=bool)
+    motivos = np.where(isento_uso & sem_motivo, MOTIVO_USO_ISENTO, motivos)
+
+    return ClassificacaoLote(
+        codigos=codigos,
+        usos=usos_norm,
+        fator_centesimos=fatores,
+        nao_incidencia=isento_cadastro | isento_uso,
+        motivos=motivos,
+    )
+
+
+def aplicar_parametros(classificacao, custo_final_centavos, total_imoveis,
+                       limite_min_centavos, limite_max_centavos):
+    """Calcula a TLP de um batch já classificado com um conjunto de parâmetros.
+
+    Uma mesma ClassificacaoLote pode ser aplicada a vários conjuntos (varredura.py).
+    """
+    if total_imoveis <= 0:
+        raise ValueError("total_imoveis deve ser positivo")
+
+    tlp_bruta = calcular_tlp_bruta_centavos(custo_final_centavos, total_imoveis, classificacao.fator_centesimos)
+
+    # max(min, min(max, bruta)): se os limites vierem invertidos, prevalece o mínimo
+    tlp_limitada = np.maximum(limite_min_centavos, np.minimum(limite_max_centavos, tlp_bruta))
+    tlp_calculada = np.where(classificacao.nao_incidencia, 0, tlp_limitada)
+
+    return ResultadoLote(
+        codigos=classificacao.codigos,
+        usos=classificacao.usos,
+        fator_centesimos=classificacao.fator_centesimos,
+        tlp_bruta_centavos=tlp_bruta,
+        tlp_calculada_centavos=tlp_calculada,
+        nao_incidencia=classificacao.nao_incidencia,
+        motivos=classificacao.motivos,
+    )
+
+
+def calcular_lote(codigos, usos, custo_final_centavos, total_imoveis,
+                  limite_min_centavos, limite_max_centavos, isencoes=None):
+    """Calcula a TLP de um batch inteiro de imóveis.
+
+    codigos: sequência de codg_inscricao_lan
+    usos: sequência de uso_classificado (pode conter None)
+    isencoes: TabelaIsencoes do exercício (opcional)
+    """
+    if total_imoveis <= 0:
+        raise ValueError("total_imoveis deve ser positivo")
+
+    return aplicar_parametros(
+        classificar_lote(codigos, usos, isencoes),
+        custo_final_centavos, total_imoveis, limite_min_centavos, limite_max_centavos
+    )
+
+
+def linhas_para_copy(resultado, nomes, atividades):
+    """Monta as tuplas (sem id_item/id_simulacao) para bulk_copy.copiar_itens_simulacao."""
+    return zip(
+        resultado.codigos.tolist(),
+        nomes,
+        resultado.usos.tolist(),
+        atividades,
+        centavos_para_texto(resultado.fator_centesimos),
+        centavos_para_texto(resultado.tlp_bruta_centavos),
+        centavos_para_texto(resultado.tlp_calculada_centavos),
+        resultado.nao_incidencia.tolist(),
+        resultado.motivos.tolist(),
+    )
+
+
+def estatisticas_por_grupos(grupos, custo_final_centavos, total_imoveis,
+                            limite_min_centavos, limite_max_centavos):
+    """Estatísticas de uma simulação a partir de contagens agregadas, sem calcular item a item.
+
+    A TLP de um imóvel depende apenas do fator do seu uso e de ele ser isento, então
+    basta a contagem por (uso_classificado, isento por não incidência).
+    `grupos` é uma sequência de (uso_classificado, isento_cadastro, quantidade).
+    Retorna {"estatisticas": {...}, "por_uso": [...]} no formato de /resultado.
+    """
+    por_uso = {}
+    total_centavos = 0
+    total_isentos = 0
+    minimo = None
+    maximo = None
+
+    for uso_raw, isento_cadastro, quantidade in grupos:
+        if not quantidade:
+            continue
+        uso = normalizar_uso(uso_raw)
+        fator = fator_centesimos(FATORES_USO.get(uso, FATOR_USO_PADRAO))
+        isento = bool(isento_cadastro) or uso in USOS_ISENTOS
+        if isento:
+            valor = 0
+            total_isentos += quantidade
+        else:
+            bruta = int(calcular_tlp_bruta_centavos(custo_final_centavos, total_imoveis, [fator])[0])
+            valor = max(limite_min_centavos, min(limite_max_centavos, bruta))
+
+        minimo = valor if minimo is None else min(minimo, valor)
+        maximo = valor if maximo is None else max(maximo, valor)
+        total_centavos += valor * quantidade
+        acumulado = por_uso.setdefault(uso, [0, 0])
+        acumulado[0] += quantidade
+        acumulado[1] += valor * quantidade
+
+    return formatar_resumo(por_uso, total_centavos, minimo, maximo, total_isentos)
+
+
+def formatar_resumo(por_uso, total_centavos, minimo, maximo, total_isentos):
+    """Resumo no formato de /resultado a partir de totais em centavos.
+
+    por_uso: {uso: [quantidade, total_centavos]}
+    """
+    quantidade_total = sum(q for q, _ in por_uso.values())
+    return {
+        "estatisticas": {
+            "total_imoveis": quantidade_total,
+            "total_arrecadado": total_centavos / 100,
+            "media_tlp": (total_centavos / quantidade_total / 100) if quantidade_total else 0.0,
+            "min_tlp": (minimo or 0) / 100,
+            "max_tlp": (maximo or 0) / 100,
+            "total_isentos": total_isentos
+        },
+        "por_uso": [
+            {"uso": uso, "quantidade": quantidade, "total": total / 100}
+            for uso, (quantidade, total) in sorted(por_uso.items(), key=lambda item: item[0] or '')
+        ]
+    }
+
+
+class ResumoSimulacao:
+    """Acumula as estatísticas de /resultado batch a batch, durante o processamento."""
+
+    def __init__(self):
+        self.por_uso = {}
+        self.total_centavos = 0
+        self.total_isentos = 0
+        self.minimo = None
+        self.maximo = None
+
+    def adicionar(self, resultado):
+        if not len(resultado):
+            return
+        valores = resultado.tlp_calculada_centavos
+        self.total_centavos += int(valores.sum())
+        self.total_isentos += int(np.count_nonzero(resultado.nao_incidencia))
+        minimo, maximo = int(valores.min()), int(valores.max())
+        self.minimo = minimo if self.minimo is None else min(self.minimo, minimo)
+        self.maximo = maximo if self.maximo is None else max(self.maximo, maximo)
+
+        usos, inverso = np.unique(resultado.usos.astype(str), return_inverse=True)
+        quantidades = np.bincount(inverso, minlength=len(usos))
+        totais = np.zeros(len(usos), dtype=np.int64)  # inteiros exatos (bincount com pesos usa float)
+        np.add.at(totais, inverso, valores)
+        for uso, quantidade, total in zip(usos.tolist(), quantidades.tolist(), totais.tolist()):
+            acumulado = self.por_uso.setdefault(uso, [0, 0])
+            acumulado[0] += quantidade
+            acumulado[1] += total
+
+    def como_dict(self):
+        return formatar_resumo(self.por_uso, self.total_centavos, self.minimo, self.maximo, self.total_isentos)
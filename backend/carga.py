@@ -0,0 +1,182 @@
+"""Teste de carga dos endpoints de leitura, para comparar servidores lado a lado.
+
+Dispara `--concorrencia` clientes simultâneos contra cada URL durante `--duracao`
+segundos, sorteando entre os endpoints de leitura, e imprime requisições por
+segundo e latências (p50/p95/p99) por endpoint e por servidor. Com `--lento`, parte
+dos clientes fica repetindo um endpoint demorado (ex.: /resultado?recalcular=true
+ou /export), para medir quanto ele atrasa os endpoints baratos.
+
+Exemplo (API síncrona na 8001, assíncrona na 8000, mesma base):
+
+    python -m carga --url http://localhost:8001 --url http://localhost:8000 \\
+        --simulacao <id> --concorrencia 100 --duracao 20 --lento 10
+
+Cada cliente mantém uma conexão HTTP/1.1 keep-alive própria, com um cliente mínimo
+sobre asyncio: o gerador de carga gasta pouca CPU e não distorce a medição quando
+roda na mesma máquina que a API.
+"""
+import argparse
+import asyncio
+import random
+import time
+from urllib.parse import urlsplit
+
+
+def _endpoints(id_simulacao):
+    endpoints = ["/parametros", "/simulacoes", "/lotes"]
+    if id_simulacao:
+        endpoints += [
+            f"/simulacoes/{id_simulacao}/progresso",
+            f"/simulacoes/{id_simulacao}/resultado",
+            f"/simulacoes/{id_simulacao}/itens?limit=100",
+        ]
+    return endpoints
+
+
+def _percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+class _Conexao:
+    """Conexão HTTP/1.1 keep-alive que faz GETs e descarta o corpo (Content-Length ou chunked)."""
+
+    def __init__(self, url):
+        partes = urlsplit(url)
+        self.host = partes.hostname
+        self.porta = partes.port or 80
+        self.prefixo = partes.path.rstrip("/")
+        self.leitor = self.escritor = None
+
+    async def _abrir(self):
+        self.leitor, self.escritor = await asyncio.open_connection(self.host, self.porta)
+
+    def fechar(self):
+        if self.escritor is not None:
+            self.escritor.close()
+        self.leitor = self.escritor = None
+
+    async def get(self, caminho):
+        """Status da resposta; em qualquer erro de conexão, fecha e propaga."""
+        if self.escritor is None:
+            await self._abrir()
+        try:
+            self.escritor.write(
+                f"GET {self.prefixo}{caminho} HTTP/1.1\r\nHost: {self.host}\r\n\r\n".encode()
+            )
+            cabecalho = await self.leitor.readuntil(b"\r\n\r\n")
+            linhas = cabecalho.decode("latin-1").split("\r\n")
+            status = int(linhas[0].split(" ", 2)[1])
+            campos = {}
+            for linha in linhas[1:]:
+                if ":" in linha:
+                    nome, valor = linha.split(":", 1)
+                    campos[nome.strip().lower()] = valor.strip().lower()
+
+            if "content-length" in campos:
+                await self.leitor.readexactly(int(campos["content-length"]))
+            elif campos.get("transfer-encoding") == "chunked":
+                while True:
+                    tamanho = int((await self.leitor.readuntil(b"\r\n")).split(b";")[0], 16)
+                    await self.leitor.readexactly(tamanho + 2)
+                    if tamanho == 0:
+                        break
+            elif status not in (204, 304):
+                await self.leitor.read()
+                self.fechar()
+            if campos.get("connection") == "close":
+                self.fechar()
+            return status
+        except Exception:
+            self.fechar()
+            raise
+
+
+async def _cliente(url, caminhos, fim, medicoes, erros):
+    conexao = _Conexao(url)
+    try:
+        while time.monotonic() < fim:
+            caminho = random.choice(caminhos)
+            inicio = time.perf_counter()
+            try:
+                status = await conexao.get(caminho)
+            except (OSError, ValueError, asyncio.IncompleteReadError):
+                status = None
+            if status is None or status >= 400:
+                erros[caminho] = erros.get(caminho, 0) + 1
+                continue
+            medicoes.setdefault(caminho, []).append((time.perf_counter() - inicio) * 1000)
+    finally:
+        conexao.fechar()
+
+
+async def medir(url, endpoints, concorrencia, duracao, endpoint_lento=None, clientes_lentos=0):
+    """Executa a carga contra um servidor. Retorna {endpoint: {requisicoes, rps, p50, p95, p99, erros}}."""
+    medicoes, erros = {}, {}
+    # Aquecimento: caches preenchidos antes de medir
+    aquecimento = _Conexao(url)
+    for caminho in endpoints:
+        await aquecimento.get(caminho)
+    aquecimento.fechar()
+
+    fim = time.monotonic() + duracao
+    tarefas = [_cliente(url, endpoints, fim, medicoes, erros) for _ in range(concorrencia)]
+    if endpoint_lento:
+        tarefas += [_cliente(url, [endpoint_lento], fim, medicoes, erros) for _ in range(clientes_lentos)]
+    await asyncio.gather(*tarefas)
+
+    resultado = {}
+    for caminho in list(endpoints) + ([endpoint_lento] if endpoint_lento else []):
+        latencias = medicoes.get(caminho, [])
+        resultado[caminho] = {
+            "requisicoes": len(latencias),
+            "rps": len(latencias) / duracao,
+            "p50": _percentil(latencias, 50),
+            "p95": _percentil(latencias, 95),
+            "p99": _percentil(latencias, 99),
+            "erros": erros.get(caminho, 0),
+        }
+    return resultado
+
+
+def _ms(valor):
+    return "-" if valor is None else f"{valor:.1f}"
+
+
+def imprimir(resultados):
+    print(f"{'servidor':<28} {'endpoint':<52} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'erros':>6}")
+    for url, por_endpoint in resultados.items():
+        total = sum(m["rps"] for m in por_endpoint.values())
+        for caminho, m in por_endpoint.items():
+            print(f"{url:<28} {caminho[:52]:<52} {m['rps']:>8.1f} {_ms(m['p50']):>8} {_ms(m['p95']):>8} "
+                  f"{_ms(m['p99']):>8} {m['erros']:>6}")
+        print(f"{url:<28} {'TOTAL':<52} {total:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga dos endpoints de leitura da API TLP")
+    parser.add_argument("--url", action="append", required=True, help="URL base do servidor (repetir para comparar)")
+    parser.add_argument("--simulacao", help="id de uma simulação CONCLUIDA (inclui progresso, resultado e itens)")
+    parser.add_argument("--concorrencia", type=int, default=50)
+    parser.add_argument("--duracao", type=float, default=15)
+    parser.add_argument("--lento", type=int, default=0, help="clientes repetindo o endpoint demorado")
+    parser.add_argument("--endpoint-lento", help="padrão: /simulacoes/{simulacao}/resultado?recalcular=true")
+    args = parser.parse_args()
+
+    endpoint_lento = None
+    if args.lento:
+        endpoint_lento = args.endpoint_lento or f"/simulacoes/{args.simulacao}/resultado?recalcular=true"
+
+    resultados = {}
+    for url in args.url:
+        resultados[url] = asyncio.run(medir(
+            url.rstrip("/"), _endpoints(args.simulacao), args.concorrencia, args.duracao,
+            endpoint_lento, args.lento
+        ))
+    imprimir(resultados)
+
+
+if __name__ == "__main__":
+    main()
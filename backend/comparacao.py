@@ -0,0 +1,172 @@
+"""Comparação dos valores por imóvel entre uma simulação e uma referência.
+
+A referência é outra simulação processada ou um lote oficial (itens congelados em
+tlp_lote_item, ver lotes.py), tipicamente o lote do exercício anterior. Os dois
+conjuntos de itens são cruzados por codg_inscricao_lan em um único FULL JOIN no
+Postgres (merge/hash join sobre a partição da simulação e os itens do lote); nada
+é carregado no Python além do resultado:
+
+- comparar(): deltas agregados por uso e por faixa de variação, numa só passada
+  (GROUPING SETS);
+- diferencas_em_blocos(): as linhas alteradas, em streaming por cursor do lado do
+  servidor.
+
+Valores comparados: tlp_calculada. A simulação é o lado "a" (novo) e a referência
+o lado "b" (anterior): delta = a - b.
+"""
+from calculo_tlp import para_centavos
+from exportacao import ler_em_blocos
+
+TIPO_SIMULACAO = 'SIMULACAO'
+TIPO_LOTE = 'LOTE'
+
+# Faixas de variação, na ordem de apresentação (ver CASE em _PARES)
+FAIXAS_VARIACAO = (
+    'NOVO',               # Só na simulação
+    'REMOVIDO',           # Só na referência
+    'PASSOU_A_COBRAR',    # Referência 0, simulação > 0
+    'DEIXOU_DE_COBRAR',   # Referência > 0, simulação 0
+    'REDUCAO_ACIMA_10',
+    'REDUCAO_ATE_10',
+    'SEM_ALTERACAO',
+    'AUMENTO_ATE_10',
+    'AUMENTO_10_A_50',
+    'AUMENTO_ACIMA_50',
+)
+
+COLUNAS_DIFERENCAS = (
+    "codg_inscricao_lan",
+    "nome_contribuinte",
+    "uso_simulacao",
+    "uso_referencia",
+    "tlp_simulacao",
+    "tlp_referencia",
+    "delta",
+    "variacao_percentual",
+    "faixa",
+)
+
+_ORIGENS = {
+    TIPO_SIMULACAO: ("tlp.tlp_simulacao_item", "id_simulacao"),
+    TIPO_LOTE: ("tlp.tlp_lote_item", "id_lote"),
+}
+
+# Parâmetros no formato do psycopg2 (%(nome)s): a mesma consulta serve ao
+# cursor do lado do servidor de diferencas_em_blocos.
+_PARES = """
+    SELECT COALESCE(a.codg_inscricao_lan, b.codg_inscricao_lan) AS codg_inscricao_lan,
+           COALESCE(a.nome_contribuinte, b.nome_contribuinte) AS nome_contribuinte,
+           COALESCE(a.uso_classificado, b.uso_classificado) AS uso,
+           a.uso_classificado AS uso_a,
+           b.uso_classificado AS uso_b,
+           a.tlp_calculada AS valor_a,
+           b.tlp_calculada AS valor_b,
+           CASE
+               WHEN b.codg_inscricao_lan IS NULL THEN 'NOVO'
+               WHEN a.codg_inscricao_lan IS NULL THEN 'REMOVIDO'
+               WHEN a.tlp_calculada = b.tlp_calculada THEN 'SEM_ALTERACAO'
+               WHEN b.tlp_calculada = 0 THEN 'PASSOU_A_COBRAR'
+               WHEN a.tlp_calculada = 0 THEN 'DEIXOU_DE_COBRAR'
+               WHEN a.tlp_calculada < b.tlp_calculada * 0.9 THEN 'REDUCAO_ACIMA_10'
+               WHEN a.tlp_calculada < b.tlp_calculada THEN 'REDUCAO_ATE_10'
+               WHEN a.tlp_calculada <= b.tlp_calculada * 1.1 THEN 'AUMENTO_ATE_10'
+               WHEN a.tlp_calculada <= b.tlp_calculada * 1.5 THEN 'AUMENTO_10_A_50'
+               ELSE 'AUMENTO_ACIMA_50'
+           END AS faixa
+    FROM (
+        SELECT codg_inscricao_lan, nome_contribuinte, uso_classificado,
+               COALESCE(tlp_calculada, 0) AS tlp_calculada
+        FROM tlp.tlp_simulacao_item
+        WHERE id_simulacao = %(a)s
+    ) a
+    FULL JOIN (
+        SELECT codg_inscricao_lan, nome_contribuinte, uso_classificado,
+               COALESCE(tlp_calculada, 0) AS tlp_calculada
+        FROM {tabela_b}
+        WHERE {coluna_b} = %(b)s
+    ) b ON a.codg_inscricao_lan = b.codg_inscricao_lan
+"""
+
+
+def _pares(tipo_referencia):
+    tabela, coluna = _ORIGENS[tipo_referencia]
+    return _PARES.format(tabela_b=tabela, coluna_b=coluna)
+
+
+def resolver_referencia(db, id_referencia):
+    """(tipo, objeto) da referência: simulação ou lote com o id informado, ou (None, None)."""
+    from models import TlpSimulacao, TlpLoteLancamento
+
+    sim = db.query(TlpSimulacao).filter(TlpSimulacao.id_simulacao == id_referencia).first()
+    if sim:
+        return TIPO_SIMULACAO, sim
+    lote = db.query(TlpLoteLancamento).filter(TlpLoteLancamento.id_lote == id_referencia).first()
+    if lote:
+        return TIPO_LOTE, lote
+    return None, None
+
+
+def _totais(quantidade_a, quantidade_b, total_a, total_b, alterados, mudaram_uso):
+    centavos_a, centavos_b = para_centavos(total_a), para_centavos(total_b)
+    return {
+        "quantidade_simulacao": quantidade_a,
+        "quantidade_referencia": quantidade_b,
+        "total_simulacao": centavos_a / 100,
+        "total_referencia": centavos_b / 100,
+        "delta": (centavos_a - centavos_b) / 100,
+        "alterados": alterados,
+        "mudaram_uso": mudaram_uso,
+    }
+
+
+def comparar(db, id_simulacao, tipo_referencia, id_referencia):
+    """Deltas agregados (geral, por uso e por faixa de variação) em uma única consulta."""
+    consulta = f"""
+        WITH pares AS ({_pares(tipo_referencia)})
+        SELECT GROUPING(uso) AS sem_uso, GROUPING(faixa) AS sem_faixa, uso, faixa,
+               COUNT(valor_a), COUNT(valor_b),
+               COALESCE(SUM(valor_a), 0), COALESCE(SUM(valor_b), 0),
+               COUNT(*) FILTER (WHERE faixa <> 'SEM_ALTERACAO'),
+               COUNT(*) FILTER (WHERE uso_a <> uso_b)
+        FROM pares
+        GROUP BY GROUPING SETS ((uso), (faixa), ())
+    """
+    linhas = db.connection().exec_driver_sql(
+        consulta, {"a": str(id_simulacao), "b": str(id_referencia)}
+    ).fetchall()
+
+    geral = _totais(0, 0, 0, 0, 0, 0)
+    por_uso, por_faixa = [], {}
+    for sem_uso, sem_faixa, uso, faixa, *valores in linhas:
+        totais = _totais(*valores)
+        if sem_uso and sem_faixa:
+            geral = totais
+        elif not sem_uso:
+            por_uso.append({"uso": uso, **totais})
+        else:
+            por_faixa[faixa] = {"faixa": faixa, **totais}
+
+    por_uso.sort(key=lambda item: item["uso"] or '')
+    return {
+        "totais": geral,
+        "por_uso": por_uso,
+        "por_faixa": [por_faixa[faixa] for faixa in FAIXAS_VARIACAO if faixa in por_faixa],
+    }
+
+
+def diferencas_em_blocos(id_simulacao, tipo_referencia, id_referencia, faixa=None):
+    """Blocos de linhas alteradas (COLUNAS_DIFERENCAS), ordenados por inscrição, opcionalmente de uma faixa."""
+    filtro = "faixa = %(faixa)s" if faixa else "faixa <> 'SEM_ALTERACAO'"
+    consulta = f"""
+        SELECT codg_inscricao_lan, nome_contribuinte, uso_a, uso_b, valor_a, valor_b,
+               COALESCE(valor_a, 0) - COALESCE(valor_b, 0),
+               ROUND((valor_a - valor_b) * 100 / NULLIF(valor_b, 0), 2),
+               faixa
+        FROM ({_pares(tipo_referencia)}) pares
+        WHERE {filtro}
+        ORDER BY codg_inscricao_lan
+    """
+    return ler_em_blocos(
+        consulta,
+        {"a": str(id_simulacao), "b": str(id_referencia), "faixa": faixa}
+    )
@@ -0,0 +1,5 @@
+import os
+
+# database.py cria os engines na importação (sem conectar). Os testes de unidade que
+# importam módulos do backend não usam o banco; a URL só precisa ser válida.
+os.environ.setdefault("DATABASE_URL", "postgresql+psycopg2://localhost/tlp_teste")
@@ -1,9 +1,13 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
+from metricas import instrumentar_engine
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -13,6 +17,7 @@ engine = create_engine(
     connect_args={"options": "-c client_encoding=utf8"}
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+instrumentar_engine(engine, "sync")
 
 Base = declarative_base()
 
@@ -22,3 +27,26 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# Caminho assíncrono (asyncpg) para os endpoints de leitura: não ocupam o threadpool
+# do FastAPI enquanto esperam o banco. Mesmo banco de DATABASE_URL, salvo se
+# ASYNC_DATABASE_URL for informada (ex.: opções de conexão que o asyncpg não aceita).
+def url_assincrona(url):
+    """postgresql[+driver]://... -> postgresql+asyncpg://..."""
+    return make_url(url).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or url_assincrona(DATABASE_URL)
+
+# Sem threads presas esperando o banco, o limite de requisições simultâneas passa a ser o pool
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=int(os.getenv("TLP_ASYNC_POOL_SIZE", "10")),
+    max_overflow=int(os.getenv("TLP_ASYNC_MAX_OVERFLOW", "20"))
+)
+instrumentar_engine(async_engine.sync_engine, "async")
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,165 @@
+"""Exportação completa dos itens de uma simulação (CSV, CSV gzip ou Parquet) em streaming.
+
+As linhas são lidas de um cursor do lado do servidor (psycopg2 named cursor) em
+uma conexão própria, em blocos de TAMANHO_BLOCO, e cada bloco é serializado e
+enviado antes de ler o próximo: a memória usada não depende do tamanho da
+simulação e, no CSV, o primeiro byte sai antes de a consulta terminar.
+
+Parquet requer o pacote opcional pyarrow.
+"""
+import csv
+import io
+import zlib
+
+from database import engine
+
+TAMANHO_BLOCO = 5000
+
+FORMATOS_EXPORTACAO = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "csv.gz": ("application/gzip", "csv.gz"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+COLUNAS_EXPORTACAO = (
+    "codg_inscricao_lan",
+    "nome_contribuinte",
+    "uso_classificado",
+    "atividade_considerada",
+    "fator_uso",
+    "tlp_bruta",
+    "tlp_calculada",
+    "nao_incidencia",
+    "motivo_nao_incidencia",
+)
+
+
+class FormatoIndisponivel(Exception):
+    """Formato que depende de um pacote opcional não instalado."""
+
+
+def ler_em_blocos(consulta, parametros, tamanho=TAMANHO_BLOCO):
+    """Gera blocos de até `tamanho` linhas de `consulta` (parâmetros %s) via cursor do lado do servidor."""
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor(name="tlp_leitura_em_blocos")
+        cursor.itersize = tamanho
+        cursor.execute(consulta, parametros)
+        while True:
+            bloco = cursor.fetchmany(tamanho)
+            if not bloco:
+                break
+            yield bloco
+        cursor.close()
+        conn.rollback()
+    finally:
+        conn.close()
+
+
+def _ler_blocos(id_simulacao):
+    # Ordenado pelo índice de inscrição da partição: sem ordenação prévia, as linhas saem já no início
+    return ler_em_blocos(
+        f"""
+        SELECT {", ".join(COLUNAS_EXPORTACAO)}
+        FROM tlp.tlp_simulacao_item
+        WHERE id_simulacao = %s
+        ORDER BY codg_inscricao_lan
+        """,
+        (str(id_simulacao),)
+    )
+
+
+def csv_em_blocos(colunas, blocos):
+    """Serializa os blocos de linhas em CSV (utf-8), um pedaço de bytes por bloco, após o cabeçalho."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, lineterminator="\n")
+    escritor.writerow(colunas)
+    for bloco in blocos:
+        escritor.writerows(bloco)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _csv_em_blocos(id_simulacao):
+    return csv_em_blocos(COLUNAS_EXPORTACAO, _ler_blocos(id_simulacao))
+
+
+def comprimir_gzip(blocos):
+    compressor = zlib.compressobj(level=6, wbits=31)  # wbits=31: formato gzip
+    for bloco in blocos:
+        dados = compressor.compress(bloco)
+        if dados:
+            yield dados
+    yield compressor.flush()
+
+
+class _Vazao(io.RawIOBase):
+    """Arquivo somente-escrita cujo conteúdo é retirado em pedaços por quem gera a resposta."""
+
+    def __init__(self):
+        self.pedacos = []
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self.pedacos.append(bytes(dados))
+        return len(dados)
+
+    def retirar(self):
+        dados = b"".join(self.pedacos)
+        self.pedacos = []
+        return dados
+
+
+def _esquema_parquet(pa):
+    return pa.schema([
+        ("codg_inscricao_lan", pa.string()),
+        ("nome_contribuinte", pa.string()),
+        ("uso_classificado", pa.string()),
+        ("atividade_considerada", pa.string()),
+        ("fator_uso", pa.decimal128(5, 2)),
+        ("tlp_bruta", pa.decimal128(18, 2)),
+        ("tlp_calculada", pa.decimal128(18, 2)),
+        ("nao_incidencia", pa.bool_()),
+        ("motivo_nao_incidencia", pa.string()),
+    ])
+
+
+def _parquet_em_blocos(id_simulacao):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    esquema = _esquema_parquet(pa)
+    vazao = _Vazao()
+    # Um row group por bloco lido; o rodapé (metadados) sai no fechamento
+    escritor = pq.ParquetWriter(vazao, esquema, compression="snappy")
+    try:
+        for bloco in _ler_blocos(id_simulacao):
+            colunas = list(zip(*bloco))
+            escritor.write_table(pa.Table.from_arrays(
+                [pa.array(valores, type=campo.type) for valores, campo in zip(colunas, esquema)],
+                schema=esquema
+            ))
+            yield vazao.retirar()
+    finally:
+        escritor.close()
+    yield vazao.retirar()
+
+
+def exportar_itens(id_simulacao, formato):
+    """Gerador de bytes com todos os itens da simulação no formato pedido (chave de FORMATOS_EXPORTACAO)."""
+    if formato == "csv":
+        return _csv_em_blocos(id_simulacao)
+    if formato == "csv.gz":
+        return comprimir_gzip(_csv_em_blocos(id_simulacao))
+    if formato == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise FormatoIndisponivel("Exportação parquet requer o pacote pyarrow")
+        return _parquet_em_blocos(id_simulacao)
+    raise ValueError(f"Formato inválido: {formato}")
@@ -0,0 +1,279 @@
+"""Lotes de lançamento oficiais: itens congelados e arquivo de remessa para arrecadação.
+
+Ao criar o lote, os itens da simulação de origem são copiados para tlp.tlp_lote_item
+com um único INSERT ... SELECT (congelar_itens): o lote deixa de depender da
+simulação. Em seguida um job GERAR_REMESSA (worker.py) gera o arquivo de remessa
+em streaming, confere os totais e grava no lote totais e checksum, passando o
+status de GERADO para PROCESSADO. Se a geração falhar (totais divergentes, valor
+que não cabe no layout, erro de banco, worker que parou de responder), o lote vai
+para ERRO_REMESSA com a mensagem em erro_remessa, e POST /lotes/{id}/remessa/gerar
+enfileira uma nova geração. O download (GET /lotes/{id}/remessa) gera o mesmo
+arquivo novamente, em streaming, a partir dos itens congelados.
+
+Layout da remessa (posicional, 150 caracteres por linha, CRLF, latin-1):
+
+    Header   (tipo 0): tipo(1) identificação(20) exercício(4) versão(3) data(8 AAAAMMDD)
+                       qtde registros(9) valor total em centavos(15) brancos
+    Detalhe  (tipo 1): tipo(1) sequencial(9) inscrição(20) contribuinte(60) uso(20)
+                       valor em centavos(15) brancos
+    Trailer  (tipo 9): tipo(1) qtde registros(9) valor total em centavos(15)
+                       checksum(8, CRC32 hexadecimal dos registros de detalhe) brancos
+
+Somente imóveis com TLP a cobrar (tlp_calculada > 0) entram no detalhe.
+"""
+import zlib
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from sqlalchemy import text
+
+from cache import CACHE_LOTES, invalidar_cache
+from calculo_tlp import para_centavos
+from database import engine
+from exportacao import ler_em_blocos
+
+TAMANHO_LINHA = 150
+FIM_LINHA = "\r\n"
+CODIFICACAO = "latin-1"
+IDENTIFICACAO_REMESSA = "REMESSA TLP"
+
+COLUNAS_LOTE_ITEM = (
+    "codg_inscricao_lan",
+    "nome_contribuinte",
+    "uso_classificado",
+    "atividade_considerada",
+    "fator_uso",
+    "tlp_bruta",
+    "tlp_calculada",
+    "nao_incidencia",
+    "motivo_nao_incidencia",
+)
+
+
+STATUS_ERRO_REMESSA = 'ERRO_REMESSA'
+
+
+class ErroRemessa(Exception):
+    """Inconsistência na geração da remessa (ex.: totais divergentes)."""
+
+
+def marcar_erro_remessa(conn, id_lote, mensagem):
+    """Lote ainda GERADO vai para ERRO_REMESSA com a mensagem (na transação de quem chama). Retorna se alterou."""
+    return conn.execute(
+        text("""
+            UPDATE tlp.tlp_lote_lancamento
+            SET status = :status, erro_remessa = :mensagem
+            WHERE id_lote = :id AND status = 'GERADO'
+        """),
+        {"id": str(id_lote), "status": STATUS_ERRO_REMESSA, "mensagem": mensagem}
+    ).rowcount > 0
+
+
+def congelar_itens(db, id_lote, id_simulacao):
+    """Copia os itens da simulação para o lote (INSERT ... SELECT, sem commit). Retorna a quantidade."""
+    colunas = ", ".join(COLUNAS_LOTE_ITEM)
+    return db.execute(
+        text(f"""
+            INSERT INTO tlp.tlp_lote_item (id_lote, {colunas})
+            SELECT :id_lote, {colunas}
+            FROM tlp.tlp_simulacao_item
+            WHERE id_simulacao = :id_simulacao
+        """),
+        {"id_lote": str(id_lote), "id_simulacao": str(id_simulacao)}
+    ).rowcount
+
+
+def totais_remessa(db, id_lote):
+    """(quantidade de registros, valor total em centavos) dos itens a cobrar do lote."""
+    quantidade, total = db.execute(
+        text("""
+            SELECT COUNT(*), COALESCE(SUM(tlp_calculada), 0)
+            FROM tlp.tlp_lote_item
+            WHERE id_lote = :id AND tlp_calculada > 0
+        """),
+        {"id": str(id_lote)}
+    ).fetchone()
+    return quantidade, para_centavos(total)
+
+
+def _campo(valor, tamanho):
+    """Texto alinhado à esquerda, completado com brancos e truncado no tamanho."""
+    texto = "" if valor is None else str(valor).replace("\r", " ").replace("\n", " ")
+    return texto[:tamanho].ljust(tamanho)
+
+
+def _numero(valor, tamanho):
+    texto = str(int(valor))
+    if len(texto) > tamanho:
+        raise ErroRemessa(f"Valor {valor} não cabe em {tamanho} posições")
+    return texto.zfill(tamanho)
+
+
+def _linha(conteudo):
+    return (conteudo.ljust(TAMANHO_LINHA) + FIM_LINHA).encode(CODIFICACAO, errors="replace")
+
+
+class ArquivoRemessa:
+    """Gera o arquivo de remessa de um lote em streaming (iterável de bytes).
+
+    O header usa os totais informados (calculados antes, por totais_remessa); ao
+    final da iteração, `registros`, `valor_gerado_centavos` e `checksum` contêm o
+    que foi efetivamente gerado, e o trailer é escrito com esses valores.
+    """
+
+    def __init__(self, lote, total_registros, valor_total_centavos, data_geracao):
+        self.lote = lote
+        self.total_registros = total_registros
+        self.valor_total_centavos = valor_total_centavos
+        self.data_geracao = data_geracao
+        self.registros = 0
+        self.valor_gerado_centavos = 0
+        self.checksum = None
+
+    def __iter__(self):
+        crc = 0
+        yield _linha(
+            "0"
+            + _campo(IDENTIFICACAO_REMESSA, 20)
+            + _numero(self.lote.exercicio, 4)
+            + _numero(self.lote.versao or 1, 3)
+            + self.data_geracao.astimezone(timezone.utc).strftime("%Y%m%d")
+            + _numero(self.total_registros, 9)
+            + _numero(self.valor_total_centavos, 15)
+        )
+
+        blocos = ler_em_blocos(
+            """
+            SELECT codg_inscricao_lan, nome_contribuinte, uso_classificado, tlp_calculada
+            FROM tlp.tlp_lote_item
+            WHERE id_lote = %s AND tlp_calculada > 0
+            ORDER BY codg_inscricao_lan
+            """,
+            (str(self.lote.id_lote),)
+        )
+        for bloco in blocos:
+            pedaco = []
+            for codg, nome, uso, valor in bloco:
+                self.registros += 1
+                valor_centavos = para_centavos(valor)
+                self.valor_gerado_centavos += valor_centavos
+                linha = _linha(
+                    "1"
+                    + _numero(self.registros, 9)
+                    + _campo(codg, 20)
+                    + _campo(nome, 60)
+                    + _campo(uso, 20)
+                    + _numero(valor_centavos, 15)
+                )
+                crc = zlib.crc32(linha, crc)
+                pedaco.append(linha)
+            yield b"".join(pedaco)
+
+        self.checksum = f"{crc:08X}"
+        yield _linha(
+            "9"
+            + _numero(self.registros, 9)
+            + _numero(self.valor_gerado_centavos, 15)
+            + self.checksum
+        )
+
+
+def arquivo_remessa(lote):
+    """Remessa de um lote já PROCESSADO, com os totais e a data gravados no processamento."""
+    return ArquivoRemessa(
+        lote,
+        lote.total_registros_remessa,
+        para_centavos(lote.valor_total_remessa),
+        lote.processado_em
+    )
+
+
+def nome_arquivo_remessa(lote):
+    return f"TLP_{lote.exercicio}_v{lote.versao or 1}.rem"
+
+
+def gerar_remessa(db, id_lote, deve_parar=None):
+    """Gera a remessa do lote e marca o lote como PROCESSADO (executado pelo worker).
+
+    Em caso de falha o lote vai para ERRO_REMESSA (exceto cancelamento, em que o
+    job foi reivindicado por outro worker) e a exceção é relançada para o job.
+    """
+    from models import TlpLoteLancamento
+    from processamento import ProcessamentoCancelado
+
+    lote = db.query(TlpLoteLancamento).filter(TlpLoteLancamento.id_lote == id_lote).first()
+    if not lote:
+        raise ErroRemessa("Lote não encontrado")
+    if lote.status != 'GERADO':
+        raise ErroRemessa(f"Lote com status {lote.status} não pode gerar remessa")
+
+    try:
+        return _gerar_e_conferir(db, lote, deve_parar)
+    except ProcessamentoCancelado:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        try:
+            with engine.begin() as conn:
+                marcar_erro_remessa(conn, id_lote, str(e))
+            invalidar_cache(CACHE_LOTES)
+        except Exception as erro_status:
+            print(f"Erro ao marcar falha da remessa do lote {id_lote}: {erro_status}")
+        raise
+
+
+def _gerar_e_conferir(db, lote, deve_parar):
+    """Gera o arquivo, confere header × detalhe e grava totais e checksum no lote."""
+    from processamento import ProcessamentoCancelado
+
+    total_registros, valor_total = totais_remessa(db, lote.id_lote)
+    # Não manter transação aberta durante a geração: fora da sessão, o lote não é
+    # expirado pelo commit e o header não dispara um novo SELECT (nova transação)
+    db.expunge(lote)
+    db.commit()
+
+    arquivo = ArquivoRemessa(lote, total_registros, valor_total, datetime.now(timezone.utc))
+    tamanho = 0
+    for pedaco in arquivo:
+        tamanho += len(pedaco)
+        if deve_parar is not None and deve_parar():
+            raise ProcessamentoCancelado("Geração de remessa cancelada")
+
+    if (arquivo.registros, arquivo.valor_gerado_centavos) != (total_registros, valor_total):
+        raise ErroRemessa(
+            f"Totais divergentes: header {total_registros}/{valor_total}, "
+            f"detalhe {arquivo.registros}/{arquivo.valor_gerado_centavos}"
+        )
+
+    if deve_parar is not None and deve_parar():
+        raise ProcessamentoCancelado("Geração de remessa cancelada")
+    # Só conclui se o lote continuar GERADO (ex.: job expirado já o levou a ERRO_REMESSA)
+    processado = db.execute(
+        text("""
+            UPDATE tlp.tlp_lote_lancamento
+            SET total_registros_remessa = :registros, valor_total_remessa = :valor,
+                checksum_remessa = :checksum, processado_em = :processado_em,
+                status = 'PROCESSADO', erro_remessa = NULL
+            WHERE id_lote = :id AND status = 'GERADO'
+        """),
+        {
+            "id": str(lote.id_lote),
+            "registros": arquivo.registros,
+            "valor": Decimal(arquivo.valor_gerado_centavos) / 100,
+            "checksum": arquivo.checksum,
+            "processado_em": arquivo.data_geracao,
+        }
+    ).rowcount
+    if not processado:
+        raise ProcessamentoCancelado("Lote não está mais GERADO")
+    db.commit()
+    invalidar_cache(CACHE_LOTES)
+
+    return {
+        "id_lote": str(lote.id_lote),
+        "total_registros": arquivo.registros,
+        "valor_total": arquivo.valor_gerado_centavos / 100,
+        "checksum": arquivo.checksum,
+        "tamanho_bytes": tamanho,
+    }
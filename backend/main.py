@@ -1,15 +1,42 @@
-from fastapi import FastAPI, Depends, HTTPException, Body
+from fastapi import FastAPI, Depends, HTTPException, Body, File, Request, Response, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import text, desc
-from database import get_db, Base, engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text, desc, select
+from sqlalchemy.exc import IntegrityError
+from database import get_db, get_async_db, engine, async_engine
+from processamento import ENGINES_PROCESSAMENTO
+from cache import CACHE_LOTES, CACHE_PARAMETROS, CACHE_SIMULACOES, estatisticas_cache, invalidar_cache, resposta_em_cache
+from migracoes import VERSAO_SCHEMA, versao_do_banco
+from metricas import TIPO_CONTEUDO, MetricasHTTP, exportar_metricas
+from progresso_sse import consultar_progresso, eventos_progresso
+from progresso import marcar_enfileirado, progresso_da_simulacao, remover as remover_progresso
+from particoes import remover_particao
+from resumo import calcular_resumo_itens, gravar_resumo, ler_resumo, remover_resumo
+from exportacao import FORMATOS_EXPORTACAO, FormatoIndisponivel, comprimir_gzip, csv_em_blocos, exportar_itens
+from comparacao import (
+    COLUNAS_DIFERENCAS, FAIXAS_VARIACAO, TIPO_LOTE, comparar, diferencas_em_blocos, resolver_referencia
+)
+from nao_incidencia import ErroImportacao, importar_nao_incidencia
+from lotes import STATUS_ERRO_REMESSA, arquivo_remessa, congelar_itens, nome_arquivo_remessa
+from base_imovel import buscar_imoveis, contagens_por_grupo, estatisticas_cache_imoveis, versao_atual
+from calculo_tlp import estatisticas_por_grupos, parametros_do_snapshot
+from worker import (
+    JOB_PROCESSAR_SIMULACAO, JOB_ATUALIZAR_BASE, JOB_GERAR_REMESSA, JOB_VARREDURA, enfileirar_job,
+    job_ativo_da_simulacao, job_ativo_do_lote, cancelar_jobs_da_simulacao, iniciar_worker_embutido
+)
+from varredura import ErroVarredura, montar_cenarios, resumo_sem_itens
 from pydantic import BaseModel
 # Importar models para registrar no Base.metadata
 import models
-from typing import Optional
+from typing import Dict, List, Optional, Union
 from decimal import Decimal
 from datetime import datetime, timezone
+import base64
+import json
 import os
+import uuid
 
 # WORKAROUND: Fix para erro de UnicodeDecodeError no Windows quando o path do projeto tem acentos (LANÇAMENTO)
 # O driver psycopg2/SQLAlchemy falha ao processar paths com caracteres não-ASCII em algumas configurações de locale.
@@ -31,58 +58,33 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricasHTTP)
 
 @app.on_event("startup")
 async def startup_db_check():
-    # Garantir que o schema e tabelas existam
+    # Só confere a versão do schema; o DDL é aplicado por `python -m migracoes` no deploy
     try:
         with engine.connect() as conn:
-            with conn.begin():
-                conn.execute(text("CREATE SCHEMA IF NOT EXISTS tlp"))
-        
-        # Cria as tabelas se não existirem
-        Base.metadata.create_all(bind=engine)
-        print("Schema e Tabelas verificados com sucesso.")
+            app.state.versao_schema = versao_do_banco(conn)
+        if app.state.versao_schema < VERSAO_SCHEMA:
+            print(
+                f"Schema do banco na versão {app.state.versao_schema}, esperada {VERSAO_SCHEMA}: "
+                f"execute `python -m migracoes`"
+            )
     except Exception as e:
-        print(f"Erro ao inicializar banco de dados: {e}")
+        print(f"Erro ao verificar a versão do schema: {e}")
 
-    # Migração de colunas (para tabelas existentes)
-    try:
-        with engine.connect() as conn:
-            with conn.begin():
-                columns = [
-                    ("ipca_percentual", "NUMERIC(5, 2)"),
-                    ("subsidio_percentual", "NUMERIC(5, 2)"),
-                    ("limite_min_base", "NUMERIC(10, 2)"),
-                    ("limite_max_base", "NUMERIC(10, 2)"),
-                    ("limite_min_atualizado", "NUMERIC(10, 2)"),
-                    ("limite_max_atualizado", "NUMERIC(10, 2)")
-                ]
-                for col_name, col_type in columns:
-                    try:
-                        conn.execute(text(f"ALTER TABLE tlp.tlp_parametros ADD COLUMN IF NOT EXISTS {col_name} {col_type}"))
-                    except Exception as e:
-                        print(f"Migration warning for {col_name}: {e}")
-            
-            # 2. Corrigir tipos das colunas (para evitar Overflow de Numeric(10,2))
-            with conn.begin():
-                alter_cols = [
-                    ("custo_tlp_base", "NUMERIC(18, 2)"),
-                    ("limite_min_base", "NUMERIC(18, 2)"),
-                    ("limite_max_base", "NUMERIC(18, 2)"),
-                    ("limite_min_atualizado", "NUMERIC(18, 2)"),
-                    ("limite_max_atualizado", "NUMERIC(18, 2)")
-                ]
-                for col, dtype in alter_cols:
-                    try:
-                        # Postgres syntax strict
-                        conn.execute(text(f"ALTER TABLE tlp.tlp_parametros ALTER COLUMN {col} TYPE {dtype}"))
-                    except Exception as ex:
-                        print(f"Type Fix Warning {col}: {ex}")
-
-            print("DB Migration checks completed.")
-    except Exception as e:
-        print(f"Startup DB Migration failed: {e}")
+    # Worker de jobs embutido (desative com TLP_WORKER_EMBUTIDO=0 ao rodar `python -m worker` à parte)
+    if os.getenv("TLP_WORKER_EMBUTIDO", "1") != "0":
+        app.state.parar_worker = iniciar_worker_embutido()
+
+
+@app.on_event("shutdown")
+async def shutdown_worker():
+    parar = getattr(app.state, "parar_worker", None)
+    if parar is not None:
+        parar.set()
+    await async_engine.dispose()
 
 
 # Schemas
@@ -119,32 +121,107 @@ def debug_db():
 def health_check(db: Session = Depends(get_db)):
     try:
         result = db.execute(text("SELECT 1"))
-        return {"status": "healthy", "database": "connected"}
+        return {
+            "status": "healthy",
+            "database": "connected",
+            "schema_versao": getattr(app.state, "versao_schema", None),
+            "schema_versao_esperada": VERSAO_SCHEMA
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/imoveis/{inscricao}")
 def get_imovel(inscricao: str, db: Session = Depends(get_db)):
     try:
-        from models import UsoImovel
-        
-        imovel = db.query(UsoImovel).filter(UsoImovel.codg_inscricao_lan == inscricao).first()
-        
-        if not imovel:
+        # Lê da base materializada (cache LRU por versão); sem versão gerada ainda, cai na view
+        id_versao, imoveis = buscar_imoveis(db, [inscricao])
+        if inscricao not in imoveis:
             raise HTTPException(status_code=404, detail="Imóvel não encontrado")
             
-        return imovel
+        return {**imoveis[inscricao], "id_versao": id_versao}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar imóvel: {str(e)}")
 
+MAX_IMOVEIS_BATCH = int(os.getenv("TLP_IMOVEIS_BATCH_MAX", "1000"))
+
+class ImoveisBatch(BaseModel):
+    inscricoes: List[str]
+
+@app.post("/imoveis/batch")
+def get_imoveis_batch(batch: ImoveisBatch, db: Session = Depends(get_db)):
+    """Busca várias inscrições de uma vez (uma consulta para as que não estão em cache).
+    
+    Retorna os imóveis encontrados na ordem pedida e a lista de inscrições não encontradas.
+    """
+    try:
+        if len(batch.inscricoes) > MAX_IMOVEIS_BATCH:
+            raise HTTPException(status_code=400, detail=f"Máximo de {MAX_IMOVEIS_BATCH} inscrições por requisição")
+        
+        id_versao, imoveis = buscar_imoveis(db, batch.inscricoes)
+        inscricoes = list(dict.fromkeys(batch.inscricoes))
+        return {
+            "id_versao": id_versao,
+            "imoveis": [imoveis[inscricao] for inscricao in inscricoes if inscricao in imoveis],
+            "nao_encontradas": [inscricao for inscricao in inscricoes if inscricao not in imoveis]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao buscar imóveis: {str(e)}")
+
+# ============== BASE DE IMÓVEIS (SNAPSHOT MATERIALIZADO) ==============
+@app.get("/base/versao")
+def get_versao_base(db: Session = Depends(get_db)):
+    """Versão ativa da base materializada de imóveis."""
+    try:
+        versao = versao_atual(db)
+        if not versao:
+            return {"id_versao": None, "total_imoveis": 0, "encontrado": False}
+        return {
+            "id_versao": versao.id_versao,
+            "total_imoveis": versao.total_imoveis,
+            "created_at": versao.created_at,
+            "concluido_em": versao.concluido_em,
+            "encontrado": True
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao buscar versão da base: {str(e)}")
+
+@app.post("/base/atualizar", status_code=202)
+def atualizar_base_imoveis(db: Session = Depends(get_db)):
+    """Enfileira a geração de uma nova versão da base a partir de vw_uso_imovel_por_inscricao."""
+    try:
+        from models import TlpJob
+        
+        em_andamento = db.query(TlpJob).filter(
+            TlpJob.tipo == JOB_ATUALIZAR_BASE,
+            TlpJob.status.in_(('PENDENTE', 'EXECUTANDO'))
+        ).first()
+        if em_andamento:
+            raise HTTPException(status_code=409, detail=f"Atualização da base já em andamento (job {em_andamento.id_job})")
+        
+        job = enfileirar_job(db, JOB_ATUALIZAR_BASE)
+        db.commit()
+        return {"message": "Atualização da base enfileirada", "id_job": str(job.id_job), "status": job.status}
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Erro ao enfileirar atualização da base: {str(e)}")
+
 @app.get("/parametros")
-def get_parametros(db: Session = Depends(get_db)):
+async def get_parametros(request: Request, db: AsyncSession = Depends(get_async_db)):
     try:
         from models import TlpParametros
         # Retorna o parametro ativo mais recente de cada exercício
         # Simplificação: retorna todos ordenados por exercício desc e versão desc
-        params = db.query(TlpParametros).order_by(desc(TlpParametros.exercicio), desc(TlpParametros.versao)).all()
-        return params
+        async def listar():
+            return (await db.execute(
+                select(TlpParametros).order_by(desc(TlpParametros.exercicio), desc(TlpParametros.versao))
+            )).scalars().all()
+        return await resposta_em_cache(request, (CACHE_PARAMETROS,), listar)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar parâmetros: {str(e)}")
 
@@ -171,6 +248,7 @@ def create_parametro(param: ParametroCreate, db: Session = Depends(get_db)):
     try:
         db.add(new_param)
         db.commit()
+        invalidar_cache(CACHE_PARAMETROS)
         db.refresh(new_param)
         return new_param
     except Exception as e:
@@ -191,28 +269,33 @@ class SimulacaoCreate(BaseModel):
     limite_max_atualizado: Optional[float] = 0
 
 @app.get("/simulacoes")
-def get_simulacoes(db: Session = Depends(get_db)):
+async def get_simulacoes(request: Request, db: AsyncSession = Depends(get_async_db)):
     try:
         from models import TlpSimulacao
-        return db.query(TlpSimulacao).order_by(desc(TlpSimulacao.created_at)).all()
+        async def listar():
+            return (await db.execute(select(TlpSimulacao).order_by(desc(TlpSimulacao.created_at)))).scalars().all()
+        return await resposta_em_cache(request, (CACHE_SIMULACOES,), listar)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar simulações: {str(e)}")
 
+def snapshot_da_simulacao(sim: SimulacaoCreate):
+    """Monta o snapshot diretamente do payload (desacoplado de TlpParametros)."""
+    return {
+        "custo_tlp_base": sim.custo_tlp_base,
+        "ipca_percentual": sim.ipca_percentual,
+        "subsidio_percentual": sim.subsidio_percentual,
+        "limite_min_base": sim.limite_min_base,
+        "limite_max_base": sim.limite_max_base,
+        "limite_min_atualizado": sim.limite_min_atualizado,
+        "limite_max_atualizado": sim.limite_max_atualizado
+    }
+
 @app.post("/simulacoes")
 def create_simulacao(sim: SimulacaoCreate, db: Session = Depends(get_db)):
     try:
         from models import TlpSimulacao
         
-        # Monta o snapshot diretamente do payload (desacoplado de TlpParametros)
-        snapshot = {
-            "custo_tlp_base": sim.custo_tlp_base,
-            "ipca_percentual": sim.ipca_percentual,
-            "subsidio_percentual": sim.subsidio_percentual,
-            "limite_min_base": sim.limite_min_base,
-            "limite_max_base": sim.limite_max_base,
-            "limite_min_atualizado": sim.limite_min_atualizado,
-            "limite_max_atualizado": sim.limite_max_atualizado
-        }
+        snapshot = snapshot_da_simulacao(sim)
         
         new_sim = TlpSimulacao(
             exercicio=sim.exercicio,
@@ -223,69 +306,108 @@ def create_simulacao(sim: SimulacaoCreate, db: Session = Depends(get_db)):
         
         db.add(new_sim)
         db.commit()
+        invalidar_cache(CACHE_SIMULACOES)
         db.refresh(new_sim)
         return new_sim
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Erro ao criar simulação: {str(e)}")
 
+@app.post("/simulacoes/preview")
+def preview_simulacao(sim: SimulacaoCreate, db: Session = Depends(get_db)):
+    """Prévia instantânea das estatísticas de /resultado, sem gravar itens.
+    
+    Calculada a partir das contagens por (uso, isento) da base, mantidas em cache.
+    """
+    try:
+        id_versao, grupos = contagens_por_grupo(db, sim.exercicio)
+        total_imoveis = sum(quantidade for _, _, quantidade in grupos)
+        if total_imoveis == 0:
+            raise HTTPException(status_code=400, detail="Nenhum imóvel encontrado na base")
+        
+        custo_final, limite_min, limite_max = parametros_do_snapshot(snapshot_da_simulacao(sim))
+        resultado = estatisticas_por_grupos(grupos, custo_final, total_imoveis, limite_min, limite_max)
+        resultado["id_versao_base"] = id_versao
+        return resultado
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao calcular prévia: {str(e)}")
+
 
 # ============== LOTES DE LANÇAMENTO ==============
 class LoteCreate(BaseModel):
     id_simulacao_origem: str
 
 @app.get("/lotes")
-def get_lotes(db: Session = Depends(get_db)):
+async def get_lotes(request: Request, db: AsyncSession = Depends(get_async_db)):
     try:
         from models import TlpLoteLancamento
-        return db.query(TlpLoteLancamento).order_by(desc(TlpLoteLancamento.created_at)).all()
+        async def listar():
+            return (await db.execute(select(TlpLoteLancamento).order_by(desc(TlpLoteLancamento.created_at)))).scalars().all()
+        return await resposta_em_cache(request, (CACHE_LOTES,), listar)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar lotes: {str(e)}")
 
+def ultimo_lote(db, exercicio):
+    """Limites do último lote do exercício (resposta de /lotes/ultimo/{exercicio})."""
+    from models import TlpLoteLancamento
+    
+    lote = db.query(TlpLoteLancamento).filter(
+        TlpLoteLancamento.exercicio == exercicio
+    ).order_by(desc(TlpLoteLancamento.versao)).first()
+    
+    if not lote:
+        # Retorna objeto vazio ao invés de None para evitar erros
+        return {
+            "exercicio": exercicio,
+            "versao": 0,
+            "limite_min_atualizado": 0,
+            "limite_max_atualizado": 0,
+            "ipca_percentual": 0,
+            "encontrado": False
+        }
+    
+    # Retorna os limites atualizados que servirão de base para o próximo ano
+    return {
+        "exercicio": lote.exercicio,
+        "versao": lote.versao,
+        "limite_min_atualizado": float(lote.parametros_snapshot.get("limite_min_atualizado", 0)) if lote.parametros_snapshot else 0,
+        "limite_max_atualizado": float(lote.parametros_snapshot.get("limite_max_atualizado", 0)) if lote.parametros_snapshot else 0,
+        "ipca_percentual": float(lote.parametros_snapshot.get("ipca_percentual", 0)) if lote.parametros_snapshot else 0,
+        "encontrado": True
+    }
+
 @app.get("/lotes/ultimo/{exercicio}")
-def get_ultimo_lote(exercicio: int, db: Session = Depends(get_db)):
+async def get_ultimo_lote(exercicio: int, request: Request, db: AsyncSession = Depends(get_async_db)):
     """Busca o último lote oficial de um exercício específico para usar como base para o próximo ano."""
     try:
-        from models import TlpLoteLancamento
-        
-        lote = db.query(TlpLoteLancamento).filter(
-            TlpLoteLancamento.exercicio == exercicio
-        ).order_by(desc(TlpLoteLancamento.versao)).first()
-        
-        if not lote:
-            # Retorna objeto vazio ao invés de None para evitar erros
-            return {
-                "exercicio": exercicio,
-                "versao": 0,
-                "limite_min_atualizado": 0,
-                "limite_max_atualizado": 0,
-                "ipca_percentual": 0,
-                "encontrado": False
-            }
-        
-        # Retorna os limites atualizados que servirão de base para o próximo ano
-        return {
-            "exercicio": lote.exercicio,
-            "versao": lote.versao,
-            "limite_min_atualizado": float(lote.parametros_snapshot.get("limite_min_atualizado", 0)) if lote.parametros_snapshot else 0,
-            "limite_max_atualizado": float(lote.parametros_snapshot.get("limite_max_atualizado", 0)) if lote.parametros_snapshot else 0,
-            "ipca_percentual": float(lote.parametros_snapshot.get("ipca_percentual", 0)) if lote.parametros_snapshot else 0,
-            "encontrado": True
-        }
+        return await resposta_em_cache(
+            request, (CACHE_LOTES, 'ultimo', exercicio), lambda: db.run_sync(ultimo_lote, exercicio)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar último lote: {str(e)}")
 
 @app.post("/lotes")
 def create_lote(lote: LoteCreate, db: Session = Depends(get_db)):
-    """Promove uma simulação para Lote de Lançamento Oficial."""
+    """Promove uma simulação para Lote de Lançamento Oficial.
+    
+    Os itens da simulação são congelados em tlp_lote_item (INSERT ... SELECT) na mesma
+    transação, e a geração da remessa é enfileirada (job GERAR_REMESSA → status PROCESSADO).
+    """
     try:
         from models import TlpSimulacao, TlpLoteLancamento
         import uuid
         
-        sim = db.query(TlpSimulacao).filter(TlpSimulacao.id_simulacao == uuid.UUID(lote.id_simulacao_origem)).first()
+        # FOR UPDATE: duas conversões simultâneas da mesma simulação passam uma de cada vez;
+        # a segunda já a vê CONVERTIDO_LOTE e não congela os itens de novo
+        sim = db.query(TlpSimulacao).filter(TlpSimulacao.id_simulacao == uuid.UUID(lote.id_simulacao_origem)).with_for_update().first()
         if not sim:
             raise HTTPException(status_code=404, detail="Simulação não encontrada")
         
+        if sim.status != 'CONCLUIDO':
+            raise HTTPException(status_code=400, detail="Somente simulações concluídas podem ser convertidas em lote")
+        
         # Verifica ultima versão para esse exercicio
         last_version = db.query(TlpLoteLancamento).filter(TlpLoteLancamento.exercicio == sim.exercicio).order_by(desc(TlpLoteLancamento.versao)).first()
         new_version = (last_version.versao + 1) if last_version else 1
@@ -297,12 +419,18 @@ def create_lote(lote: LoteCreate, db: Session = Depends(get_db)):
             parametros_snapshot=sim.parametros_snapshot,
             status='GERADO'
         )
+        db.add(new_lote)
+        db.flush()
+        
+        # Congela os valores por imóvel no lote (não dependem mais da simulação)
+        new_lote.total_itens = congelar_itens(db, new_lote.id_lote, sim.id_simulacao)
+        enfileirar_job(db, JOB_GERAR_REMESSA, parametros={"id_lote": str(new_lote.id_lote)})
         
         # Atualiza status da simulação
         sim.status = 'CONVERTIDO_LOTE'
         
-        db.add(new_lote)
         db.commit()
+        invalidar_cache(CACHE_LOTES, CACHE_SIMULACOES)
         db.refresh(new_lote)
         return new_lote
     except HTTPException:
@@ -312,6 +440,94 @@ def create_lote(lote: LoteCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Erro ao criar lote: {str(e)}")
 
 
+@app.post("/lotes/{id_lote}/remessa/gerar", status_code=202)
+def gerar_remessa_novamente(id_lote: str, db: Session = Depends(get_db)):
+    """Enfileira novamente a geração da remessa de um lote em ERRO_REMESSA (ou GERADO sem job ativo).
+    
+    Os itens congelados não mudam; o job refaz o arquivo e a conferência dos totais.
+    """
+    try:
+        from models import TlpLoteLancamento
+        
+        # FOR UPDATE: duas requisições simultâneas não enfileiram dois jobs
+        lote = db.query(TlpLoteLancamento).filter(TlpLoteLancamento.id_lote == id_lote).with_for_update().first()
+        if not lote:
+            raise HTTPException(status_code=404, detail="Lote não encontrado")
+        
+        if lote.status not in ('GERADO', STATUS_ERRO_REMESSA):
+            raise HTTPException(status_code=400, detail=f"Remessa do lote já foi gerada (status {lote.status})")
+        
+        job_ativo = job_ativo_do_lote(db, lote.id_lote)
+        if job_ativo:
+            raise HTTPException(status_code=409, detail=f"Remessa já está na fila de geração (job {job_ativo.id_job})")
+        
+        job = enfileirar_job(db, JOB_GERAR_REMESSA, parametros={"id_lote": str(lote.id_lote)})
+        lote.status = 'GERADO'
+        lote.erro_remessa = None
+        db.commit()
+        invalidar_cache(CACHE_LOTES)
+        
+        return {
+            "message": "Geração da remessa enfileirada",
+            "id_job": str(job.id_job),
+            "status": job.status
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Erro ao enfileirar remessa: {str(e)}")
+
+
+@app.get("/lotes/{id_lote}/remessa")
+def download_remessa(id_lote: str, db: Session = Depends(get_db)):
+    """Arquivo de remessa do lote (layout posicional descrito em lotes.py), gerado em streaming."""
+    try:
+        from models import TlpLoteLancamento
+        
+        lote = db.query(TlpLoteLancamento).filter(TlpLoteLancamento.id_lote == id_lote).first()
+        if not lote:
+            raise HTTPException(status_code=404, detail="Lote não encontrado")
+        
+        if lote.status == 'GERADO':
+            raise HTTPException(status_code=409, detail="Remessa ainda em geração")
+        
+        if lote.status == STATUS_ERRO_REMESSA:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Falha na geração da remessa: {lote.erro_remessa}. Gere novamente com POST /lotes/{id_lote}/remessa/gerar"
+            )
+        
+        if lote.checksum_remessa is None:
+            raise HTTPException(status_code=400, detail="Lote sem itens congelados (criado antes da remessa)")
+        
+        return StreamingResponse(
+            arquivo_remessa(lote),
+            media_type="text/plain; charset=latin-1",
+            headers={
+                "Content-Disposition": f'attachment; filename="{nome_arquivo_remessa(lote)}"',
+                "X-Checksum-Remessa": lote.checksum_remessa,
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao gerar remessa: {str(e)}")
+
+
+@app.get("/cache/estatisticas")
+def get_estatisticas_cache():
+    """Acertos, faltas, invalidações e descartes do cache de listagens (cache.py), por grupo, e do cache de imóveis."""
+    return {**estatisticas_cache(), "imoveis": estatisticas_cache_imoveis()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Métricas no formato texto do Prometheus (metricas.py): latência por rota, consultas e pool do banco,
+    processamento de simulações e caches. Valores deste processo."""
+    return PlainTextResponse(exportar_metricas(), media_type=TIPO_CONTEUDO)
+
+
 # ============== NÃO INCIDÊNCIA ==============
 class NaoIncidenciaCreate(BaseModel):
     codg_inscricao_lan: str
@@ -332,15 +548,25 @@ def create_nao_incidencia(ni: NaoIncidenciaCreate, db: Session = Depends(get_db)
     try:
         from models import TlpNaoIncidencia
         
-        new_ni = TlpNaoIncidencia(
-            codg_inscricao_lan=ni.codg_inscricao_lan,
-            exercicio=ni.exercicio,
-            motivo=ni.motivo,
-            origem=ni.origem,
-            ativo=True
-        )
+        # Uma por inscrição e exercício: se já existe, atualiza e reativa
+        new_ni = db.query(TlpNaoIncidencia).filter(
+            TlpNaoIncidencia.codg_inscricao_lan == ni.codg_inscricao_lan,
+            TlpNaoIncidencia.exercicio == ni.exercicio
+        ).first()
+        if new_ni:
+            new_ni.motivo = ni.motivo
+            new_ni.origem = ni.origem
+            new_ni.ativo = True
+        else:
+            new_ni = TlpNaoIncidencia(
+                codg_inscricao_lan=ni.codg_inscricao_lan,
+                exercicio=ni.exercicio,
+                motivo=ni.motivo,
+                origem=ni.origem,
+                ativo=True
+            )
+            db.add(new_ni)
         
-        db.add(new_ni)
         db.commit()
         db.refresh(new_ni)
         return new_ni
@@ -349,229 +575,219 @@ def create_nao_incidencia(ni: NaoIncidenciaCreate, db: Session = Depends(get_db)
         raise HTTPException(status_code=500, detail=f"Erro ao criar não incidência: {str(e)}")
 
 
+@app.post("/nao-incidencia/import")
+def importar_nao_incidencia_csv(arquivo: UploadFile = File(...), exercicio: Optional[int] = None,
+                                origem: Optional[str] = None, codificacao: str = "utf-8",
+                                db: Session = Depends(get_db)):
+    """Importa não incidências em massa a partir de um CSV (COPY + upsert, ver nao_incidencia.py).
+    
+    Tudo em uma transação; retorna inseridos, atualizados, inalterados e rejeitados
+    (com as primeiras linhas rejeitadas e o motivo). Reimportar o mesmo arquivo é idempotente.
+    """
+    try:
+        return importar_nao_incidencia(db, arquivo.file, exercicio=exercicio, origem=origem, codificacao=codificacao)
+    except ErroImportacao as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Erro ao importar não incidências: {str(e)}")
+
+
 # ============== PROCESSAMENTO DE SIMULAÇÃO (CÁLCULO TLP) ==============
 
-# Fatores por tipo de uso
-FATORES_USO = {
-    'RESIDENCIAL': 1.0,
-    'SERVICO': 1.2,
-    'COMERCIO': 1.5,
-    'INDUSTRIA': 2.0,
-    'PUBLICO/FILANTROPICO': 0,
-    'PUBLICO': 0,
-    'FILANTROPICO': 0
-}
-
-@app.post("/simulacoes/{id_simulacao}/processar")
-def processar_simulacao(id_simulacao: str, db: Session = Depends(get_db)):
-    """Processa a simulação: calcula TLP para cada imóvel e salva os resultados.
+@app.post("/simulacoes/{id_simulacao}/processar", status_code=202)
+def processar_simulacao(id_simulacao: str, engine: str = 'python', profundidade_fila: Optional[int] = None,
+                        perfil: bool = False, cprofile: bool = False, db: Session = Depends(get_db)):
+    """Enfileira o processamento da simulação e retorna imediatamente (202) com o id do job.
     
-    OTIMIZADO para baixo uso de memória:
-    - Usa yield_per para streaming de resultados
-    - Processa em batches de 1000 imóveis
-    - Commits parciais a cada batch
+    O cálculo é executado pelo worker (worker.py / processamento.py); o andamento
+    é acompanhado por /simulacoes/{id}/progresso ou /jobs/{id_job}.
+    engine=python (padrão) ou engine=sql (cálculo todo no banco).
+    profundidade_fila: batches em espera entre os estágios do pipeline (engine=python).
+    perfil: grava tempos por etapa e por batch em /simulacoes/{id}/perfil; cprofile inclui o dump do cProfile.
     """
     try:
-        from models import TlpSimulacao, TlpSimulacaoItem, TlpNaoIncidencia, UsoImovel
-        from decimal import Decimal
-        import gc
+        from models import TlpSimulacao
         
-        BATCH_SIZE = 1000  # Processar 1000 imóveis por vez
+        if engine not in ENGINES_PROCESSAMENTO:
+            raise HTTPException(status_code=400, detail=f"Engine inválida: {engine}. Use {', '.join(ENGINES_PROCESSAMENTO)}")
         
-        # 1. Buscar simulação
-        sim = db.query(TlpSimulacao).filter(TlpSimulacao.id_simulacao == id_simulacao).first()
+        # FOR UPDATE: requisições simultâneas para a mesma simulação (duplo clique) passam
+        # pela verificação do job ativo uma de cada vez; a segunda já vê o job da primeira
+        sim = db.query(TlpSimulacao).filter(TlpSimulacao.id_simulacao == id_simulacao).with_for_update().first()
         if not sim:
             raise HTTPException(status_code=404, detail="Simulação não encontrada")
         
-        if sim.status == 'CONCLUIDO':
+        if sim.status in ('CONCLUIDO', 'CONVERTIDO_LOTE'):
             raise HTTPException(status_code=400, detail="Simulação já foi processada")
         
-        # Atualiza status e salva timestamp de início
-        sim.status = 'EM_PROCESSAMENTO'
-        params = dict(sim.parametros_snapshot or {})
-        params['inicio_processamento'] = datetime.now(timezone.utc).isoformat()
-        sim.parametros_snapshot = params
-        db.commit()
+        job_ativo = job_ativo_da_simulacao(db, sim.id_simulacao)
+        if job_ativo:
+            raise HTTPException(status_code=409, detail=f"Simulação já está na fila de processamento (job {job_ativo.id_job})")
         
-        # 2. Extrair parâmetros do snapshot
-        params = sim.parametros_snapshot or {}
-        custo_final = Decimal(str(params.get('custo_final', 0) or params.get('custo_tlp_base', 0)))
-        limite_min = Decimal(str(params.get('limite_min_atualizado', 258)))
-        limite_max = Decimal(str(params.get('limite_max_atualizado', 1600.08)))
-        exercicio = sim.exercicio
+        if profundidade_fila is not None and profundidade_fila < 1:
+            raise HTTPException(status_code=400, detail="profundidade_fila deve ser >= 1")
         
-        # 3. Buscar não incidências do exercício (set para lookup O(1))
-        nao_incidencias_result = db.execute(
-            text("SELECT codg_inscricao_lan, motivo FROM tlp.tlp_nao_incidencia WHERE exercicio = :ex AND ativo = true"),
-            {"ex": exercicio}
-        ).fetchall()
-        inscricoes_isentas = {row[0]: row[1] for row in nao_incidencias_result}
-        del nao_incidencias_result  # Liberar memória
+        parametros_job = {"engine": engine}
+        if profundidade_fila is not None:
+            parametros_job["profundidade_fila"] = profundidade_fila
+        if perfil or cprofile:
+            parametros_job["perfil"] = True
+            parametros_job["cprofile"] = cprofile
+        job = enfileirar_job(db, JOB_PROCESSAR_SIMULACAO, sim.id_simulacao, parametros_job)
         
-        # 4. Contar total de imóveis (sem carregar na memória)
-        total_imoveis = db.execute(text("SELECT COUNT(*) FROM tlp.vw_uso_imovel_por_inscricao")).scalar()
+        # Status visível imediatamente para a listagem (o worker registra o início real)
+        sim.status = 'EM_PROCESSAMENTO'
+        marcar_enfileirado(db, sim.id_simulacao)
+        db.commit()
+        invalidar_cache(CACHE_SIMULACOES)
         
-        if total_imoveis == 0:
-            raise HTTPException(status_code=400, detail="Nenhum imóvel encontrado na base")
+        return {
+            "message": "Processamento enfileirado",
+            "id_job": str(job.id_job),
+            "status": job.status
+        }
+    except HTTPException:
+        raise
+    except IntegrityError:
+        # Índice único de job ativo por simulação (migração 10)
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Simulação já está na fila de processamento")
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Erro ao enfileirar processamento: {str(e)}")
+
+
+class VarreduraCreate(BaseModel):
+    exercicio: int
+    descricao: str
+    cenarios: Optional[List[Dict[str, Optional[float]]]] = None
+    base: Optional[Dict[str, Optional[float]]] = None
+    grade: Optional[Dict[str, Union[List[float], Dict[str, float]]]] = None
+    gravar_itens: bool = False
+
+@app.post("/simulacoes/varredura", status_code=202)
+def criar_varredura(varredura: VarreduraCreate, profundidade_fila: Optional[int] = None,
+                    db: Session = Depends(get_db)):
+    """Cria uma simulação por cenário e enfileira um único job que calcula todas (varredura.py).
+    
+    Cenários: lista de parâmetros (`cenarios`) ou grade (`grade`, com os demais campos
+    em `base`), em que cada campo é uma lista de valores ou {"inicio", "fim", "passo"}.
+    Os campos são os valores base (custo_tlp_base, ipca_percentual, subsidio_percentual,
+    limite_min_base, limite_max_base); custo final e limites atualizados são derivados
+    deles, como no formulário de simulações.
+    A base de imóveis é lida uma vez para todos os cenários. Cada simulação recebe o
+    resumo de /resultado; com gravar_itens=true recebe também os itens e termina
+    CONCLUIDO, senão fica em RASCUNHO, pronta para ser processada se escolhida.
+    O resultado do job (/jobs/{id_job}) traz as estatísticas de todos os cenários.
+    """
+    try:
+        from models import TlpSimulacao
         
-        # 5. Calcular TLP base por imóvel
-        tlp_base_por_imovel = custo_final / Decimal(total_imoveis)
+        if profundidade_fila is not None and profundidade_fila < 1:
+            raise HTTPException(status_code=400, detail="profundidade_fila deve ser >= 1")
         
-        # 6. Limpar itens anteriores (se reprocessando)
-        db.execute(
-            text("DELETE FROM tlp.tlp_simulacao_item WHERE id_simulacao = :id"),
-            {"id": str(sim.id_simulacao)}
-        )
-        db.commit()
+        try:
+            snapshots = montar_cenarios(varredura.cenarios, varredura.base, varredura.grade)
+        except ErroVarredura as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # 7. Processar em BATCHES usando SQL puro para economia de memória
-        itens_criados = 0
-        offset = 0
-        
-        while True:
-            # Buscar batch de imóveis via SQL direto (mais leve que ORM)
-            imoveis_batch = db.execute(
-                text("""
-                    SELECT codg_inscricao_lan, nome_contribuinte_lan, uso_classificado, atividade_considerada
-                    FROM tlp.vw_uso_imovel_por_inscricao
-                    ORDER BY codg_inscricao_lan
-                    LIMIT :limit OFFSET :offset
-                """),
-                {"limit": BATCH_SIZE, "offset": offset}
-            ).fetchall()
-            
-            if not imoveis_batch:
-                break  # Fim dos dados
-            
-            # Processar batch
-            batch_items = []
-            for row in imoveis_batch:
-                codg, nome, uso_raw, atividade = row[0], row[1], row[2], row[3]
-                uso = (uso_raw or 'RESIDENCIAL').upper()
-                fator = Decimal(str(FATORES_USO.get(uso, 1.0)))
-                
-                # TLP Bruta = Base × Fator
-                tlp_bruta = tlp_base_por_imovel * fator
-                
-                # Verificar não incidência
-                is_isento = codg in inscricoes_isentas
-                motivo_isencao = inscricoes_isentas.get(codg) if is_isento else None
-                
-                # Verificar se uso é público (isento por padrão)
-                if uso in ['PUBLICO', 'FILANTROPICO', 'PUBLICO/FILANTROPICO']:
-                    is_isento = True
-                    motivo_isencao = motivo_isencao or 'PROPRIEDADE PÚBLICA/FILANTRÓPICA'
-                
-                # Aplicar limites (min/max) - somente se não isento
-                if is_isento:
-                    tlp_calculada = Decimal('0')
-                else:
-                    tlp_calculada = max(limite_min, min(limite_max, tlp_bruta))
-                
-                batch_items.append({
-                    "id_simulacao": str(sim.id_simulacao),
-                    "codg_inscricao_lan": codg,
-                    "nome_contribuinte": nome,
-                    "uso_classificado": uso,
-                    "atividade_considerada": atividade,
-                    "fator_uso": float(fator),
-                    "tlp_bruta": float(tlp_bruta),
-                    "tlp_calculada": float(tlp_calculada),
-                    "nao_incidencia": is_isento,
-                    "motivo_nao_incidencia": motivo_isencao
-                })
-            
-            # Inserir batch via SQL bulk insert
-            if batch_items:
-                db.execute(
-                    text("""
-                        INSERT INTO tlp.tlp_simulacao_item 
-                        (id_item, id_simulacao, codg_inscricao_lan, nome_contribuinte, uso_classificado, 
-                         atividade_considerada, fator_uso, tlp_bruta, tlp_calculada, 
-                         nao_incidencia, motivo_nao_incidencia)
-                        VALUES (gen_random_uuid(), :id_simulacao, :codg_inscricao_lan, :nome_contribuinte, :uso_classificado,
-                                :atividade_considerada, :fator_uso, :tlp_bruta, :tlp_calculada,
-                                :nao_incidencia, :motivo_nao_incidencia)
-                    """),
-                    batch_items
-                )
-                db.commit()  # Commit parcial a cada batch
-                itens_criados += len(batch_items)
-            
-            # Atualizar offset para próximo batch
-            offset += BATCH_SIZE
-            
-            # Atualizar progresso na simulação
-            percentual = min(100, int((itens_criados / total_imoveis) * 100))
-            params_atualizado = dict(params)
-            params_atualizado['progresso_percentual'] = percentual
-            params_atualizado['itens_processados'] = itens_criados
-            params_atualizado['total_imoveis'] = total_imoveis
-            sim.parametros_snapshot = params_atualizado
-            db.commit()
-            
-            # Forçar garbage collection para liberar memória
-            del imoveis_batch, batch_items
-            gc.collect()
+        sims = [
+            TlpSimulacao(
+                exercicio=varredura.exercicio,
+                descricao=f"{varredura.descricao} (cenário {i} de {len(snapshots)})",
+                status='EM_PROCESSAMENTO' if varredura.gravar_itens else 'RASCUNHO',
+                parametros_snapshot=snapshot
+            )
+            for i, snapshot in enumerate(snapshots, start=1)
+        ]
+        db.add_all(sims)
+        db.flush()
         
-        # 8. Atualizar status da simulação
-        sim.status = 'CONCLUIDO'
+        parametros_job = {
+            "simulacoes": [str(sim.id_simulacao) for sim in sims],
+            "gravar_itens": varredura.gravar_itens
+        }
+        if profundidade_fila is not None:
+            parametros_job["profundidade_fila"] = profundidade_fila
+        job = enfileirar_job(db, JOB_VARREDURA, parametros=parametros_job)
+        if varredura.gravar_itens:
+            for sim in sims:
+                marcar_enfileirado(db, sim.id_simulacao)
         db.commit()
+        invalidar_cache(CACHE_SIMULACOES)
         
         return {
-            "message": "Simulação processada com sucesso",
-            "total_imoveis": total_imoveis,
-            "itens_criados": itens_criados
+            "message": f"Varredura de {len(sims)} cenário(s) enfileirada",
+            "id_job": str(job.id_job),
+            "status": job.status,
+            "cenarios": [
+                {"id_simulacao": str(sim.id_simulacao), "descricao": sim.descricao, "parametros": sim.parametros_snapshot}
+                for sim in sims
+            ]
         }
-        
     except HTTPException:
         raise
     except Exception as e:
         db.rollback()
-        # Tentar reverter status e salvar mensagem de erro
-        try:
-            sim = db.query(TlpSimulacao).filter(TlpSimulacao.id_simulacao == id_simulacao).first()
-            if sim:
-                sim.status = 'ERRO'
-                # Salvar erro detalhado no snapshot para exibição posterior
-                params = dict(sim.parametros_snapshot or {})
-                params['erro_mensagem'] = str(e)
-                params['erro_timestamp'] = datetime.now(timezone.utc).isoformat()
-                sim.parametros_snapshot = params
-                db.commit()
-        except:
-            pass
-        raise HTTPException(status_code=500, detail=f"Erro ao processar simulação: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Erro ao enfileirar varredura: {str(e)}")
 
 
-@app.get("/simulacoes/{id_simulacao}/progresso")
-def get_progresso_simulacao(id_simulacao: str, db: Session = Depends(get_db)):
-    """Retorna o progresso atual do processamento de uma simulação."""
+@app.get("/jobs/{id_job}")
+def get_job(id_job: str, db: Session = Depends(get_db)):
+    """Retorna o estado de um job de processamento."""
     try:
-        from models import TlpSimulacao
+        from models import TlpJob
         
-        sim = db.query(TlpSimulacao).filter(TlpSimulacao.id_simulacao == id_simulacao).first()
-        if not sim:
+        job = db.query(TlpJob).filter(TlpJob.id_job == id_job).first()
+        if not job:
+            raise HTTPException(status_code=404, detail="Job não encontrado")
+        return job
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao buscar job: {str(e)}")
+
+@app.get("/simulacoes/{id_simulacao}/progresso")
+async def get_progresso_simulacao(id_simulacao: str, db: AsyncSession = Depends(get_async_db)):
+    """Retorna o progresso atual do processamento de uma simulação.
+    
+    Para acompanhar em tempo real prefira /simulacoes/{id}/progresso/stream (SSE);
+    este endpoint continua disponível como alternativa por polling.
+    """
+    try:
+        progresso = await db.run_sync(progresso_da_simulacao, id_simulacao)
+        if progresso is None:
             raise HTTPException(status_code=404, detail="Simulação não encontrada")
-        
-        params = sim.parametros_snapshot or {}
-        return {
-            "status": sim.status,
-            "progresso_percentual": params.get('progresso_percentual', 0),
-            "itens_processados": params.get('itens_processados', 0),
-            "total_imoveis": params.get('total_imoveis', 0),
-            "concluido": sim.status == 'CONCLUIDO',
-            "erro": sim.status == 'ERRO',
-            "erro_mensagem": params.get('erro_mensagem', None),
-            "erro_timestamp": params.get('erro_timestamp', None),
-            "inicio_processamento": params.get('inicio_processamento', None)
-        }
+        return progresso
         
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar progresso: {str(e)}")
 
+@app.get("/simulacoes/{id_simulacao}/progresso/stream")
+async def stream_progresso_simulacao(id_simulacao: str):
+    """Progresso da simulação via Server-Sent Events (evento `progresso`, mesmo formato de /progresso).
+    
+    Envia um evento a cada mudança e encerra quando a simulação sai de EM_PROCESSAMENTO.
+    Todas as conexões da mesma simulação compartilham uma única consulta ao banco (progresso_sse.py).
+    """
+    try:
+        if await consultar_progresso(id_simulacao) is None:
+            raise HTTPException(status_code=404, detail="Simulação não encontrada")
+        
+        return StreamingResponse(
+            eventos_progresso(id_simulacao),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao acompanhar progresso: {str(e)}")
+
 @app.post("/simulacoes/{id_simulacao}/resetar")
 def resetar_simulacao(id_simulacao: str, db: Session = Depends(get_db)):
     """Reseta o status de uma simulação travada (EM_PROCESSAMENTO ou ERRO) para RASCUNHO.
@@ -581,7 +797,8 @@ def resetar_simulacao(id_simulacao: str, db: Session = Depends(get_db)):
     try:
         from models import TlpSimulacao
         
-        sim = db.query(TlpSimulacao).filter(TlpSimulacao.id_simulacao == id_simulacao).first()
+        # Trava a linha da simulação: a finalização do processamento espera o reset (ou vice-versa)
+        sim = db.query(TlpSimulacao).filter(TlpSimulacao.id_simulacao == id_simulacao).with_for_update().first()
         if not sim:
             raise HTTPException(status_code=404, detail="Simulação não encontrada")
         
@@ -591,15 +808,18 @@ def resetar_simulacao(id_simulacao: str, db: Session = Depends(get_db)):
         if sim.status == 'CONVERTIDO_LOTE':
             raise HTTPException(status_code=400, detail="Simulação já foi convertida em lote oficial.")
         
-        # Limpar itens parciais
-        db.execute(
-            text("DELETE FROM tlp.tlp_simulacao_item WHERE id_simulacao = :id"),
-            {"id": str(sim.id_simulacao)}
-        )
+        # Cancelar job em andamento (o worker interrompe no próximo heartbeat)
+        cancelar_jobs_da_simulacao(db, sim.id_simulacao)
+        
+        # Limpar itens parciais (remove a partição da simulação)
+        remover_particao(db, sim.id_simulacao)
+        remover_resumo(db, sim.id_simulacao)
+        remover_progresso(db, sim.id_simulacao)
         
         # Resetar status
         sim.status = 'RASCUNHO'
         db.commit()
+        invalidar_cache(CACHE_SIMULACOES)
         
         return {"message": "Simulação resetada para RASCUNHO", "id": id_simulacao}
         
@@ -610,35 +830,37 @@ def resetar_simulacao(id_simulacao: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Erro ao resetar simulação: {str(e)}")
 
 @app.get("/simulacoes/{id_simulacao}/resultado")
-def get_resultado_simulacao(id_simulacao: str, db: Session = Depends(get_db)):
-    """Retorna estatísticas do resultado da simulação."""
+async def get_resultado_simulacao(id_simulacao: str, recalcular: bool = False,
+                                  db: AsyncSession = Depends(get_async_db)):
+    """Retorna estatísticas do resultado da simulação.
+    
+    Lê o resumo gravado ao final do processamento (tlp_simulacao_resumo). Sem resumo
+    (simulações antigas ou ainda em processamento) ou com recalcular=true, agrega sobre
+    os itens; para simulações concluídas o resumo agregado é gravado para as próximas leituras.
+    Cenários de varredura ainda em RASCUNHO não têm itens: o resumo é sempre recalculado
+    das contagens atuais da base (em cache), com ou sem recalcular=true, para não servir
+    o de uma base já substituída.
+    """
     try:
-        from models import TlpSimulacao, TlpSimulacaoItem
-        from sqlalchemy import func as sqlfunc
+        from models import TlpSimulacao
         
         # Verificar se simulação existe
-        sim = db.query(TlpSimulacao).filter(TlpSimulacao.id_simulacao == id_simulacao).first()
+        sim = (await db.execute(select(TlpSimulacao).where(TlpSimulacao.id_simulacao == id_simulacao))).scalar()
         if not sim:
             raise HTTPException(status_code=404, detail="Simulação não encontrada")
         
-        # Estatísticas gerais
-        stats = db.query(
-            sqlfunc.count(TlpSimulacaoItem.id_item).label('total_imoveis'),
-            sqlfunc.sum(TlpSimulacaoItem.tlp_calculada).label('total_arrecadado'),
-            sqlfunc.avg(TlpSimulacaoItem.tlp_calculada).label('media_tlp'),
-            sqlfunc.min(TlpSimulacaoItem.tlp_calculada).label('min_tlp'),
-            sqlfunc.max(TlpSimulacaoItem.tlp_calculada).label('max_tlp'),
-            sqlfunc.sum(sqlfunc.cast(TlpSimulacaoItem.nao_incidencia, Integer)).label('total_isentos')
-        ).filter(TlpSimulacaoItem.id_simulacao == id_simulacao).first()
-        
-        # Distribuição por uso
-        por_uso = db.query(
-            TlpSimulacaoItem.uso_classificado,
-            sqlfunc.count(TlpSimulacaoItem.id_item).label('quantidade'),
-            sqlfunc.sum(TlpSimulacaoItem.tlp_calculada).label('total')
-        ).filter(
-            TlpSimulacaoItem.id_simulacao == id_simulacao
-        ).group_by(TlpSimulacaoItem.uso_classificado).all()
+        if sim.status == 'RASCUNHO':
+            # Só a varredura grava resumo de RASCUNHO; sem itens, recalcular é sempre pelas contagens
+            resultado = await db.run_sync(ler_resumo, sim.id_simulacao)
+            if resultado is not None:
+                resultado = await db.run_sync(resumo_sem_itens, sim)
+        else:
+            resultado = None if recalcular else await db.run_sync(ler_resumo, sim.id_simulacao)
+        if resultado is None:
+            resultado = await db.run_sync(calcular_resumo_itens, sim.id_simulacao)
+            if sim.status in ('CONCLUIDO', 'CONVERTIDO_LOTE'):
+                await db.run_sync(gravar_resumo, sim.id_simulacao, resultado, 'RECALCULO')
+                await db.commit()
         
         return {
             "simulacao": {
@@ -648,36 +870,248 @@ def get_resultado_simulacao(id_simulacao: str, db: Session = Depends(get_db)):
                 "status": sim.status,
                 "parametros": sim.parametros_snapshot
             },
-            "estatisticas": {
-                "total_imoveis": stats.total_imoveis or 0,
-                "total_arrecadado": float(stats.total_arrecadado or 0),
-                "media_tlp": float(stats.media_tlp or 0),
-                "min_tlp": float(stats.min_tlp or 0),
-                "max_tlp": float(stats.max_tlp or 0),
-                "total_isentos": stats.total_isentos or 0
-            },
-            "por_uso": [
-                {"uso": row.uso_classificado, "quantidade": row.quantidade, "total": float(row.total or 0)}
-                for row in por_uso
-            ]
+            "estatisticas": resultado["estatisticas"],
+            "por_uso": resultado["por_uso"]
         }
     except HTTPException:
         raise
     except Exception as e:
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Erro ao buscar resultado: {str(e)}")
 
 
+@app.get("/simulacoes/{id_simulacao}/perfil")
+async def get_perfil_simulacao(id_simulacao: str, formato: str = "json", db: AsyncSession = Depends(get_async_db)):
+    """Perfil da última execução processada com ?perfil=true (perfil.py).
+    
+    formato=json (padrão): tempos por etapa, séries por batch, CPU e pico de RSS.
+    formato=pstats: dump do cProfile (execuções com cprofile=true), para `python -m pstats` ou snakeviz.
+    """
+    try:
+        from models import TlpSimulacao, TlpSimulacaoPerfil
+        
+        if formato not in ("json", "pstats"):
+            raise HTTPException(status_code=400, detail=f"Formato inválido: {formato}. Use json ou pstats")
+        
+        sim = (await db.execute(select(TlpSimulacao).where(TlpSimulacao.id_simulacao == id_simulacao))).scalar()
+        if not sim:
+            raise HTTPException(status_code=404, detail="Simulação não encontrada")
+        
+        perfil = (await db.execute(
+            select(TlpSimulacaoPerfil)
+            .where(TlpSimulacaoPerfil.id_simulacao == sim.id_simulacao)
+            .order_by(desc(TlpSimulacaoPerfil.created_at))
+            .limit(1)
+        )).scalar()
+        if not perfil:
+            raise HTTPException(status_code=404, detail="Nenhuma execução com perfil. Processe com ?perfil=true")
+        
+        if formato == "pstats":
+            if perfil.cprofile is None:
+                raise HTTPException(status_code=404, detail="Execução sem cProfile. Processe com ?cprofile=true")
+            return Response(
+                content=perfil.cprofile,
+                media_type="application/octet-stream",
+                headers={"Content-Disposition": f'attachment; filename="perfil_{sim.id_simulacao}.prof"'}
+            )
+        
+        return {
+            "id_perfil": str(perfil.id_perfil),
+            "id_simulacao": str(perfil.id_simulacao),
+            "engine": perfil.engine,
+            "resultado": perfil.resultado,
+            "created_at": perfil.created_at,
+            **perfil.dados,
+            "cprofile_resumo": perfil.cprofile_resumo,
+            "cprofile_disponivel": perfil.cprofile is not None
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao buscar perfil: {str(e)}")
+
+
+@app.get("/simulacoes/{id_simulacao}/export")
+def exportar_simulacao(id_simulacao: str, format: str = "csv", db: Session = Depends(get_db)):
+    """Exporta todos os itens da simulação em streaming (format=csv, csv.gz ou parquet).
+    
+    As linhas vêm de um cursor do lado do servidor (exportacao.py): memória constante
+    qualquer que seja o tamanho da simulação. Parquet requer o pacote opcional pyarrow.
+    """
+    try:
+        from models import TlpSimulacao
+        
+        if format not in FORMATOS_EXPORTACAO:
+            raise HTTPException(status_code=400, detail=f"Formato inválido: {format}. Use {', '.join(FORMATOS_EXPORTACAO)}")
+        
+        sim = db.query(TlpSimulacao).filter(TlpSimulacao.id_simulacao == id_simulacao).first()
+        if not sim:
+            raise HTTPException(status_code=404, detail="Simulação não encontrada")
+        
+        if sim.status not in ('CONCLUIDO', 'CONVERTIDO_LOTE'):
+            raise HTTPException(status_code=400, detail="Simulação ainda não foi processada")
+        
+        try:
+            conteudo = exportar_itens(sim.id_simulacao, format)
+        except FormatoIndisponivel as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        media_type, extensao = FORMATOS_EXPORTACAO[format]
+        return StreamingResponse(
+            conteudo,
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="simulacao_{sim.exercicio}_{sim.id_simulacao}.{extensao}"'}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao exportar simulação: {str(e)}")
+
+
+@app.get("/simulacoes/{id_simulacao}/diff/{id_referencia}")
+def diff_simulacao(id_simulacao: str, id_referencia: str, linhas: bool = False, faixa: Optional[str] = None,
+                   format: str = "csv", db: Session = Depends(get_db)):
+    """Compara os valores por imóvel da simulação com outra simulação ou com um lote (comparacao.py).
+    
+    Por padrão retorna os deltas agregados por uso e por faixa de variação. Com linhas=true,
+    transmite em streaming (format=csv ou csv.gz) as inscrições alteradas, opcionalmente de uma faixa.
+    """
+    try:
+        from models import TlpSimulacao
+        
+        if linhas and format not in ("csv", "csv.gz"):
+            raise HTTPException(status_code=400, detail="Formato inválido para linhas: use csv ou csv.gz")
+        if faixa is not None and faixa not in FAIXAS_VARIACAO:
+            raise HTTPException(status_code=400, detail=f"Faixa inválida: {faixa}. Use {', '.join(FAIXAS_VARIACAO)}")
+        
+        sim = db.query(TlpSimulacao).filter(TlpSimulacao.id_simulacao == id_simulacao).first()
+        if not sim:
+            raise HTTPException(status_code=404, detail="Simulação não encontrada")
+        if sim.status not in ('CONCLUIDO', 'CONVERTIDO_LOTE'):
+            raise HTTPException(status_code=400, detail="Simulação ainda não foi processada")
+        
+        tipo, referencia = resolver_referencia(db, id_referencia)
+        if referencia is None:
+            raise HTTPException(status_code=404, detail="Referência não encontrada (simulação ou lote)")
+        if tipo == TIPO_LOTE:
+            if referencia.total_itens is None:
+                raise HTTPException(status_code=400, detail="Lote sem itens congelados (criado antes da remessa)")
+            id_ref = referencia.id_lote
+        else:
+            if referencia.status not in ('CONCLUIDO', 'CONVERTIDO_LOTE'):
+                raise HTTPException(status_code=400, detail="Simulação de referência ainda não foi processada")
+            id_ref = referencia.id_simulacao
+        
+        if linhas:
+            conteudo = csv_em_blocos(
+                COLUNAS_DIFERENCAS, diferencas_em_blocos(sim.id_simulacao, tipo, id_ref, faixa)
+            )
+            if format == "csv.gz":
+                conteudo = comprimir_gzip(conteudo)
+            media_type, extensao = FORMATOS_EXPORTACAO[format]
+            return StreamingResponse(
+                conteudo,
+                media_type=media_type,
+                headers={"Content-Disposition": f'attachment; filename="diff_{sim.id_simulacao}_{id_ref}.{extensao}"'}
+            )
+        
+        return {
+            "id_simulacao": str(sim.id_simulacao),
+            "referencia": {
+                "tipo": tipo,
+                "id": str(id_ref),
+                "exercicio": referencia.exercicio,
+                "versao": getattr(referencia, "versao", None),
+            },
+            **comparar(db, sim.id_simulacao, tipo, id_ref)
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao comparar simulação: {str(e)}")
+
+
+CAMPOS_ITEM = (
+    "id_item", "codg_inscricao_lan", "nome_contribuinte", "uso_classificado", "atividade_considerada",
+    "fator_uso", "tlp_bruta", "tlp_calculada", "nao_incidencia", "motivo_nao_incidencia", "created_at"
+)
+
+
+def codificar_cursor(tlp_calculada, id_item):
+    """Cursor opaco (base64) com a posição (tlp_calculada, id_item) do último item da página."""
+    bruto = json.dumps([str(tlp_calculada), str(id_item)]).encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor):
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        tlp_calculada, id_item = json.loads(bruto)
+        return Decimal(tlp_calculada), uuid.UUID(id_item)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
 @app.get("/simulacoes/{id_simulacao}/itens")
-def get_itens_simulacao(id_simulacao: str, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Lista itens calculados de uma simulação (paginado)."""
+async def get_itens_simulacao(id_simulacao: str, limit: int = 100, cursor: Optional[str] = None,
+                              uso: Optional[str] = None, nao_incidencia: Optional[bool] = None,
+                              prefixo: Optional[str] = None, campos: Optional[str] = None,
+                              db: AsyncSession = Depends(get_async_db)):
+    """Lista itens calculados de uma simulação, do maior para o menor tlp_calculada.
+    
+    Paginação por cursor: passe o `proximo_cursor` da resposta anterior em `cursor`
+    (null na última página). Ordem (tlp_calculada, id_item) decrescente, atendida pelo
+    índice ix_tlp_simulacao_item_ordem sem ordenar a simulação inteira.
+    Filtros: uso (uso_classificado), nao_incidencia, prefixo (início da inscrição).
+    campos: lista separada por vírgulas das colunas desejadas (padrão: todas).
+    """
     try:
         from models import TlpSimulacaoItem
+        from sqlalchemy import tuple_
+        
+        if limit < 1 or limit > 1000:
+            raise HTTPException(status_code=400, detail="limit deve estar entre 1 e 1000")
         
-        itens = db.query(TlpSimulacaoItem).filter(
+        if campos:
+            selecionados = [c.strip() for c in campos.split(",") if c.strip()]
+            invalidos = [c for c in selecionados if c not in CAMPOS_ITEM]
+            if invalidos:
+                raise HTTPException(status_code=400, detail=f"Campos inválidos: {', '.join(invalidos)}. Use {', '.join(CAMPOS_ITEM)}")
+        else:
+            selecionados = list(CAMPOS_ITEM)
+        
+        # Colunas do cursor sempre lidas, mesmo fora da projeção
+        colunas = list(dict.fromkeys(selecionados + ["tlp_calculada", "id_item"]))
+        query = select(*[getattr(TlpSimulacaoItem, c) for c in colunas]).where(
             TlpSimulacaoItem.id_simulacao == id_simulacao
-        ).order_by(TlpSimulacaoItem.tlp_calculada.desc()).offset(skip).limit(limit).all()
+        )
+        if uso:
+            query = query.where(TlpSimulacaoItem.uso_classificado == uso.upper())
+        if nao_incidencia is not None:
+            query = query.where(TlpSimulacaoItem.nao_incidencia == nao_incidencia)
+        if prefixo:
+            query = query.where(TlpSimulacaoItem.codg_inscricao_lan.startswith(prefixo, autoescape=True))
+        if cursor:
+            tlp_calculada, id_item = decodificar_cursor(cursor)
+            query = query.where(
+                tuple_(TlpSimulacaoItem.tlp_calculada, TlpSimulacaoItem.id_item) < tuple_(tlp_calculada, id_item)
+            )
+        
+        linhas = (await db.execute(query.order_by(
+            TlpSimulacaoItem.tlp_calculada.desc(), TlpSimulacaoItem.id_item.desc()
+        ).limit(limit + 1))).all()
+        
+        proximo_cursor = None
+        if len(linhas) > limit:
+            linhas = linhas[:limit]
+            proximo_cursor = codificar_cursor(linhas[-1].tlp_calculada, linhas[-1].id_item)
         
-        return itens
+        return {
+            "itens": [{c: getattr(linha, c) for c in selecionados} for linha in linhas],
+            "proximo_cursor": proximo_cursor
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar itens: {str(e)}")
 
@@ -0,0 +1,307 @@
+"""Métricas da API e do processamento no formato texto do Prometheus (GET /metrics).
+
+Registro em processo, sem dependências: contadores, medidores e histogramas com
+rótulos, protegidos por lock. Fontes:
+
+- MetricasHTTP (middleware ASGI): latência e quantidade de requisições por
+  método, rota (o template, ex. /simulacoes/{id_simulacao}/itens) e status.
+  A duração vai até o fim do corpo, incluindo respostas em streaming;
+- instrumentar_engine(): eventos do SQLAlchemy para quantidade, tempo e erros de
+  consultas, e o estado do pool (em uso, overflow, livres) lido a cada coleta.
+  COPY e cursores nomeados, que usam o cursor psycopg2 direto, não passam pelos eventos;
+- processamento.py / progresso.py: itens e batches gravados, segundos por fase
+  e por estágio do pipeline, execuções por resultado e vazão da última execução;
+- caches de cache.py e base_imovel.py.
+
+Com o worker em processo separado, as métricas de processamento ficam nele:
+`TLP_WORKER_METRICAS_PORTA=9101 python -m worker` expõe /metrics nessa porta.
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import event
+
+TIPO_CONTEUDO = "text/plain; version=0.0.4; charset=utf-8"
+
+BUCKETS_HTTP = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BUCKETS_CONSULTA = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0)
+
+_registro = []
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _rotulos(nomes, valores, extra=()):
+    pares = list(zip(nomes, valores)) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{nome}="{_escapar(valor)}"' for nome, valor in pares) + "}"
+
+
+def _numero(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._lock = threading.Lock()
+        _registro.append(self)
+
+    def _chave(self, rotulos):
+        return tuple(str(rotulos[nome]) for nome in self.rotulos)
+
+    def _amostras(self):
+        raise NotImplementedError
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        linhas += [f"{nome}{rotulos} {_numero(valor)}" for nome, rotulos, valor in self._amostras()]
+        return linhas
+
+
+class _MetricaSimples(_Metrica):
+    """Um valor por combinação de rótulos; com `coletar`, os valores são lidos a cada exportação.
+
+    coletar: função sem argumentos que retorna [(valores dos rótulos, valor)].
+    """
+
+    def __init__(self, nome, ajuda, rotulos=(), coletar=None):
+        super().__init__(nome, ajuda, rotulos)
+        self._valores = {}
+        self._coletar = coletar
+
+    def _amostras(self):
+        if self._coletar is not None:
+            valores = {tuple(str(v) for v in chave): valor for chave, valor in self._coletar()}
+        else:
+            with self._lock:
+                valores = dict(self._valores)
+        return [(self.nome, _rotulos(self.rotulos, chave), valor) for chave, valor in sorted(valores.items())]
+
+
+class Contador(_MetricaSimples):
+    tipo = "counter"
+
+    def inc(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+
+class Medidor(_MetricaSimples):
+    tipo = "gauge"
+
+    def set(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._valores[chave] = valor
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nome, ajuda, rotulos=(), buckets=BUCKETS_HTTP):
+        super().__init__(nome, ajuda, rotulos)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # chave -> [contagens por bucket..., soma, quantidade]
+
+    def observe(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = [0] * len(self.buckets) + [0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[i] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def _amostras(self):
+        with self._lock:
+            series = {chave: list(serie) for chave, serie in self._series.items()}
+        amostras = []
+        for chave, serie in sorted(series.items()):
+            for limite, contagem in zip(self.buckets, serie):
+                amostras.append((f"{self.nome}_bucket", _rotulos(self.rotulos, chave, [("le", _numero(float(limite)))]), contagem))
+            amostras.append((f"{self.nome}_bucket", _rotulos(self.rotulos, chave, [("le", "+Inf")]), serie[-1]))
+            amostras.append((f"{self.nome}_sum", _rotulos(self.rotulos, chave), serie[-2]))
+            amostras.append((f"{self.nome}_count", _rotulos(self.rotulos, chave), serie[-1]))
+        return amostras
+
+
+def exportar_metricas():
+    """Todas as métricas registradas, no formato texto do Prometheus."""
+    linhas = []
+    for metrica in list(_registro):
+        try:
+            linhas += metrica.exportar()
+        except Exception as e:
+            print(f"Falha ao coletar métrica {metrica.nome}: {e}")
+    return "\n".join(linhas) + "\n"
+
+
+# ============== HTTP ==============
+
+REQUISICOES_HTTP = Histograma(
+    "tlp_http_request_duration_seconds", "Duração das requisições HTTP, até o fim do corpo da resposta.",
+    ("metodo", "rota", "status")
+)
+
+
+class MetricasHTTP:
+    """Middleware ASGI que mede cada requisição HTTP por rota (template), método e status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        resposta = {"status": 500}
+
+        async def enviar(mensagem):
+            if mensagem["type"] == "http.response.start":
+                resposta["status"] = mensagem["status"]
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            # O roteador grava a rota encontrada no próprio scope; sem rota (404), um rótulo fixo
+            rota = scope.get("route")
+            REQUISICOES_HTTP.observe(
+                time.perf_counter() - inicio,
+                metodo=scope["method"],
+                rota=getattr(rota, "path", "sem_rota"),
+                status=resposta["status"]
+            )
+
+
+# ============== BANCO DE DADOS ==============
+
+CONSULTAS_DB = Histograma(
+    "tlp_db_query_duration_seconds", "Duração das consultas SQL executadas pelo SQLAlchemy.",
+    ("engine",), buckets=BUCKETS_CONSULTA
+)
+ERROS_DB = Contador("tlp_db_query_errors_total", "Consultas SQL que terminaram em erro.", ("engine",))
+
+_engines = {}
+
+
+def _estado_pools():
+    for nome, engine in list(_engines.items()):
+        pool = engine.pool
+        if not hasattr(pool, "checkedout"):
+            continue
+        yield (nome, "em_uso"), pool.checkedout()
+        yield (nome, "livres"), pool.checkedin()
+        yield (nome, "overflow"), max(pool.overflow(), 0)
+        yield (nome, "tamanho"), pool.size()
+
+
+POOL_DB = Medidor(
+    "tlp_db_pool_connections", "Conexões do pool do SQLAlchemy por estado (em_uso, livres, overflow, tamanho).",
+    ("engine", "estado"), coletar=_estado_pools
+)
+
+
+def instrumentar_engine(engine, nome):
+    """Registra os eventos de consulta e o pool de uma Engine síncrona (para AsyncEngine, use .sync_engine)."""
+    if nome in _engines:
+        return
+    _engines[nome] = engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _antes(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._tlp_inicio_consulta = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _depois(conn, cursor, statement, parameters, context, executemany):
+        inicio = getattr(context, "_tlp_inicio_consulta", None)
+        if inicio is not None:
+            CONSULTAS_DB.observe(time.perf_counter() - inicio, engine=nome)
+
+    @event.listens_for(engine, "handle_error")
+    def _erro(contexto_excecao):
+        ERROS_DB.inc(engine=nome)
+
+
+# ============== PROCESSAMENTO DE SIMULAÇÕES ==============
+
+ITENS_SIMULACAO = Contador(
+    "tlp_simulacao_itens_total", "Itens de simulação calculados e gravados (rate() = linhas por segundo).", ("engine",)
+)
+BATCHES_SIMULACAO = Contador("tlp_simulacao_batches_total", "Batches gravados pelo pipeline do engine python.")
+FASES_SIMULACAO = Contador(
+    "tlp_simulacao_fase_segundos_total", "Segundos gastos em cada fase do processamento (progresso.py).", ("fase",)
+)
+ESTAGIOS_PIPELINE = Contador(
+    "tlp_simulacao_estagio_segundos_total", "Segundos ocupados por estágio do pipeline (leitura, calculo, escrita).",
+    ("estagio",)
+)
+EXECUCOES_SIMULACAO = Contador(
+    "tlp_simulacao_execucoes_total", "Processamentos de simulação por engine e resultado.", ("engine", "resultado")
+)
+VAZAO_SIMULACAO = Medidor(
+    "tlp_simulacao_ultima_linhas_por_segundo", "Linhas por segundo da fase de cálculo da última simulação concluída."
+)
+
+
+# ============== CACHES ==============
+
+def _eventos_caches():
+    from base_imovel import estatisticas_cache_imoveis
+    from cache import estatisticas_cache
+
+    for grupo, contadores in estatisticas_cache()["grupos"].items():
+        for evento, valor in contadores.items():
+            yield (grupo, evento), valor
+    imoveis = estatisticas_cache_imoveis()
+    for evento in ("acertos", "faltas"):
+        yield ("imoveis", evento), imoveis[evento]
+
+
+EVENTOS_CACHE = Contador(
+    "tlp_cache_eventos_total", "Acertos, faltas, invalidações e descartes dos caches em processo, por grupo.",
+    ("grupo", "evento"), coletar=_eventos_caches
+)
+
+
+# ============== SERVIDOR AVULSO (worker) ==============
+
+class _TratadorMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        corpo = exportar_metricas().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", TIPO_CONTEUDO)
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, formato, *args):
+        pass
+
+
+def servir_metricas(porta):
+    """Expõe /metrics em uma thread daemon (processos sem a API, como `python -m worker`)."""
+    servidor = ThreadingHTTPServer(("0.0.0.0", porta), _TratadorMetricas)
+    threading.Thread(target=servidor.serve_forever, daemon=True, name="tlp-metricas").start()
+    return servidor
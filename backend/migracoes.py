@@ -0,0 +1,251 @@
+"""Migrações versionadas do schema tlp (versão aplicada em tlp.tlp_schema_versao).
+
+O DDL não roda mais no startup da API: ADD COLUMN, ALTER COLUMN TYPE e CREATE
+INDEX pegam lock ACCESS EXCLUSIVE e podem reescrever a tabela. Cada deploy aplica
+as migrações pendentes com um comando explícito, antes de subir a API:
+
+    python -m migracoes            # aplica as pendentes (sem pendentes, não altera nada)
+    python -m migracoes --status   # versão do banco e migrações pendentes
+
+O startup apenas compara versao_do_banco() com VERSAO_SCHEMA.
+
+Cada migração roda em uma transação própria, junto com o registro da sua versão,
+e é idempotente (IF NOT EXISTS, verificação do tipo atual, create_all com
+checkfirst): um banco criado antes deste controle, sem a tabela de versões, passa
+por todas sem efeito no que já existe. Um advisory lock impede dois deploys
+migrando ao mesmo tempo.
+
+Novas mudanças de schema entram no fim de MIGRACOES, com o próximo número: tabela
+nova com create_all(tables=[...]), coluna nova com ADD COLUMN IF NOT EXISTS.
+"""
+import argparse
+
+from sqlalchemy import text
+
+from database import Base, engine
+from particoes import converter_tabela_legada
+
+# Chave do pg_advisory_lock das migrações
+_CHAVE_LOCK = 7281541
+
+
+# Tabelas da versão 1, fixas: tabelas novas entram em migrações próprias. Ficam de fora
+# os models mapeados sobre views do cadastro (vw_imovel_base, vw_uso_imovel_por_inscricao),
+# que não são criadas por este schema.
+TABELAS_ESQUEMA_INICIAL = (
+    "tlp.tlp_parametros",
+    "tlp.tlp_simulacao",
+    "tlp.tlp_lote_lancamento",
+    "tlp.tlp_lote_item",
+    "tlp.tlp_nao_incidencia",
+    "tlp.tlp_simulacao_item",
+    "tlp.tlp_job",
+    "tlp.tlp_base_versao",
+    "tlp.tlp_base_imovel",
+    "tlp.tlp_simulacao_progresso",
+    "tlp.tlp_simulacao_resumo",
+)
+
+
+def _esquema_inicial(conn):
+    import models  # registra as tabelas no Base.metadata
+
+    conn.execute(text("CREATE SCHEMA IF NOT EXISTS tlp"))
+    Base.metadata.create_all(
+        bind=conn, tables=[Base.metadata.tables[nome] for nome in TABELAS_ESQUEMA_INICIAL]
+    )
+
+
+def _colunas_parametros(conn):
+    columns = [
+        ("ipca_percentual", "NUMERIC(5, 2)"),
+        ("subsidio_percentual", "NUMERIC(5, 2)"),
+        ("limite_min_base", "NUMERIC(10, 2)"),
+        ("limite_max_base", "NUMERIC(10, 2)"),
+        ("limite_min_atualizado", "NUMERIC(10, 2)"),
+        ("limite_max_atualizado", "NUMERIC(10, 2)")
+    ]
+    for col_name, col_type in columns:
+        conn.execute(text(f"ALTER TABLE tlp.tlp_parametros ADD COLUMN IF NOT EXISTS {col_name} {col_type}"))
+
+
+def _tipos_parametros(conn):
+    # NUMERIC(10,2) estourava com custos na casa dos bilhões; só altera (e reescreve) o que ainda difere
+    colunas = ("custo_tlp_base", "limite_min_base", "limite_max_base", "limite_min_atualizado", "limite_max_atualizado")
+    divergentes = conn.execute(
+        text("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = 'tlp' AND table_name = 'tlp_parametros'
+              AND column_name = ANY(:colunas)
+              AND (data_type <> 'numeric' OR numeric_precision IS DISTINCT FROM 18 OR numeric_scale IS DISTINCT FROM 2)
+        """),
+        {"colunas": list(colunas)}
+    ).scalars().all()
+    for col in divergentes:
+        conn.execute(text(f"ALTER TABLE tlp.tlp_parametros ALTER COLUMN {col} TYPE NUMERIC(18, 2)"))
+
+
+def _versao_base_simulacao(conn):
+    conn.execute(text("ALTER TABLE tlp.tlp_simulacao ADD COLUMN IF NOT EXISTS id_versao_base INTEGER"))
+
+
+def _itens_particionados(conn):
+    # tlp_simulacao_item anterior ao particionamento por simulação
+    converter_tabela_legada(conn)
+
+
+def _indice_ordem_itens(conn):
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS ix_tlp_simulacao_item_ordem
+        ON tlp.tlp_simulacao_item (id_simulacao, tlp_calculada DESC, id_item DESC)
+    """))
+
+
+def _colunas_remessa_lote(conn):
+    lote_columns = [
+        ("total_itens", "INTEGER"),
+        ("total_registros_remessa", "INTEGER"),
+        ("valor_total_remessa", "NUMERIC(18, 2)"),
+        ("checksum_remessa", "VARCHAR"),
+        ("processado_em", "TIMESTAMP WITH TIME ZONE")
+    ]
+    for col_name, col_type in lote_columns:
+        conn.execute(text(f"ALTER TABLE tlp.tlp_lote_lancamento ADD COLUMN IF NOT EXISTS {col_name} {col_type}"))
+
+
+def _nao_incidencia_unica(conn):
+    # Duplicatas criadas antes do índice único: mantém a ativa mais recente
+    conn.execute(text("""
+        DELETE FROM tlp.tlp_nao_incidencia n
+        USING (
+            SELECT id_nao_incidencia,
+                   row_number() OVER (
+                       PARTITION BY codg_inscricao_lan, exercicio
+                       ORDER BY ativo DESC, created_at DESC
+                   ) AS ordem
+            FROM tlp.tlp_nao_incidencia
+        ) d
+        WHERE d.id_nao_incidencia = n.id_nao_incidencia AND d.ordem > 1
+    """))
+    conn.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ix_tlp_nao_incidencia_inscricao_exercicio
+        ON tlp.tlp_nao_incidencia (codg_inscricao_lan, exercicio)
+    """))
+
+
+def _tabela_perfil(conn):
+    import models
+
+    Base.metadata.create_all(bind=conn, tables=[models.TlpSimulacaoPerfil.__table__])
+
+
+def _job_ativo_unico(conn):
+    # Jobs duplicados enfileirados antes do índice: mantém o mais antigo de cada simulação
+    conn.execute(text("""
+        UPDATE tlp.tlp_job j
+        SET status = 'CANCELADO', finalizado_em = now(),
+            erro_mensagem = 'Job duplicado da simulação, cancelado pela migração 10'
+        FROM (
+            SELECT id_job,
+                   row_number() OVER (PARTITION BY id_simulacao ORDER BY created_at, id_job) AS ordem
+            FROM tlp.tlp_job
+            WHERE id_simulacao IS NOT NULL AND status IN ('PENDENTE', 'EXECUTANDO')
+        ) d
+        WHERE d.id_job = j.id_job AND d.ordem > 1
+    """))
+    conn.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ix_tlp_job_simulacao_ativo
+        ON tlp.tlp_job (id_simulacao)
+        WHERE status IN ('PENDENTE', 'EXECUTANDO')
+    """))
+
+
+def _erro_remessa_lote(conn):
+    conn.execute(text("ALTER TABLE tlp.tlp_lote_lancamento ADD COLUMN IF NOT EXISTS erro_remessa TEXT"))
+
+
+# (versão, descrição, função(conn)) em ordem; nunca renumerar nem alterar uma migração já publicada
+MIGRACOES = [
+    (1, "Schema tlp e tabelas iniciais", _esquema_inicial),
+    (2, "Colunas de IPCA, subsídio e limites em tlp_parametros", _colunas_parametros),
+    (3, "Valores de tlp_parametros em NUMERIC(18, 2)", _tipos_parametros),
+    (4, "Versão da base de imóveis na simulação", _versao_base_simulacao),
+    (5, "tlp_simulacao_item particionada por simulação", _itens_particionados),
+    (6, "Índice de ordenação dos itens (tlp_calculada, id_item)", _indice_ordem_itens),
+    (7, "Colunas da remessa em tlp_lote_lancamento", _colunas_remessa_lote),
+    (8, "Não incidência única por inscrição e exercício", _nao_incidencia_unica),
+    (9, "Perfil de execução das simulações (tlp_simulacao_perfil)", _tabela_perfil),
+    (10, "No máximo um job ativo por simulação", _job_ativo_unico),
+    (11, "Motivo da falha da remessa em tlp_lote_lancamento", _erro_remessa_lote),
+]
+
+VERSAO_SCHEMA = MIGRACOES[-1][0]
+
+
+def versao_do_banco(conn):
+    """Última versão aplicada (0 se o controle de versões ainda não existe). Duas consultas de catálogo/índice."""
+    if conn.execute(text("SELECT to_regclass('tlp.tlp_schema_versao')")).scalar() is None:
+        return 0
+    return conn.execute(text("SELECT COALESCE(MAX(versao), 0) FROM tlp.tlp_schema_versao")).scalar()
+
+
+def pendentes(versao):
+    return [migracao for migracao in MIGRACOES if migracao[0] > versao]
+
+
+def aplicar_migracoes():
+    """Aplica as migrações pendentes, cada uma em sua transação. Retorna as versões aplicadas."""
+    aplicadas = []
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:chave)"), {"chave": _CHAVE_LOCK})
+        try:
+            conn.execute(text("CREATE SCHEMA IF NOT EXISTS tlp"))
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS tlp.tlp_schema_versao (
+                    versao INTEGER PRIMARY KEY,
+                    descricao VARCHAR NOT NULL,
+                    aplicada_em TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+                )
+            """))
+            conn.commit()
+
+            # Lida após o lock: outro processo pode ter acabado de migrar
+            for versao, descricao, migrar in pendentes(versao_do_banco(conn)):
+                conn.commit()
+                with conn.begin():
+                    print(f"Aplicando migração {versao}: {descricao}")
+                    migrar(conn)
+                    conn.execute(
+                        text("INSERT INTO tlp.tlp_schema_versao (versao, descricao) VALUES (:versao, :descricao)"),
+                        {"versao": versao, "descricao": descricao}
+                    )
+                aplicadas.append(versao)
+        finally:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:chave)"), {"chave": _CHAVE_LOCK})
+            conn.commit()
+    return aplicadas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrações do schema tlp")
+    parser.add_argument("--status", action="store_true", help="só mostra a versão do banco e as pendentes")
+    args = parser.parse_args()
+
+    if args.status:
+        with engine.connect() as conn:
+            versao = versao_do_banco(conn)
+        print(f"Versão do banco: {versao} (esperada: {VERSAO_SCHEMA})")
+        for numero, descricao, _ in pendentes(versao):
+            print(f"  pendente {numero}: {descricao}")
+        return
+
+    aplicadas = aplicar_migracoes()
+    if aplicadas:
+        print(f"{len(aplicadas)} migração(ões) aplicada(s); schema na versão {VERSAO_SCHEMA}")
+    else:
+        print(f"Schema já está na versão {VERSAO_SCHEMA}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Numeric, Boolean, BigInteger, DateTime, func, Text
+from sqlalchemy import Column, String, Integer, Numeric, Boolean, BigInteger, DateTime, func, Text, Index, LargeBinary, text
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 import uuid
 from database import Base
@@ -56,6 +56,7 @@ class TlpSimulacao(Base):
     status = Column(Text, default='RASCUNHO') # RASCUNHO, EM_PROCESSAMENTO, CONCLUIDO, ERRO
     descricao = Column(Text)
     parametros_snapshot = Column(JSONB, default={})
+    id_versao_base = Column(Integer)  # Versão de tlp_base_imovel usada no processamento
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 
@@ -69,14 +70,41 @@ class TlpLoteLancamento(Base):
     versao = Column(Integer, default=1)
     id_simulacao_origem = Column(UUID(as_uuid=True), nullable=True)
     parametros_snapshot = Column(JSONB, default={})
-    status = Column(Text, default='GERADO')  # GERADO, PROCESSADO, ENVIADO
+    status = Column(Text, default='GERADO')  # GERADO, PROCESSADO, ENVIADO, ERRO_REMESSA
+    total_itens = Column(Integer)  # Itens congelados em tlp_lote_item
+    total_registros_remessa = Column(Integer)
+    valor_total_remessa = Column(Numeric(18, 2))
+    checksum_remessa = Column(String)  # CRC32 dos registros de detalhe (também no trailer)
+    processado_em = Column(DateTime(timezone=True))
+    erro_remessa = Column(Text)  # Motivo da última falha na geração da remessa (status ERRO_REMESSA)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 
+class TlpLoteItem(Base):
+    """Valores por imóvel congelados no lote oficial (cópia dos itens da simulação de origem)."""
+    __tablename__ = 'tlp_lote_item'
+    __table_args__ = {'schema': 'tlp'}
+
+    id_lote = Column(UUID(as_uuid=True), primary_key=True)
+    codg_inscricao_lan = Column(String, primary_key=True)
+    nome_contribuinte = Column(String)
+    uso_classificado = Column(String)
+    atividade_considerada = Column(String)
+    fator_uso = Column(Numeric(5, 2))
+    tlp_bruta = Column(Numeric(18, 2))
+    tlp_calculada = Column(Numeric(18, 2))
+    nao_incidencia = Column(Boolean)
+    motivo_nao_incidencia = Column(Text)
+
+
 class TlpNaoIncidencia(Base):
     """Cadastro de imóveis isentos/imunes (não incidência)."""
     __tablename__ = 'tlp_nao_incidencia'
-    __table_args__ = {'schema': 'tlp'}
+    __table_args__ = (
+        # Uma linha por inscrição e exercício: ON CONFLICT da importação em massa (nao_incidencia.py)
+        Index('ix_tlp_nao_incidencia_inscricao_exercicio', 'codg_inscricao_lan', 'exercicio', unique=True),
+        {'schema': 'tlp'}
+    )
 
     id_nao_incidencia = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     codg_inscricao_lan = Column(String, nullable=False, index=True)
@@ -88,12 +116,19 @@ class TlpNaoIncidencia(Base):
 
 
 class TlpSimulacaoItem(Base):
-    """Resultado do cálculo TLP por imóvel em uma simulação."""
+    """Resultado do cálculo TLP por imóvel em uma simulação.
+
+    Particionada por LIST (id_simulacao), uma partição por simulação (ver particoes.py).
+    """
     __tablename__ = 'tlp_simulacao_item'
-    __table_args__ = {'schema': 'tlp'}
+    __table_args__ = (
+        # Ordem e cursor de /simulacoes/{id}/itens: (tlp_calculada, id_item) decrescentes
+        Index('ix_tlp_simulacao_item_ordem', 'id_simulacao', text('tlp_calculada DESC'), text('id_item DESC')),
+        {'schema': 'tlp', 'postgresql_partition_by': 'LIST (id_simulacao)'}
+    )
 
+    id_simulacao = Column(UUID(as_uuid=True), primary_key=True)
     id_item = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    id_simulacao = Column(UUID(as_uuid=True), nullable=False, index=True)
     codg_inscricao_lan = Column(String, nullable=False, index=True)
     nome_contribuinte = Column(String)
     uso_classificado = Column(String)
@@ -106,3 +141,105 @@ class TlpSimulacaoItem(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 
+class TlpJob(Base):
+    """Fila persistente de jobs de processamento (executados por worker.py)."""
+    __tablename__ = 'tlp_job'
+    __table_args__ = {'schema': 'tlp'}
+
+    id_job = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    tipo = Column(String, nullable=False)  # PROCESSAR_SIMULACAO, ATUALIZAR_BASE, GERAR_REMESSA
+    id_simulacao = Column(UUID(as_uuid=True), nullable=True, index=True)
+    parametros = Column(JSONB, default={})
+    status = Column(Text, default='PENDENTE', index=True)  # PENDENTE, EXECUTANDO, CONCLUIDO, ERRO, CANCELADO
+    tentativas = Column(Integer, default=0)
+    worker_id = Column(String)
+    heartbeat_em = Column(DateTime(timezone=True))
+    iniciado_em = Column(DateTime(timezone=True))
+    finalizado_em = Column(DateTime(timezone=True))
+    resultado = Column(JSONB)
+    erro_mensagem = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class TlpBaseVersao(Base):
+    """Versões da base materializada de imóveis (snapshot de vw_uso_imovel_por_inscricao)."""
+    __tablename__ = 'tlp_base_versao'
+    __table_args__ = {'schema': 'tlp'}
+
+    id_versao = Column(Integer, primary_key=True, autoincrement=True)
+    status = Column(Text, default='GERANDO')  # GERANDO, ATIVA, SUBSTITUIDA, ERRO
+    total_imoveis = Column(Integer)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    concluido_em = Column(DateTime(timezone=True))
+
+
+class TlpBaseImovel(Base):
+    """Snapshot materializado de vw_uso_imovel_por_inscricao, por versão da base."""
+    __tablename__ = 'tlp_base_imovel'
+    __table_args__ = (
+        Index('ix_tlp_base_imovel_versao_uso', 'id_versao', 'uso_classificado'),
+        {'schema': 'tlp'}
+    )
+
+    id_versao = Column(Integer, primary_key=True)
+    codg_inscricao_lan = Column(String, primary_key=True)
+    nome_contribuinte_lan = Column(String)
+    uso_classificado = Column(String)
+    atividade_considerada = Column(String)
+    tem_servico = Column(Boolean)
+    tem_comercio = Column(Boolean)
+    tem_industria = Column(Boolean)
+    qtde_empresas_distintas = Column(Integer)
+    qtde_cnaes_distintos = Column(Integer)
+
+
+class TlpSimulacaoProgresso(Base):
+    """Telemetria de execução de uma simulação (separada do parametros_snapshot)."""
+    __tablename__ = 'tlp_simulacao_progresso'
+    __table_args__ = {'schema': 'tlp'}
+
+    id_simulacao = Column(UUID(as_uuid=True), primary_key=True)
+    fase = Column(Text)  # ENFILEIRADO, PREPARANDO, CALCULANDO, CONCLUIDO, ERRO
+    itens_processados = Column(Integer, default=0)
+    total_imoveis = Column(Integer, default=0)
+    progresso_percentual = Column(Integer, default=0)
+    linhas_por_segundo = Column(Numeric(18, 2))
+    eta_segundos = Column(Integer)
+    inicio_processamento = Column(DateTime(timezone=True))
+    erro_mensagem = Column(Text)
+    erro_timestamp = Column(DateTime(timezone=True))
+    atualizado_em = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class TlpSimulacaoResumo(Base):
+    """Estatísticas de /resultado, acumuladas durante o processamento (ver resumo.py)."""
+    __tablename__ = 'tlp_simulacao_resumo'
+    __table_args__ = {'schema': 'tlp'}
+
+    id_simulacao = Column(UUID(as_uuid=True), primary_key=True)
+    total_imoveis = Column(Integer, nullable=False)
+    total_arrecadado = Column(Numeric(18, 2), nullable=False)
+    min_tlp = Column(Numeric(18, 2))
+    max_tlp = Column(Numeric(18, 2))
+    total_isentos = Column(Integer, nullable=False)
+    por_uso = Column(JSONB, nullable=False)  # [{uso, quantidade, total}]
+    origem = Column(Text)  # PROCESSAMENTO, VARREDURA ou RECALCULO (agregação sobre os itens)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class TlpSimulacaoPerfil(Base):
+    """Perfil de uma execução do processamento (opcional, ?perfil=true; ver perfil.py)."""
+    __tablename__ = 'tlp_simulacao_perfil'
+    __table_args__ = {'schema': 'tlp'}
+
+    id_perfil = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id_simulacao = Column(UUID(as_uuid=True), nullable=False, index=True)
+    engine = Column(String)
+    resultado = Column(String)  # CONCLUIDO, ERRO, CANCELADO
+    duracao_segundos = Column(Numeric(12, 3))
+    cpu_segundos = Column(Numeric(12, 3))
+    pico_rss_mb = Column(Numeric(12, 1))
+    dados = Column(JSONB)  # etapas (totais e percentis) e séries por batch
+    cprofile_resumo = Column(Text)
+    cprofile = Column(LargeBinary)  # dump pstats (marshal), só com cprofile=true
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
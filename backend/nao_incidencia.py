@@ -0,0 +1,191 @@
+"""Importação em massa do cadastro de não incidência (tlp.tlp_nao_incidencia) a partir de CSV.
+
+Listas de isenções judiciais e legais chegam como planilhas com milhares de
+inscrições. POST /nao-incidencia/import envia o arquivo inteiro, em uma única
+transação:
+
+1. o CSV é enviado por COPY direto para uma tabela temporária de staging
+   (colunas texto, na ordem do cabeçalho do arquivo);
+2. as linhas são validadas em SQL: inscrição vazia, exercício inválido, origem
+   fora de ORIGENS_NAO_INCIDENCIA, inscrição duplicada no arquivo e inscrição
+   inexistente na base de imóveis (versão ATIVA de tlp_base_imovel, ou a view
+   se a base ainda não foi materializada);
+3. as válidas entram com INSERT ... ON CONFLICT (codg_inscricao_lan, exercicio)
+   DO UPDATE, sobre o índice único ix_tlp_nao_incidencia_inscricao_exercicio.
+   Reimportar o mesmo arquivo não altera nada (inalterados).
+
+Cabeçalho: codg_inscricao_lan (obrigatória), exercicio, motivo, origem, separados
+por vírgula ou ponto e vírgula. exercicio e origem podem vir da requisição
+quando a coluna não existe no arquivo.
+"""
+import csv
+
+from sqlalchemy import text
+
+from base_imovel import versao_atual
+
+ORIGENS_NAO_INCIDENCIA = ('JUDICIAL', 'ADMINISTRATIVO', 'LEI')
+
+COLUNAS_IMPORTACAO = ("codg_inscricao_lan", "exercicio", "motivo", "origem")
+
+# Codificações aceitas → nome no COPY
+CODIFICACOES = {"utf-8": "UTF8", "latin-1": "LATIN1"}
+
+MAX_REJEICOES_LISTADAS = 100
+
+_STAGING = "tmp_nao_incidencia_import"
+
+
+class ErroImportacao(Exception):
+    """Arquivo de importação inválido (cabeçalho, codificação ou formato CSV)."""
+
+
+def _ler_cabecalho(arquivo, codificacao):
+    """Lê a primeira linha do arquivo: (colunas, separador). O arquivo fica posicionado nos dados."""
+    try:
+        linha = arquivo.readline().decode(codificacao).lstrip("﻿").strip()
+    except UnicodeDecodeError:
+        raise ErroImportacao(f"Cabeçalho não está em {codificacao}")
+    if not linha:
+        raise ErroImportacao("Arquivo vazio")
+
+    separador = ";" if ";" in linha else ","
+    colunas = [coluna.strip().lower() for coluna in next(csv.reader([linha], delimiter=separador))]
+    desconhecidas = [coluna for coluna in colunas if coluna not in COLUNAS_IMPORTACAO]
+    if desconhecidas:
+        raise ErroImportacao(
+            f"Colunas desconhecidas: {', '.join(desconhecidas)}. Use {', '.join(COLUNAS_IMPORTACAO)}"
+        )
+    if len(set(colunas)) != len(colunas):
+        raise ErroImportacao("Colunas repetidas no cabeçalho")
+    if "codg_inscricao_lan" not in colunas:
+        raise ErroImportacao("Coluna codg_inscricao_lan é obrigatória")
+    return colunas, separador
+
+
+def _carregar_staging(db, arquivo, colunas, separador, codificacao):
+    """Cria a tabela de staging e envia o restante do arquivo com um único COPY. Retorna o número de linhas."""
+    db.execute(text(f"""
+        CREATE TEMP TABLE {_STAGING} (
+            linha bigserial,
+            codg_inscricao_lan text,
+            exercicio text,
+            motivo text,
+            origem text
+        ) ON COMMIT DROP
+    """))
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {_STAGING} ({', '.join(colunas)}) FROM STDIN "
+            f"WITH (FORMAT csv, DELIMITER '{separador}', ENCODING '{CODIFICACOES[codificacao]}')",
+            arquivo
+        )
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def importar_nao_incidencia(db, arquivo, exercicio=None, origem=None, codificacao="utf-8"):
+    """Importa o CSV (arquivo binário) em uma transação. Retorna as contagens e uma amostra das rejeições.
+
+    ErroImportacao para problemas no arquivo; o commit é feito aqui.
+    """
+    if codificacao not in CODIFICACOES:
+        raise ErroImportacao(f"Codificação inválida: {codificacao}. Use {', '.join(CODIFICACOES)}")
+    if origem is not None and origem.upper() not in ORIGENS_NAO_INCIDENCIA:
+        raise ErroImportacao(f"Origem inválida: {origem}. Use {', '.join(ORIGENS_NAO_INCIDENCIA)}")
+
+    colunas, separador = _ler_cabecalho(arquivo, codificacao)
+    if "exercicio" not in colunas and exercicio is None:
+        raise ErroImportacao("Informe a coluna exercicio no arquivo ou o parâmetro exercicio")
+
+    try:
+        total_linhas = _carregar_staging(db, arquivo, colunas, separador, codificacao)
+    except Exception as e:
+        db.rollback()
+        # Erros do COPY (colunas faltando, aspas sem fechamento, bytes inválidos) vêm do Postgres
+        raise ErroImportacao(f"CSV inválido: {getattr(e, 'pgerror', None) or e}".strip())
+
+    versao = versao_atual(db)
+    base = (
+        "SELECT codg_inscricao_lan FROM tlp.tlp_base_imovel WHERE id_versao = :versao" if versao
+        else "SELECT codg_inscricao_lan FROM tlp.vw_uso_imovel_por_inscricao"
+    )
+
+    # Normaliza e classifica cada linha; só as sem motivo_rejeicao seguem para o upsert
+    db.execute(text(f"""
+        CREATE TEMP TABLE {_STAGING}_validada ON COMMIT DROP AS
+        WITH normalizada AS (
+            SELECT linha,
+                   NULLIF(btrim(codg_inscricao_lan), '') AS codg_inscricao_lan,
+                   COALESCE(NULLIF(btrim(exercicio), ''), CAST(:exercicio AS text)) AS exercicio,
+                   NULLIF(btrim(motivo), '') AS motivo,
+                   upper(COALESCE(NULLIF(btrim(origem), ''), :origem)) AS origem
+            FROM {_STAGING}
+        ),
+        numerada AS (
+            SELECT n.*,
+                   COUNT(*) OVER (PARTITION BY codg_inscricao_lan, exercicio) AS ocorrencias,
+                   EXISTS (SELECT 1 FROM ({base}) b WHERE b.codg_inscricao_lan = n.codg_inscricao_lan) AS na_base
+            FROM normalizada n
+        )
+        SELECT linha, codg_inscricao_lan,
+               CASE WHEN exercicio ~ '^[0-9]{{4}}$' THEN CAST(exercicio AS integer) END AS exercicio,
+               motivo, origem,
+               CASE
+                   WHEN codg_inscricao_lan IS NULL THEN 'Inscrição vazia'
+                   WHEN exercicio IS NULL OR exercicio !~ '^[0-9]{{4}}$' THEN 'Exercício inválido'
+                   WHEN origem IS NOT NULL AND origem <> ALL(:origens) THEN 'Origem inválida'
+                   WHEN ocorrencias > 1 THEN 'Inscrição duplicada no arquivo'
+                   WHEN NOT na_base THEN 'Inscrição não encontrada na base de imóveis'
+               END AS motivo_rejeicao
+        FROM numerada
+    """), {
+        "exercicio": exercicio,
+        "origem": origem.upper() if origem else None,
+        "origens": list(ORIGENS_NAO_INCIDENCIA),
+        "versao": versao.id_versao if versao else None,
+    })
+
+    # xmax = 0 só na versão recém-inserida da linha; no DO UPDATE é o id da transação
+    upsert = db.execute(text(f"""
+        INSERT INTO tlp.tlp_nao_incidencia
+            (id_nao_incidencia, codg_inscricao_lan, exercicio, motivo, origem, ativo, created_at)
+        SELECT gen_random_uuid(), codg_inscricao_lan, exercicio, motivo, origem, true, now()
+        FROM {_STAGING}_validada
+        WHERE motivo_rejeicao IS NULL
+        ON CONFLICT (codg_inscricao_lan, exercicio) DO UPDATE
+        SET motivo = EXCLUDED.motivo, origem = EXCLUDED.origem, ativo = true
+        WHERE (tlp_nao_incidencia.motivo, tlp_nao_incidencia.origem, tlp_nao_incidencia.ativo)
+              IS DISTINCT FROM (EXCLUDED.motivo, EXCLUDED.origem, true)
+        RETURNING (xmax = 0) AS inserido
+    """)).fetchall()
+    inseridos = sum(1 for (inserido,) in upsert if inserido)
+    atualizados = len(upsert) - inseridos
+
+    rejeitados, validos = db.execute(text(f"""
+        SELECT COUNT(*) FILTER (WHERE motivo_rejeicao IS NOT NULL),
+               COUNT(*) FILTER (WHERE motivo_rejeicao IS NULL)
+        FROM {_STAGING}_validada
+    """)).fetchone()
+    rejeicoes = [
+        {"linha": linha + 1, "codg_inscricao_lan": codg, "motivo": motivo}  # +1: cabeçalho
+        for linha, codg, motivo in db.execute(text(f"""
+            SELECT linha, codg_inscricao_lan, motivo_rejeicao
+            FROM {_STAGING}_validada
+            WHERE motivo_rejeicao IS NOT NULL
+            ORDER BY linha
+            LIMIT :limite
+        """), {"limite": MAX_REJEICOES_LISTADAS})
+    ]
+
+    db.commit()
+    return {
+        "total_linhas": total_linhas,
+        "inseridos": inseridos,
+        "atualizados": atualizados,
+        "inalterados": validos - inseridos - atualizados,
+        "rejeitados": rejeitados,
+        "rejeicoes": rejeicoes,
+    }
@@ -0,0 +1,154 @@
+"""Particionamento de tlp.tlp_simulacao_item por simulação (LIST em id_simulacao).
+
+Cada simulação tem sua própria partição. Reprocessar esvazia a partição com
+TRUNCATE e resetar a remove com DROP, em vez de um DELETE de milhões de linhas
+(WAL, tuplas mortas e inchaço de índices para o autovacuum). Consultas filtradas
+por id_simulacao leem somente a partição da simulação (partition pruning).
+
+Tabelas criadas antes do particionamento são convertidas pela migração 5
+(`python -m migracoes`, converter_tabela_legada): as linhas existentes são
+copiadas para uma partição por simulação e a tabela antiga é removida.
+
+Limpeza de partições de simulações que não existem mais:
+    python -m particoes
+"""
+import uuid
+
+from sqlalchemy import text
+
+TABELA_ITENS = "tlp_simulacao_item"
+SCHEMA = "tlp"
+
+
+def nome_particao(id_simulacao):
+    """Nome (sem schema) da partição de uma simulação: tlp_simulacao_item_<uuid sem hífens>."""
+    return f"{TABELA_ITENS}_{uuid.UUID(str(id_simulacao)).hex}"
+
+
+def _tipo_tabela(conn, nome):
+    """relkind da tabela no schema tlp ('r' comum, 'p' particionada) ou None se não existe."""
+    return conn.execute(
+        text("""
+            SELECT c.relkind FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = :schema AND c.relname = :nome
+        """),
+        {"schema": SCHEMA, "nome": nome}
+    ).scalar()
+
+
+def particao_existe(db, id_simulacao):
+    return _tipo_tabela(db, nome_particao(id_simulacao)) is not None
+
+
+def criar_particao(db, id_simulacao):
+    """Cria a partição da simulação (sem commit).
+
+    A tabela é criada à parte e depois anexada: ATTACH PARTITION bloqueia a tabela
+    principal com SHARE UPDATE EXCLUSIVE, sem impedir leituras e escritas nas demais partições.
+    """
+    id_simulacao = str(uuid.UUID(str(id_simulacao)))
+    particao = f"{SCHEMA}.{nome_particao(id_simulacao)}"
+    db.execute(text(f"""
+        CREATE TABLE {particao}
+        (LIKE {SCHEMA}.{TABELA_ITENS} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+    """))
+    db.execute(text(f"""
+        ALTER TABLE {SCHEMA}.{TABELA_ITENS}
+        ATTACH PARTITION {particao} FOR VALUES IN ('{id_simulacao}')
+    """))
+
+
+def preparar_particao(db, id_simulacao):
+    """Deixa a partição da simulação existente e vazia (reprocessamento usa TRUNCATE). Sem commit."""
+    if particao_existe(db, id_simulacao):
+        db.execute(text(f"TRUNCATE TABLE {SCHEMA}.{nome_particao(id_simulacao)}"))
+    else:
+        criar_particao(db, id_simulacao)
+
+
+def remover_particao(db, id_simulacao):
+    """Desanexa e remove a partição da simulação, se existir (sem commit)."""
+    if not particao_existe(db, id_simulacao):
+        return
+    particao = f"{SCHEMA}.{nome_particao(id_simulacao)}"
+    db.execute(text(f"ALTER TABLE {SCHEMA}.{TABELA_ITENS} DETACH PARTITION {particao}"))
+    db.execute(text(f"DROP TABLE {particao}"))
+
+
+def remover_particoes_orfas(db):
+    """Remove partições de simulações que não existem mais. Retorna os nomes removidos."""
+    orfas = db.execute(
+        text("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            JOIN pg_namespace n ON n.oid = p.relnamespace
+            WHERE n.nspname = :schema AND p.relname = :tabela
+              AND NOT EXISTS (
+                  SELECT 1 FROM tlp.tlp_simulacao s
+                  WHERE replace(CAST(s.id_simulacao AS text), '-', '') = substr(c.relname, :inicio)
+              )
+        """),
+        {"schema": SCHEMA, "tabela": TABELA_ITENS, "inicio": len(TABELA_ITENS) + 2}
+    ).scalars().all()
+    for nome in orfas:
+        db.execute(text(f"ALTER TABLE {SCHEMA}.{TABELA_ITENS} DETACH PARTITION {SCHEMA}.{nome}"))
+        db.execute(text(f"DROP TABLE {SCHEMA}.{nome}"))
+    return orfas
+
+
+def converter_tabela_legada(conn):
+    """Converte uma tlp_simulacao_item não particionada na tabela particionada do models.
+
+    Migração de migracoes.py, na transação de `conn`; não faz nada se a tabela já é particionada.
+    """
+    from models import TlpSimulacaoItem
+
+    if _tipo_tabela(conn, TABELA_ITENS) != 'r':
+        return False
+
+    legado = f"{TABELA_ITENS}_legado"
+    print(f"Convertendo {SCHEMA}.{TABELA_ITENS} em tabela particionada por simulação...")
+
+    # Renomear tabela e índices antigos para liberar os nomes para a nova tabela
+    conn.execute(text(f"ALTER TABLE {SCHEMA}.{TABELA_ITENS} RENAME TO {legado}"))
+    indices = conn.execute(
+        text("SELECT indexname FROM pg_indexes WHERE schemaname = :schema AND tablename = :tabela"),
+        {"schema": SCHEMA, "tabela": legado}
+    ).scalars().all()
+    for indice in indices:
+        conn.execute(text(f"ALTER INDEX {SCHEMA}.{indice} RENAME TO {indice[:56]}_legado"))
+
+    TlpSimulacaoItem.__table__.create(conn)
+
+    simulacoes = conn.execute(
+        text(f"SELECT DISTINCT id_simulacao FROM {SCHEMA}.{legado}")
+    ).scalars().all()
+    colunas = ", ".join(c.name for c in TlpSimulacaoItem.__table__.columns)
+    for id_simulacao in simulacoes:
+        criar_particao(conn, id_simulacao)
+        conn.execute(
+            text(f"""
+                INSERT INTO {SCHEMA}.{nome_particao(id_simulacao)} ({colunas})
+                SELECT {colunas} FROM {SCHEMA}.{legado} WHERE id_simulacao = :id
+            """),
+            {"id": id_simulacao}
+        )
+
+    conn.execute(text(f"DROP TABLE {SCHEMA}.{legado}"))
+    print(f"{SCHEMA}.{TABELA_ITENS} convertida: {len(simulacoes)} partição(ões) criada(s).")
+    return True
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    sessao = SessionLocal()
+    try:
+        removidas = remover_particoes_orfas(sessao)
+        sessao.commit()
+        print(f"{len(removidas)} partição(ões) órfã(s) removida(s)")
+    finally:
+        sessao.close()
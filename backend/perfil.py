@@ -0,0 +1,198 @@
+"""Perfil de execução opcional do processamento (tlp.tlp_simulacao_perfil).
+
+POST /simulacoes/{id}/processar?perfil=true mede cada etapa de processar_simulacao
+(preparação, consultas de leitura, kernel de cálculo, acumulação do resumo,
+montagem do buffer, COPY, commits, progresso, finalização): tempo de parede e CPU
+da thread que a executou, por chamada. Etapas executadas por batch guardam a
+série completa (wall_ms/cpu_ms por batch). Com cprofile=true, cada thread do
+pipeline roda também sob um cProfile.Profile (no Python 3.12+, em que o cProfile
+usa sys.monitoring e só um perfilador pode estar ativo no interpretador, um único
+perfilador ligado em iniciar() cobre todas as threads); os perfis são somados e gravados
+em formato pstats (GET /simulacoes/{id}/perfil?formato=pstats, abrir com
+`python -m pstats` ou snakeviz), com um resumo em texto das funções mais caras.
+
+O pico de RSS vem de getrusage (indisponível no Windows): é o pico do processo
+desde que ele subiu, então só mostra o custo desta execução se ela o elevou
+(compare pico_rss_mb com pico_rss_inicio_mb).
+
+Sem perfil ativo, medir() não faz nada além de um context manager vazio.
+"""
+import cProfile
+import io
+import marshal
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from database import engine
+
+MAX_FUNCOES_RESUMO = 40
+
+_FIM = object()
+
+# 3.12+: cProfile sobre sys.monitoring, que vale para o interpretador inteiro
+_CPROFILE_UNICO = sys.version_info >= (3, 12)
+
+
+def _pico_rss_mb():
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss: kilobytes no Linux, bytes no macOS
+    return round(pico / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+class PerfilExecucao:
+    """Tempos por etapa de uma execução, seguros entre as threads do pipeline."""
+
+    def __init__(self, ativo=False, cprofile=False):
+        self.ativo = ativo or cprofile
+        self.cprofile = cprofile
+        self._series = {}  # etapa -> ([wall], [cpu]) em segundos
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._perfiladores = []
+        self._principal = None
+        self._inicio = time.perf_counter()
+        self._inicio_cpu = time.process_time()
+        self._pico_rss_inicio = _pico_rss_mb() if self.ativo else None
+
+    def _ligar_cprofile(self):
+        """Liga o cProfile da thread atual, se ainda não estiver ligado. Retorna o perfilador a desligar, ou None."""
+        if not self.cprofile or getattr(self._local, "ligado", False):
+            return None
+        if _CPROFILE_UNICO and self._principal is not None:
+            return None  # o perfilador de iniciar() já vê esta thread
+        perfilador = getattr(self._local, "perfilador", None) or cProfile.Profile()
+        try:
+            perfilador.enable()
+        except ValueError:
+            # Outro perfilador já ativo no interpretador (3.12+): esta medição fica sem cProfile
+            return None
+        # Só entram no dump os perfiladores que de fato rodaram
+        if getattr(self._local, "perfilador", None) is None:
+            self._local.perfilador = perfilador
+            with self._lock:
+                self._perfiladores.append(perfilador)
+        self._local.ligado = True
+        return perfilador
+
+    def _desligar_cprofile(self, perfilador):
+        if perfilador is not None:
+            perfilador.disable()
+            self._local.ligado = False
+
+    def iniciar(self):
+        """Liga o cProfile na thread chamadora até finalizar() (tudo o que ela executa entra no dump)."""
+        if self.ativo:
+            self._principal = self._ligar_cprofile()
+
+    @contextmanager
+    def medir(self, etapa):
+        if not self.ativo:
+            yield
+            return
+        perfilador = self._ligar_cprofile()
+        inicio, inicio_cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - inicio, time.thread_time() - inicio_cpu
+            self._desligar_cprofile(perfilador)
+            with self._lock:
+                serie = self._series.setdefault(etapa, ([], []))
+                serie[0].append(wall)
+                serie[1].append(cpu)
+
+    def iterar(self, etapa, iteravel):
+        """Percorre o iterável medindo cada next() como uma chamada da etapa (ex.: consultas de leitura)."""
+        if not self.ativo:
+            yield from iteravel
+            return
+        iterador = iter(iteravel)
+        while True:
+            with self.medir(etapa):
+                item = next(iterador, _FIM)
+            if item is _FIM:
+                return
+            yield item
+
+    def finalizar(self):
+        """Encerra a medição. Retorna (dados, resumo do cProfile, dump pstats) para gravar_perfil()."""
+        self._desligar_cprofile(self._principal)
+        duracao = time.perf_counter() - self._inicio
+
+        etapas, lotes = {}, {}
+        with self._lock:
+            series = {etapa: (list(w), list(c)) for etapa, (w, c) in self._series.items()}
+        for etapa, (walls, cpus) in series.items():
+            etapas[etapa] = {
+                "chamadas": len(walls),
+                "wall_segundos": round(sum(walls), 4),
+                "cpu_segundos": round(sum(cpus), 4),
+                "percentual_duracao": round(sum(walls) * 100 / duracao, 1) if duracao > 0 else 0,
+                "wall_p50_ms": round(_percentil(walls, 50) * 1000, 3),
+                "wall_p95_ms": round(_percentil(walls, 95) * 1000, 3),
+                "wall_max_ms": round(max(walls) * 1000, 3),
+            }
+            if len(walls) > 1:
+                lotes[etapa] = {
+                    "wall_ms": [round(w * 1000, 2) for w in walls],
+                    "cpu_ms": [round(c * 1000, 2) for c in cpus],
+                }
+
+        dados = {
+            "duracao_segundos": round(duracao, 3),
+            # CPU do processo inteiro (todas as threads) durante a execução
+            "cpu_segundos": round(time.process_time() - self._inicio_cpu, 3),
+            "pico_rss_mb": _pico_rss_mb(),
+            "pico_rss_inicio_mb": self._pico_rss_inicio,
+            "etapas": dict(sorted(etapas.items(), key=lambda item: -item[1]["wall_segundos"])),
+            "lotes": lotes,
+        }
+
+        resumo_cprofile = dump = None
+        if self._perfiladores:
+            estatisticas = pstats.Stats(self._perfiladores[0])
+            for perfilador in self._perfiladores[1:]:
+                estatisticas.add(perfilador)
+            saida = io.StringIO()
+            estatisticas.stream = saida
+            estatisticas.sort_stats("cumulative").print_stats(MAX_FUNCOES_RESUMO)
+            resumo_cprofile = saida.getvalue()
+            dump = marshal.dumps(estatisticas.stats)  # mesmo formato de Stats.dump_stats
+        return dados, resumo_cprofile, dump
+
+
+def gravar_perfil(id_simulacao, engine_processamento, resultado, registro):
+    """Finaliza o registro e grava o perfil em transação própria. Falhas só são registradas no log."""
+    from models import TlpSimulacaoPerfil
+
+    try:
+        dados, resumo_cprofile, dump = registro.finalizar()
+        with engine.begin() as conn:
+            conn.execute(TlpSimulacaoPerfil.__table__.insert().values(
+                id_simulacao=id_simulacao,
+                engine=engine_processamento,
+                resultado=resultado,
+                duracao_segundos=dados["duracao_segundos"],
+                cpu_segundos=dados["cpu_segundos"],
+                pico_rss_mb=dados["pico_rss_mb"],
+                dados=dados,
+                cprofile_resumo=resumo_cprofile,
+                cprofile=dump
+            ))
+    except Exception as e:
+        print(f"Erro ao gravar perfil da simulação {id_simulacao}: {e}")
@@ -0,0 +1,142 @@
+"""Pipeline de três estágios (leitura → cálculo → escrita) com filas limitadas.
+
+Enquanto o batch N é calculado, o batch N+1 já está sendo lido e o batch N-1
+gravado. Leitura e escrita rodam em threads próprias (cada uma com sua própria
+conexão, fornecida por quem chama); o cálculo roda na thread chamadora.
+As filas têm tamanho máximo `profundidade`, o que limita a memória em uso.
+
+Ao final, cada estágio informa o tempo ocupado (excluindo a espera nas filas)
+e a utilização = ocupado / duração total.
+"""
+import queue
+import threading
+import time
+
+_FIM = object()
+_ESPERA_FILA = 0.1  # segundos entre verificações do sinal de parada
+
+
+class EstatisticaEstagio:
+    def __init__(self, nome):
+        self.nome = nome
+        self.ocupado = 0.0
+        self.lotes = 0
+
+    def como_dict(self, duracao):
+        return {
+            "ocupado_segundos": round(self.ocupado, 3),
+            "utilizacao": round(self.ocupado / duracao, 3) if duracao > 0 else 0.0,
+            "lotes": self.lotes,
+        }
+
+
+class _Controle:
+    """Sinal de parada e primeira exceção ocorrida em qualquer estágio."""
+
+    def __init__(self):
+        self.parar = threading.Event()
+        self.erro = None
+
+    def falhar(self, erro):
+        if self.erro is None:
+            self.erro = erro
+        self.parar.set()
+
+    def colocar(self, fila, item):
+        while not self.parar.is_set():
+            try:
+                fila.put(item, timeout=_ESPERA_FILA)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def retirar(self, fila):
+        while not self.parar.is_set():
+            try:
+                return fila.get(timeout=_ESPERA_FILA)
+            except queue.Empty:
+                continue
+        return _FIM
+
+
+def executar_pipeline(fonte, calcular, gravar, profundidade=2):
+    """Executa o pipeline até esgotar `fonte` e devolve as estatísticas por estágio.
+
+    fonte: iterável de batches, consumido na thread de leitura
+    calcular: função batch -> resultado, executada na thread chamadora
+    gravar: função resultado -> None, executada na thread de escrita
+    Qualquer exceção interrompe os três estágios e é relançada aqui.
+    """
+    profundidade = max(1, int(profundidade))
+    fila_leitura = queue.Queue(maxsize=profundidade)
+    fila_escrita = queue.Queue(maxsize=profundidade)
+    controle = _Controle()
+    estagios = {nome: EstatisticaEstagio(nome) for nome in ("leitura", "calculo", "escrita")}
+
+    def estagio_leitura():
+        stats = estagios["leitura"]
+        try:
+            iterador = iter(fonte)
+            while not controle.parar.is_set():
+                inicio = time.perf_counter()
+                batch = next(iterador, _FIM)
+                stats.ocupado += time.perf_counter() - inicio
+                if batch is _FIM:
+                    break
+                stats.lotes += 1
+                if not controle.colocar(fila_leitura, batch):
+                    return
+        except BaseException as e:
+            controle.falhar(e)
+        finally:
+            controle.colocar(fila_leitura, _FIM)
+
+    def estagio_escrita():
+        stats = estagios["escrita"]
+        try:
+            while True:
+                resultado = controle.retirar(fila_escrita)
+                if resultado is _FIM:
+                    return
+                inicio = time.perf_counter()
+                gravar(resultado)
+                stats.ocupado += time.perf_counter() - inicio
+                stats.lotes += 1
+        except BaseException as e:
+            controle.falhar(e)
+
+    inicio_total = time.perf_counter()
+    leitor = threading.Thread(target=estagio_leitura, name="pipeline-leitura", daemon=True)
+    escritor = threading.Thread(target=estagio_escrita, name="pipeline-escrita", daemon=True)
+    leitor.start()
+    escritor.start()
+
+    stats_calculo = estagios["calculo"]
+    try:
+        while True:
+            batch = controle.retirar(fila_leitura)
+            if batch is _FIM:
+                break
+            inicio = time.perf_counter()
+            resultado = calcular(batch)
+            stats_calculo.ocupado += time.perf_counter() - inicio
+            stats_calculo.lotes += 1
+            if not controle.colocar(fila_escrita, resultado):
+                break
+    except BaseException as e:
+        controle.falhar(e)
+    finally:
+        controle.colocar(fila_escrita, _FIM)
+        leitor.join()
+        escritor.join()
+
+    if controle.erro is not None:
+        raise controle.erro
+
+    duracao = time.perf_counter() - inicio_total
+    return {
+        "duracao_segundos": round(duracao, 3),
+        "profundidade_fila": profundidade,
+        "estagios": {nome: stats.como_dict(duracao) for nome, stats in estagios.items()},
+    }
@@ -0,0 +1,400 @@
+"""Processamento de simulações (cálculo da TLP para toda a base de imóveis).
+
+Executado fora da requisição HTTP, pelo worker de jobs (worker.py). As funções
+recebem uma sessão própria e fazem commits parciais a cada batch.
+"""
+import os
+
+from sqlalchemy import text
+
+from bulk_copy import COLUNAS_SIMULACAO_ITEM, copiar_buffer, montar_buffer_itens_simulacao
+from cache import CACHE_SIMULACOES, invalidar_cache
+from base_imovel import garantir_versao
+from particoes import preparar_particao
+from database import SessionLocal
+from metricas import BATCHES_SIMULACAO, ESTAGIOS_PIPELINE, EXECUCOES_SIMULACAO, ITENS_SIMULACAO
+from perfil import PerfilExecucao, gravar_perfil
+from pipeline import executar_pipeline
+from progresso import RegistroProgresso
+from resumo import calcular_resumo_itens, gravar_resumo, remover_resumo
+from calculo_tlp import (
+    FATORES_USO, FATOR_USO_PADRAO, USO_PADRAO, USOS_ISENTOS, MOTIVO_USO_ISENTO,
+    ResumoSimulacao, TabelaIsencoes, calcular_lote, fator_centesimos, linhas_para_copy, parametros_do_snapshot
+)
+
+BATCH_SIZE = 1000  # Processar 1000 imóveis por vez
+PROFUNDIDADE_FILA_PADRAO = int(os.getenv("TLP_PIPELINE_PROFUNDIDADE", "2"))
+
+ENGINES_PROCESSAMENTO = ('python', 'sql')
+
+
+class ErroProcessamento(Exception):
+    """Erro de regra de negócio que impede o processamento (ex.: base vazia)."""
+
+
+class ProcessamentoCancelado(Exception):
+    """O job foi cancelado (ex.: simulação resetada) durante o processamento."""
+
+
+def inserir_itens_sql(db, id_simulacao, id_versao, exercicio, total_imoveis,
+                      custo_final_centavos, limite_min_centavos, limite_max_centavos):
+    """Calcula e grava todos os itens da simulação em um único INSERT ... SELECT.
+
+    Aplica no banco as mesmas regras do kernel calculo_tlp: fator por uso (FATORES_USO),
+    não incidência do exercício, isenção de uso público/filantrópico e limites min/max,
+    com a mesma aritmética em centavos e arredondamento half-up.
+    Retorna a quantidade de itens gravados (não faz commit).
+    """
+    valores_fatores = []
+    parametros = {}
+    for i, (uso, fator) in enumerate(FATORES_USO.items()):
+        valores_fatores.append(f"(CAST(:uso_{i} AS text), CAST(:fator_{i} AS bigint))")
+        parametros[f"uso_{i}"] = uso
+        parametros[f"fator_{i}"] = fator_centesimos(fator)
+
+    parametros.update({
+        "id_simulacao": str(id_simulacao),
+        "id_versao": id_versao,
+        "exercicio": exercicio,
+        "total_imoveis": total_imoveis,
+        "custo_final": custo_final_centavos,
+        "limite_min": limite_min_centavos,
+        "limite_max": limite_max_centavos,
+        "fator_padrao": fator_centesimos(FATOR_USO_PADRAO),
+        "uso_padrao": USO_PADRAO,
+        "usos_isentos": list(USOS_ISENTOS),
+        "motivo_uso_isento": MOTIVO_USO_ISENTO,
+    })
+
+    result = db.execute(
+        text(f"""
+            WITH fatores (uso, fator) AS (
+                VALUES {", ".join(valores_fatores)}
+            ),
+            isentas AS (
+                SELECT DISTINCT ON (codg_inscricao_lan) codg_inscricao_lan, motivo
+                FROM tlp.tlp_nao_incidencia
+                WHERE exercicio = :exercicio AND ativo = true
+                ORDER BY codg_inscricao_lan, created_at DESC
+            ),
+            base AS (
+                SELECT
+                    v.codg_inscricao_lan,
+                    v.nome_contribuinte_lan,
+                    UPPER(COALESCE(NULLIF(v.uso_classificado, ''), :uso_padrao)) AS uso,
+                    v.atividade_considerada
+                FROM tlp.tlp_base_imovel v
+                WHERE v.id_versao = :id_versao
+            ),
+            calculo AS (
+                SELECT
+                    b.codg_inscricao_lan,
+                    b.nome_contribuinte_lan,
+                    b.uso,
+                    b.atividade_considerada,
+                    COALESCE(f.fator, :fator_padrao) AS fator,
+                    ROUND(
+                        CAST(:custo_final AS numeric) * COALESCE(f.fator, :fator_padrao)
+                        / (100 * CAST(:total_imoveis AS numeric))
+                    ) AS tlp_bruta,
+                    (i.codg_inscricao_lan IS NOT NULL OR b.uso = ANY(:usos_isentos)) AS isento,
+                    CASE
+                        WHEN b.uso = ANY(:usos_isentos) THEN COALESCE(NULLIF(i.motivo, ''), :motivo_uso_isento)
+                        ELSE i.motivo
+                    END AS motivo
+                FROM base b
+                LEFT JOIN fatores f ON f.uso = b.uso
+                LEFT JOIN isentas i ON i.codg_inscricao_lan = b.codg_inscricao_lan
+            )
+            INSERT INTO tlp.tlp_simulacao_item
+            (id_item, id_simulacao, codg_inscricao_lan, nome_contribuinte, uso_classificado,
+             atividade_considerada, fator_uso, tlp_bruta, tlp_calculada,
+             nao_incidencia, motivo_nao_incidencia)
+            SELECT
+                gen_random_uuid(),
+                CAST(:id_simulacao AS uuid),
+                codg_inscricao_lan,
+                nome_contribuinte_lan,
+                uso,
+                atividade_considerada,
+                fator / 100.0,
+                tlp_bruta / 100.0,
+                CASE
+                    WHEN isento THEN 0
+                    ELSE GREATEST(CAST(:limite_min AS numeric), LEAST(CAST(:limite_max AS numeric), tlp_bruta)) / 100.0
+                END,
+                isento,
+                motivo
+            FROM calculo
+        """),
+        parametros
+    )
+    return result.rowcount
+
+
+def ler_isencoes(db, exercicio):
+    """TabelaIsencoes com as não incidências ativas do exercício."""
+    nao_incidencias_result = db.execute(
+        # Ordenado por created_at: havendo mais de um registro ativo, prevalece o mais recente
+        text("SELECT codg_inscricao_lan, motivo FROM tlp.tlp_nao_incidencia WHERE exercicio = :ex AND ativo = true ORDER BY created_at"),
+        {"ex": exercicio}
+    ).fetchall()
+    return TabelaIsencoes({row[0]: row[1] for row in nao_incidencias_result})
+
+
+def ler_base_em_lotes(db, id_versao, tamanho=BATCH_SIZE):
+    """Lê uma versão da base de imóveis em batches, em uma única passada ordenada por inscrição.
+
+    Paginação por keyset: cada batch continua a partir da última inscrição lida,
+    em vez de OFFSET (que reordena e descarta todas as linhas anteriores a cada batch).
+    """
+    ultima_inscricao = None
+    while True:
+        if ultima_inscricao is None:
+            imoveis_batch = db.execute(
+                text("""
+                    SELECT codg_inscricao_lan, nome_contribuinte_lan, uso_classificado, atividade_considerada
+                    FROM tlp.tlp_base_imovel
+                    WHERE id_versao = :versao
+                    ORDER BY codg_inscricao_lan
+                    LIMIT :limit
+                """),
+                {"limit": tamanho, "versao": id_versao}
+            ).fetchall()
+        else:
+            imoveis_batch = db.execute(
+                text("""
+                    SELECT codg_inscricao_lan, nome_contribuinte_lan, uso_classificado, atividade_considerada
+                    FROM tlp.tlp_base_imovel
+                    WHERE id_versao = :versao AND codg_inscricao_lan > :ultima
+                    ORDER BY codg_inscricao_lan
+                    LIMIT :limit
+                """),
+                {"limit": tamanho, "versao": id_versao, "ultima": ultima_inscricao}
+            ).fetchall()
+        
+        if not imoveis_batch:
+            return  # Fim dos dados
+        
+        ultima_inscricao = imoveis_batch[-1][0]
+        yield imoveis_batch
+        
+        # Consulta de leitura não precisa manter transação aberta entre batches
+        db.commit()
+
+
+def _processar_em_pipeline(id_simulacao, id_versao, total_imoveis, custo_final, limite_min, limite_max,
+                           isencoes, progresso, resumo, profundidade_fila=None, deve_parar=None, perfil=None):
+    """Calcula e grava todos os itens com o pipeline leitura → cálculo → escrita.
+
+    As estatísticas de /resultado são acumuladas em `resumo` (ResumoSimulacao) a cada batch.
+    `perfil` (PerfilExecucao) mede cada etapa por batch.
+    """
+    perfil = perfil or PerfilExecucao()
+    leitor_db = SessionLocal()
+    escritor_db = SessionLocal()
+    gravados = {"itens": 0}
+    
+    def calcular(imoveis_batch):
+        if deve_parar is not None and deve_parar():
+            raise ProcessamentoCancelado("Processamento cancelado")
+        
+        # Calcular o batch inteiro de uma vez (kernel vetorizado, centavos inteiros)
+        codigos, nomes, usos, atividades = zip(*imoveis_batch)
+        with perfil.medir("calculo.kernel"):
+            resultado = calcular_lote(
+                codigos, usos, custo_final, total_imoveis, limite_min, limite_max, isencoes
+            )
+        with perfil.medir("calculo.resumo"):
+            resumo.adicionar(resultado)
+        with perfil.medir("calculo.buffer"):
+            return montar_buffer_itens_simulacao(id_simulacao, linhas_para_copy(resultado, nomes, atividades))
+    
+    def gravar(buffer_e_quantidade):
+        buffer, quantidade = buffer_e_quantidade
+        # Inserir batch via COPY FROM STDIN (um único envio por batch)
+        with perfil.medir("escrita.copy"):
+            copiar_buffer(escritor_db, "tlp.tlp_simulacao_item", COLUNAS_SIMULACAO_ITEM, buffer)
+        gravados["itens"] += quantidade
+        with perfil.medir("escrita.commit"):
+            escritor_db.commit()  # Commit parcial a cada batch
+        ITENS_SIMULACAO.inc(quantidade, engine='python')
+        BATCHES_SIMULACAO.inc()
+        
+        # Progresso em canal próprio (tlp_simulacao_progresso), com frequência limitada
+        with perfil.medir("escrita.progresso"):
+            progresso.avancar(gravados["itens"])
+    
+    try:
+        estatisticas = executar_pipeline(
+            perfil.iterar("leitura.consulta", ler_base_em_lotes(leitor_db, id_versao)),
+            calcular,
+            gravar,
+            profundidade=profundidade_fila or PROFUNDIDADE_FILA_PADRAO
+        )
+    except BaseException:
+        escritor_db.rollback()
+        raise
+    finally:
+        leitor_db.close()
+        escritor_db.close()
+    
+    estatisticas["itens_criados"] = gravados["itens"]
+    return estatisticas
+
+
+def processar_simulacao(db, id_simulacao, engine='python', deve_parar=None, profundidade_fila=None,
+                        perfil=False, cprofile=False):
+    """Processa a simulação: calcula TLP para cada imóvel e salva os resultados.
+    
+    engine=python (padrão) calcula em batches no Python; engine=sql executa todo o
+    cálculo no banco com um único INSERT ... SELECT (mesmo resultado).
+    `deve_parar` é uma função opcional consultada a cada batch; se retornar True,
+    o processamento é interrompido com ProcessamentoCancelado.
+    
+    OTIMIZADO para baixo uso de memória e tempo total:
+    - Lê a base em uma única passada, paginando por keyset (codg_inscricao_lan)
+    - Processa em batches de 1000 imóveis
+    - Leitura, cálculo e escrita rodam em pipeline (pipeline.py), com filas de
+      `profundidade_fila` batches (padrão TLP_PIPELINE_PROFUNDIDADE)
+    - Grava cada batch com COPY FROM STDIN (bulk_copy)
+    - Commits parciais a cada batch
+    - Progresso em tlp_simulacao_progresso (progresso.py), não no parametros_snapshot
+    - Resumo de /resultado acumulado por batch e gravado ao concluir (resumo.py)
+    
+    Com perfil=True (ou cprofile=True, que inclui o dump do cProfile), os tempos de
+    cada etapa são gravados em tlp_simulacao_perfil ao final (perfil.py).
+    """
+    from models import TlpSimulacao
+    
+    if engine not in ENGINES_PROCESSAMENTO:
+        raise ErroProcessamento(f"Engine inválida: {engine}. Use {', '.join(ENGINES_PROCESSAMENTO)}")
+    
+    # 1. Buscar simulação
+    sim = db.query(TlpSimulacao).filter(TlpSimulacao.id_simulacao == id_simulacao).first()
+    if not sim:
+        raise ErroProcessamento("Simulação não encontrada")
+    
+    if sim.status in ('CONCLUIDO', 'CONVERTIDO_LOTE'):
+        raise ErroProcessamento("Simulação já foi processada")
+    
+    progresso = RegistroProgresso(sim.id_simulacao)
+    registro_perfil = PerfilExecucao(perfil, cprofile)
+    registro_perfil.iniciar()
+    try:
+        # Atualiza status; início e andamento ficam no canal de progresso
+        sim.status = 'EM_PROCESSAMENTO'
+        db.commit()
+        invalidar_cache(CACHE_SIMULACOES)
+        progresso.fase('PREPARANDO')
+        
+        # 2. Extrair parâmetros do snapshot
+        params = sim.parametros_snapshot or {}
+        custo_final, limite_min, limite_max = parametros_do_snapshot(params)  # em centavos
+        exercicio = sim.exercicio
+        
+        # 3. Buscar não incidências do exercício (tabela ordenada para busca vetorizada)
+        with registro_perfil.medir("preparacao.nao_incidencia"):
+            isencoes = ler_isencoes(db, exercicio)
+        
+        # 4. Versão da base materializada (total de imóveis já contado na atualização)
+        with registro_perfil.medir("preparacao.base"):
+            versao = garantir_versao(db)
+            total_imoveis = versao.total_imoveis or 0
+            sim.id_versao_base = versao.id_versao
+            db.commit()
+        invalidar_cache(CACHE_SIMULACOES)
+        
+        if total_imoveis == 0:
+            raise ErroProcessamento("Nenhum imóvel encontrado na base")
+        
+        # 5. Partição da simulação: criada, ou esvaziada com TRUNCATE se reprocessando
+        with registro_perfil.medir("preparacao.particao"):
+            preparar_particao(db, sim.id_simulacao)
+            remover_resumo(db, sim.id_simulacao)
+            db.commit()
+        
+        # 6. Calcular e gravar os itens
+        progresso.fase('CALCULANDO', total_imoveis=total_imoveis)
+        estatisticas_pipeline = None
+        if engine == 'sql':
+            # Motor "in-database": um único INSERT ... SELECT, nenhuma linha passa pelo Python
+            with registro_perfil.medir("sql.insert"):
+                itens_criados = inserir_itens_sql(
+                    db, sim.id_simulacao, versao.id_versao, exercicio, total_imoveis,
+                    custo_final, limite_min, limite_max
+                )
+            # Resumo agregado no banco, sobre a partição recém-gravada
+            with registro_perfil.medir("sql.resumo"):
+                resumo = calcular_resumo_itens(db, sim.id_simulacao)
+                db.commit()
+            ITENS_SIMULACAO.inc(itens_criados, engine='sql')
+        else:
+            # Pipeline: leitura, cálculo e escrita sobrepostos, cada estágio com sua conexão
+            acumulador = ResumoSimulacao()
+            estatisticas_pipeline = _processar_em_pipeline(
+                sim.id_simulacao, versao.id_versao, total_imoveis, custo_final, limite_min, limite_max,
+                isencoes, progresso, acumulador, profundidade_fila, deve_parar, registro_perfil
+            )
+            itens_criados = estatisticas_pipeline["itens_criados"]
+            resumo = acumulador.como_dict()
+            for estagio, valores in estatisticas_pipeline["estagios"].items():
+                ESTAGIOS_PIPELINE.inc(valores["ocupado_segundos"], estagio=estagio)
+            print(f"Simulação {sim.id_simulacao}: pipeline {estatisticas_pipeline}")
+        
+        # 7. Gravar resumo do resultado e atualizar status da simulação (mesma transação)
+        with registro_perfil.medir("finalizacao"):
+            if deve_parar is not None and deve_parar():
+                raise ProcessamentoCancelado("Processamento cancelado")
+            # Só conclui se continuar EM_PROCESSAMENTO: um reset concorrente já removeu
+            # a partição e voltou a simulação para RASCUNHO
+            concluida = db.execute(
+                text("""
+                    UPDATE tlp.tlp_simulacao SET status = 'CONCLUIDO'
+                    WHERE id_simulacao = :id AND status = 'EM_PROCESSAMENTO'
+                """),
+                {"id": str(sim.id_simulacao)}
+            ).rowcount
+            if not concluida:
+                raise ProcessamentoCancelado("Simulação resetada durante o processamento")
+            gravar_resumo(db, sim.id_simulacao, resumo, 'PROCESSAMENTO')
+            db.commit()
+        invalidar_cache(CACHE_SIMULACOES)
+        progresso.concluir(itens_criados)
+        EXECUCOES_SIMULACAO.inc(engine=engine, resultado='CONCLUIDO')
+        if registro_perfil.ativo:
+            gravar_perfil(sim.id_simulacao, engine, 'CONCLUIDO', registro_perfil)
+        
+        resposta = {
+            "message": "Simulação processada com sucesso",
+            "total_imoveis": total_imoveis,
+            "itens_criados": itens_criados
+        }
+        if estatisticas_pipeline is not None:
+            resposta["pipeline"] = estatisticas_pipeline
+        return resposta
+        
+    except ProcessamentoCancelado:
+        db.rollback()
+        EXECUCOES_SIMULACAO.inc(engine=engine, resultado='CANCELADO')
+        if registro_perfil.ativo:
+            gravar_perfil(id_simulacao, engine, 'CANCELADO', registro_perfil)
+        raise
+    except Exception as e:
+        db.rollback()
+        EXECUCOES_SIMULACAO.inc(engine=engine, resultado='ERRO')
+        if registro_perfil.ativo:
+            gravar_perfil(id_simulacao, engine, 'ERRO', registro_perfil)
+        # Tentar reverter status e salvar mensagem de erro
+        try:
+            sim = db.query(TlpSimulacao).filter(TlpSimulacao.id_simulacao == id_simulacao).first()
+            # Simulação resetada no meio do processamento não volta para ERRO
+            if sim and sim.status == 'EM_PROCESSAMENTO':
+                sim.status = 'ERRO'
+                db.commit()
+                invalidar_cache(CACHE_SIMULACOES)
+                # Erro detalhado no canal de progresso, para exibição posterior
+                progresso.erro(str(e))
+        except Exception:
+            db.rollback()
+        raise
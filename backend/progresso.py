@@ -0,0 +1,202 @@
+"""Canal de progresso das simulações (tlp.tlp_simulacao_progresso).
+
+A telemetria de execução (fase, itens, linhas/s, ETA, erro) fica em uma tabela
+pequena, uma linha por simulação, separada do parametros_snapshot, que é o
+registro imutável dos parâmetros. As gravações usam transações próprias e curtas
+e são limitadas no tempo (no máximo uma a cada TLP_PROGRESSO_INTERVALO segundos),
+independentemente do tamanho do batch.
+"""
+import os
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+from database import engine
+from metricas import FASES_SIMULACAO, VAZAO_SIMULACAO
+
+INTERVALO_MINIMO = float(os.getenv("TLP_PROGRESSO_INTERVALO", "1.0"))
+
+FASES_FINAIS = ('CONCLUIDO', 'ERRO')
+
+_UPSERT = text("""
+    INSERT INTO tlp.tlp_simulacao_progresso
+        (id_simulacao, fase, itens_processados, total_imoveis, progresso_percentual,
+         linhas_por_segundo, eta_segundos, inicio_processamento, erro_mensagem, erro_timestamp, atualizado_em)
+    VALUES
+        (:id_simulacao, :fase, :itens_processados, :total_imoveis, :progresso_percentual,
+         :linhas_por_segundo, :eta_segundos, :inicio_processamento, :erro_mensagem, :erro_timestamp, now())
+    ON CONFLICT (id_simulacao) DO UPDATE SET
+        fase = EXCLUDED.fase,
+        itens_processados = EXCLUDED.itens_processados,
+        total_imoveis = EXCLUDED.total_imoveis,
+        progresso_percentual = EXCLUDED.progresso_percentual,
+        linhas_por_segundo = EXCLUDED.linhas_por_segundo,
+        eta_segundos = EXCLUDED.eta_segundos,
+        inicio_processamento = EXCLUDED.inicio_processamento,
+        erro_mensagem = EXCLUDED.erro_mensagem,
+        erro_timestamp = EXCLUDED.erro_timestamp,
+        atualizado_em = now()
+""")
+
+
+def _gravar(conn, estado):
+    conn.execute(_UPSERT, estado)
+
+
+def marcar_enfileirado(db, id_simulacao):
+    """Zera o progresso ao enfileirar (na transação de quem chama)."""
+    _gravar(db, {
+        "id_simulacao": str(id_simulacao),
+        "fase": 'ENFILEIRADO',
+        "itens_processados": 0,
+        "total_imoveis": 0,
+        "progresso_percentual": 0,
+        "linhas_por_segundo": None,
+        "eta_segundos": None,
+        "inicio_processamento": None,
+        "erro_mensagem": None,
+        "erro_timestamp": None,
+    })
+
+
+def marcar_erro(conn, id_simulacao, mensagem):
+    """Registra erro sem apagar o restante da telemetria (usado fora do RegistroProgresso)."""
+    conn.execute(
+        text("""
+            INSERT INTO tlp.tlp_simulacao_progresso (id_simulacao, fase, erro_mensagem, erro_timestamp, atualizado_em)
+            VALUES (:id, 'ERRO', :msg, now(), now())
+            ON CONFLICT (id_simulacao) DO UPDATE SET
+                fase = 'ERRO', erro_mensagem = EXCLUDED.erro_mensagem,
+                erro_timestamp = EXCLUDED.erro_timestamp, atualizado_em = now()
+        """),
+        {"id": str(id_simulacao), "msg": mensagem}
+    )
+
+
+def remover(db, id_simulacao):
+    db.execute(
+        text("DELETE FROM tlp.tlp_simulacao_progresso WHERE id_simulacao = :id"),
+        {"id": str(id_simulacao)}
+    )
+
+
+def ler_progresso(db, id_simulacao):
+    """Linha de progresso da simulação como dict, ou None."""
+    row = db.execute(
+        text("""
+            SELECT fase, itens_processados, total_imoveis, progresso_percentual, linhas_por_segundo,
+                   eta_segundos, inicio_processamento, erro_mensagem, erro_timestamp, atualizado_em
+            FROM tlp.tlp_simulacao_progresso
+            WHERE id_simulacao = :id
+        """),
+        {"id": str(id_simulacao)}
+    ).mappings().fetchone()
+    return dict(row) if row else None
+
+
+def progresso_da_simulacao(db, id_simulacao):
+    """Resposta de /simulacoes/{id}/progresso, ou None se a simulação não existe.
+
+    Simulações processadas antes do canal de progresso ainda têm esses campos
+    no parametros_snapshot.
+    """
+    from models import TlpSimulacao
+
+    sim = db.query(TlpSimulacao).filter(TlpSimulacao.id_simulacao == id_simulacao).first()
+    if not sim:
+        return None
+
+    progresso = ler_progresso(db, sim.id_simulacao) or dict(sim.parametros_snapshot or {})
+    return {
+        "status": sim.status,
+        "fase": progresso.get('fase'),
+        "progresso_percentual": progresso.get('progresso_percentual') or 0,
+        "itens_processados": progresso.get('itens_processados') or 0,
+        "total_imoveis": progresso.get('total_imoveis') or 0,
+        "linhas_por_segundo": progresso.get('linhas_por_segundo'),
+        "eta_segundos": progresso.get('eta_segundos'),
+        "concluido": sim.status == 'CONCLUIDO',
+        "erro": sim.status == 'ERRO',
+        "erro_mensagem": progresso.get('erro_mensagem'),
+        "erro_timestamp": progresso.get('erro_timestamp'),
+        "inicio_processamento": progresso.get('inicio_processamento')
+    }
+
+
+class RegistroProgresso:
+    """Acompanha uma execução e grava a telemetria com limitação de frequência.
+
+    Mudanças de fase, conclusão e erro são gravadas sempre; avancar() só grava
+    se já passou `intervalo` segundos desde a última gravação.
+    """
+
+    def __init__(self, id_simulacao, intervalo=INTERVALO_MINIMO):
+        self.intervalo = intervalo
+        self._ultima_gravacao = 0.0
+        self._inicio_relogio = time.monotonic()
+        self._inicio_fase = self._inicio_relogio
+        self._inicio_calculo = None
+        self.estado = {
+            "id_simulacao": str(id_simulacao),
+            "fase": 'PREPARANDO',
+            "itens_processados": 0,
+            "total_imoveis": 0,
+            "progresso_percentual": 0,
+            "linhas_por_segundo": None,
+            "eta_segundos": None,
+            "inicio_processamento": datetime.now(timezone.utc),
+            "erro_mensagem": None,
+            "erro_timestamp": None,
+        }
+
+    def _persistir(self):
+        with engine.begin() as conn:
+            _gravar(conn, self.estado)
+        self._ultima_gravacao = time.monotonic()
+
+    def _encerrar_fase(self):
+        """Soma a duração da fase atual em tlp_simulacao_fase_segundos_total."""
+        agora = time.monotonic()
+        FASES_SIMULACAO.inc(agora - self._inicio_fase, fase=self.estado["fase"])
+        self._inicio_fase = agora
+        return agora
+
+    def fase(self, fase, total_imoveis=None):
+        agora = self._encerrar_fase()
+        if fase == 'CALCULANDO':
+            self._inicio_calculo = agora
+        self.estado["fase"] = fase
+        if total_imoveis is not None:
+            self.estado["total_imoveis"] = total_imoveis
+        self._persistir()
+
+    def avancar(self, itens_processados):
+        total = self.estado["total_imoveis"] or 0
+        decorrido = time.monotonic() - self._inicio_relogio
+        taxa = itens_processados / decorrido if decorrido > 0 else None
+
+        self.estado["itens_processados"] = itens_processados
+        self.estado["progresso_percentual"] = min(100, int(itens_processados * 100 / total)) if total else 0
+        self.estado["linhas_por_segundo"] = round(taxa, 2) if taxa else None
+        self.estado["eta_segundos"] = int((total - itens_processados) / taxa) if taxa and total else None
+
+        if time.monotonic() - self._ultima_gravacao >= self.intervalo or itens_processados >= total:
+            self._persistir()
+
+    def concluir(self, itens_processados):
+        self.avancar(itens_processados)
+        agora = self._encerrar_fase()
+        if self._inicio_calculo is not None and agora > self._inicio_calculo:
+            VAZAO_SIMULACAO.set(round(itens_processados / (agora - self._inicio_calculo), 2))
+        self.estado["fase"] = 'CONCLUIDO'
+        self.estado["progresso_percentual"] = 100
+        self.estado["eta_segundos"] = 0
+        self._persistir()
+
+    def erro(self, mensagem):
+        self._encerrar_fase()
+        self.estado["fase"] = 'ERRO'
+        self.estado["erro_mensagem"] = mensagem
+        self.estado["erro_timestamp"] = datetime.now(timezone.utc)
+        self._persistir()
@@ -0,0 +1,109 @@
+"""Transmissão do progresso das simulações via Server-Sent Events.
+
+Um único TransmissorProgresso por simulação consulta o banco (uma leitura a cada
+TLP_PROGRESSO_STREAM_INTERVALO segundos) e repassa o estado a todos os
+assinantes conectados, somente quando ele muda: N abas acompanhando a mesma
+simulação custam uma consulta, não N. O transmissor termina quando a simulação
+sai de EM_PROCESSAMENTO (CONCLUIDO, ERRO ou resetada) ou quando o último
+assinante se desconecta.
+"""
+import asyncio
+import json
+import os
+
+from fastapi.encoders import jsonable_encoder
+
+from database import AsyncSessionLocal
+from progresso import progresso_da_simulacao
+
+INTERVALO_CONSULTA = float(os.getenv("TLP_PROGRESSO_STREAM_INTERVALO", "1.0"))
+INTERVALO_KEEPALIVE = 15.0  # comentário SSE para manter proxies com a conexão aberta
+
+_FIM = object()
+
+_transmissores = {}
+
+
+async def consultar_progresso(id_simulacao):
+    """Leitura do progresso com sessão assíncrona própria (não bloqueia o event loop)."""
+    async with AsyncSessionLocal() as db:
+        progresso = await db.run_sync(progresso_da_simulacao, id_simulacao)
+        return jsonable_encoder(progresso) if progresso is not None else None
+
+
+def _finalizado(progresso):
+    return progresso is None or progresso["status"] != 'EM_PROCESSAMENTO'
+
+
+def _formatar_evento(progresso):
+    return f"event: progresso\ndata: {json.dumps(progresso, ensure_ascii=False)}\n\n"
+
+
+class TransmissorProgresso:
+    """Consulta o progresso de uma simulação e distribui as mudanças aos assinantes."""
+
+    def __init__(self, id_simulacao):
+        self.id_simulacao = id_simulacao
+        self.assinantes = set()
+        self.ultimo = None
+        self.tarefa = None
+
+    def assinar(self):
+        fila = asyncio.Queue()
+        if self.ultimo is not None:
+            # Quem chega depois recebe o último estado conhecido sem esperar a próxima mudança
+            fila.put_nowait(self.ultimo)
+        self.assinantes.add(fila)
+        if self.tarefa is None:
+            self.tarefa = asyncio.get_running_loop().create_task(self._executar())
+        return fila
+
+    def cancelar_assinatura(self, fila):
+        self.assinantes.discard(fila)
+
+    def _distribuir(self, item):
+        for fila in self.assinantes:
+            fila.put_nowait(item)
+
+    async def _executar(self):
+        try:
+            while self.assinantes:
+                progresso = await consultar_progresso(self.id_simulacao)
+                if progresso != self.ultimo:
+                    self.ultimo = progresso
+                    if progresso is not None:
+                        self._distribuir(progresso)
+                if _finalizado(progresso):
+                    break
+                await asyncio.sleep(INTERVALO_CONSULTA)
+        except Exception as e:
+            print(f"Transmissão de progresso falhou para {self.id_simulacao}: {e}")
+        finally:
+            if _transmissores.get(self.id_simulacao) is self:
+                del _transmissores[self.id_simulacao]
+            self._distribuir(_FIM)
+
+
+def assinar(id_simulacao):
+    """Inscreve um assinante no transmissor da simulação (criando-o se preciso). Retorna (transmissor, fila)."""
+    transmissor = _transmissores.get(id_simulacao)
+    if transmissor is None:
+        transmissor = _transmissores[id_simulacao] = TransmissorProgresso(id_simulacao)
+    return transmissor, transmissor.assinar()
+
+
+async def eventos_progresso(id_simulacao):
+    """Gerador de eventos SSE para uma conexão; termina junto com o transmissor."""
+    transmissor, fila = assinar(id_simulacao)
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(fila.get(), timeout=INTERVALO_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if item is _FIM:
+                return
+            yield _formatar_evento(item)
+    finally:
+        transmissor.cancelar_assinatura(fila)
@@ -0,0 +1,115 @@
+"""Resumo pré-calculado do resultado das simulações (tlp.tlp_simulacao_resumo).
+
+O processamento acumula as estatísticas batch a batch (calculo_tlp.ResumoSimulacao)
+e grava uma linha por simulação junto com o status CONCLUIDO; /resultado passa a
+ser a leitura dessa linha. A agregação sobre tlp_simulacao_item (calcular_resumo_itens)
+fica apenas para o engine sql, simulações antigas e verificação/reconstrução
+(/resultado?recalcular=true).
+"""
+import json
+
+from sqlalchemy import text
+
+from calculo_tlp import formatar_resumo, para_centavos
+
+
+def calcular_resumo_itens(db, id_simulacao):
+    """Agrega o resumo a partir dos itens gravados (uma passada sobre a partição da simulação)."""
+    linhas = db.execute(
+        text("""
+            SELECT uso_classificado,
+                   COUNT(*) AS quantidade,
+                   COALESCE(SUM(tlp_calculada), 0) AS total,
+                   MIN(tlp_calculada) AS minimo,
+                   MAX(tlp_calculada) AS maximo,
+                   COUNT(*) FILTER (WHERE nao_incidencia) AS isentos
+            FROM tlp.tlp_simulacao_item
+            WHERE id_simulacao = :id
+            GROUP BY uso_classificado
+        """),
+        {"id": str(id_simulacao)}
+    ).fetchall()
+
+    por_uso = {}
+    minimos, maximos = [], []
+    total_isentos = 0
+    for uso, quantidade, total, minimo, maximo, isentos in linhas:
+        por_uso[uso] = [quantidade, para_centavos(total)]
+        if minimo is not None:
+            minimos.append(para_centavos(minimo))
+            maximos.append(para_centavos(maximo))
+        total_isentos += isentos
+
+    return formatar_resumo(
+        por_uso,
+        sum(total for _, total in por_uso.values()),
+        min(minimos) if minimos else None,
+        max(maximos) if maximos else None,
+        total_isentos
+    )
+
+
+def gravar_resumo(db, id_simulacao, resumo, origem):
+    """Grava (ou substitui) o resumo da simulação na transação de quem chama."""
+    estatisticas = resumo["estatisticas"]
+    db.execute(
+        text("""
+            INSERT INTO tlp.tlp_simulacao_resumo
+                (id_simulacao, total_imoveis, total_arrecadado, min_tlp, max_tlp, total_isentos, por_uso, origem, created_at)
+            VALUES
+                (:id, :total_imoveis, :total_arrecadado, :min_tlp, :max_tlp, :total_isentos, CAST(:por_uso AS jsonb), :origem, now())
+            ON CONFLICT (id_simulacao) DO UPDATE SET
+                total_imoveis = EXCLUDED.total_imoveis,
+                total_arrecadado = EXCLUDED.total_arrecadado,
+                min_tlp = EXCLUDED.min_tlp,
+                max_tlp = EXCLUDED.max_tlp,
+                total_isentos = EXCLUDED.total_isentos,
+                por_uso = EXCLUDED.por_uso,
+                origem = EXCLUDED.origem,
+                created_at = now()
+        """),
+        {
+            "id": str(id_simulacao),
+            "total_imoveis": estatisticas["total_imoveis"],
+            "total_arrecadado": estatisticas["total_arrecadado"],
+            "min_tlp": estatisticas["min_tlp"],
+            "max_tlp": estatisticas["max_tlp"],
+            "total_isentos": estatisticas["total_isentos"],
+            "por_uso": json.dumps(resumo["por_uso"]),
+            "origem": origem,
+        }
+    )
+
+
+def ler_resumo(db, id_simulacao):
+    """Resumo gravado no formato de /resultado ({"estatisticas", "por_uso"}), ou None."""
+    row = db.execute(
+        text("""
+            SELECT total_imoveis, total_arrecadado, min_tlp, max_tlp, total_isentos, por_uso
+            FROM tlp.tlp_simulacao_resumo
+            WHERE id_simulacao = :id
+        """),
+        {"id": str(id_simulacao)}
+    ).fetchone()
+    if row is None:
+        return None
+
+    total_imoveis, total_arrecadado, min_tlp, max_tlp, total_isentos, por_uso = row
+    return {
+        "estatisticas": {
+            "total_imoveis": total_imoveis,
+            "total_arrecadado": float(total_arrecadado),
+            "media_tlp": para_centavos(total_arrecadado) / total_imoveis / 100 if total_imoveis else 0.0,
+            "min_tlp": float(min_tlp or 0),
+            "max_tlp": float(max_tlp or 0),
+            "total_isentos": total_isentos
+        },
+        "por_uso": por_uso
+    }
+
+
+def remover_resumo(db, id_simulacao):
+    db.execute(
+        text("DELETE FROM tlp.tlp_simulacao_resumo WHERE id_simulacao = :id"),
+        {"id": str(id_simulacao)}
+    )
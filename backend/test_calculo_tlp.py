@@ -0,0 +1,162 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+
+from calculo_tlp import (
+    FATORES_USO, MOTIVO_USO_ISENTO, ResumoSimulacao, TabelaIsencoes, aplicar_parametros, calcular_lote,
+    centavos_para_texto, classificar_lote, estatisticas_por_grupos, linhas_para_copy, para_centavos,
+    parametros_do_snapshot
+)
+
+
+def calculo_referencia(codg, uso_raw, custo_final, total, limite_min, limite_max, isentas):
+    """Regra original (loop por imóvel com Decimal), arredondada como o NUMERIC(18, 2)."""
+    uso = (uso_raw or 'RESIDENCIAL').upper()
+    fator = Decimal(str(FATORES_USO.get(uso, 1.0)))
+    tlp_bruta = Decimal(str(custo_final)) / Decimal(total) * fator
+    is_isento = codg in isentas
+    motivo = isentas.get(codg)
+    if uso in ['PUBLICO', 'FILANTROPICO', 'PUBLICO/FILANTROPICO']:
+        is_isento = True
+        motivo = motivo or MOTIVO_USO_ISENTO
+    if is_isento:
+        tlp_calculada = Decimal('0')
+    else:
+        tlp_calculada = max(Decimal(str(limite_min)), min(Decimal(str(limite_max)), tlp_bruta))
+    centavos = Decimal('0.01')
+    return (
+        uso,
+        tlp_bruta.quantize(centavos, rounding=ROUND_HALF_UP),
+        tlp_calculada.quantize(centavos, rounding=ROUND_HALF_UP),
+        is_isento,
+        motivo,
+    )
+
+
+def test_para_centavos():
+    assert para_centavos(258) == 25800
+    assert para_centavos(1600.08) == 160008
+    assert para_centavos('10.005') == 1001
+    assert para_centavos(None) == 0
+
+
+def test_centavos_para_texto():
+    assert centavos_para_texto(np.array([0, 5, 123456, -250])) == ['0.00', '0.05', '1234.56', '-2.50']
+
+
+def test_parametros_do_snapshot_usa_custo_final_quando_presente():
+    assert parametros_do_snapshot({'custo_tlp_base': 100, 'custo_final': 80}) == (8000, 25800, 160008)
+    assert parametros_do_snapshot({'custo_tlp_base': 100, 'limite_min_atualizado': 1,
+                                   'limite_max_atualizado': 2}) == (10000, 100, 200)
+
+
+def test_fatores_e_limites():
+    resultado = calcular_lote(
+        ['1', '2', '3', '4'],
+        ['RESIDENCIAL', 'SERVICO', 'COMERCIO', 'INDUSTRIA'],
+        custo_final_centavos=400000,
+        total_imoveis=1000,
+        limite_min_centavos=420,
+        limite_max_centavos=700,
+    )
+    assert resultado.fator_centesimos.tolist() == [100, 120, 150, 200]
+    assert resultado.tlp_bruta_centavos.tolist() == [400, 480, 600, 800]
+    assert resultado.tlp_calculada_centavos.tolist() == [420, 480, 600, 700]
+    assert not resultado.nao_incidencia.any()
+
+
+def test_uso_nulo_vazio_e_minusculo():
+    resultado = calcular_lote(['1', '2', '3', '4'], [None, '', 'comercio', 'OUTRO'], 100000, 100, 0, 10**9)
+    assert resultado.usos.tolist() == ['RESIDENCIAL', 'RESIDENCIAL', 'COMERCIO', 'OUTRO']
+    assert resultado.fator_centesimos.tolist() == [100, 100, 150, 100]
+
+
+def test_isencoes_por_cadastro_e_por_uso():
+    isencoes = TabelaIsencoes({'2': 'JUDICIAL', '3': None, '4': 'LEI 123'})
+    resultado = calcular_lote(
+        ['1', '2', '3', '4', '5'],
+        ['RESIDENCIAL', 'RESIDENCIAL', 'PUBLICO', 'FILANTROPICO', 'PUBLICO/FILANTROPICO'],
+        100000, 100, 258, 1600, isencoes
+    )
+    assert resultado.nao_incidencia.tolist() == [False, True, True, True, True]
+    assert resultado.tlp_calculada_centavos.tolist() == [1000, 0, 0, 0, 0]
+    assert resultado.motivos.tolist() == [None, 'JUDICIAL', MOTIVO_USO_ISENTO, 'LEI 123', MOTIVO_USO_ISENTO]
+
+
+def test_lote_vazio():
+    resultado = calcular_lote([], [], 100000, 100, 0, 100, TabelaIsencoes({'1': 'X'}))
+    assert len(resultado) == 0
+    assert list(linhas_para_copy(resultado, [], [])) == []
+
+
+def test_equivalente_ao_calculo_decimal():
+    rng = np.random.default_rng(42)
+    usos_possiveis = list(FATORES_USO) + [None, '', 'residencial', 'DESCONHECIDO']
+    n = 5000
+    codigos = [f"{i:014d}" for i in range(n)]
+    usos = [usos_possiveis[i] for i in rng.integers(0, len(usos_possiveis), n)]
+    isentas = {codigos[i]: ('MOTIVO' if i % 2 else None) for i in rng.integers(0, n, 200)}
+    total = 1_234_567
+
+    for custo_final, limite_min, limite_max in [
+        (987654321.99, 258, 1600.08),
+        (1_000_000, 0.5, 1.25),
+        (333.33, 0, 0),
+    ]:
+        custo_c, min_c, max_c = parametros_do_snapshot({
+            'custo_tlp_base': custo_final,
+            'limite_min_atualizado': limite_min,
+            'limite_max_atualizado': limite_max,
+        })
+        resultado = calcular_lote(codigos, usos, custo_c, total, min_c, max_c, TabelaIsencoes(isentas))
+        linhas = list(linhas_para_copy(resultado, [None] * n, [None] * n))
+
+        for i in range(n):
+            uso, bruta, calculada, isento, motivo = calculo_referencia(
+                codigos[i], usos[i], custo_final, total, limite_min, limite_max, isentas
+            )
+            linha = linhas[i]
+            assert linha[2] == uso
+            assert Decimal(linha[5]) == bruta
+            assert Decimal(linha[6]) == calculada
+            assert linha[7] == isento
+            assert linha[8] == motivo
+
+
+def test_resumo_acumulado_por_batch_igual_ao_agregado():
+    rng = np.random.default_rng(7)
+    usos_possiveis = list(FATORES_USO) + [None, 'residencial']
+    n = 3000
+    codigos = [f"{i:014d}" for i in range(n)]
+    usos = [usos_possiveis[i] for i in rng.integers(0, len(usos_possiveis), n)]
+    isentas = {codigos[i]: 'X' for i in rng.integers(0, n, 100)}
+    isencoes = TabelaIsencoes(isentas)
+    custo_c, total, min_c, max_c = 123456789, n, 258, 160008
+
+    resumo = ResumoSimulacao()
+    for inicio in range(0, n, 1000):
+        resumo.adicionar(calcular_lote(
+            codigos[inicio:inicio + 1000], usos[inicio:inicio + 1000], custo_c, total, min_c, max_c, isencoes
+        ))
+
+    grupos = {}
+    for codigo, uso in zip(codigos, usos):
+        chave = (uso, codigo in isentas)
+        grupos[chave] = grupos.get(chave, 0) + 1
+    esperado = estatisticas_por_grupos(
+        [(uso, isento, q) for (uso, isento), q in grupos.items()], custo_c, total, min_c, max_c
+    )
+    assert resumo.como_dict() == esperado
+
+
+def test_classificacao_reaplicada_a_varios_parametros():
+    codigos = ['1', '2', '3', '4']
+    usos = ['COMERCIO', None, 'PUBLICO', 'INDUSTRIA']
+    isencoes = TabelaIsencoes({'4': 'JUDICIAL'})
+    classificacao = classificar_lote(codigos, usos, isencoes)
+
+    for custo_c, min_c, max_c in [(100000, 0, 10**9), (100000, 3000, 4000), (987654, 258, 160008)]:
+        separado = calcular_lote(codigos, usos, custo_c, 4, min_c, max_c, isencoes)
+        reaplicado = aplicar_parametros(classificacao, custo_c, 4, min_c, max_c)
+        for campo in separado.__slots__:
+            assert getattr(reaplicado, campo).tolist() == getattr(separado, campo).tolist()
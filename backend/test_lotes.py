@@ -0,0 +1,85 @@
+import zlib
+from datetime import datetime, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+import lotes
+from lotes import FIM_LINHA, TAMANHO_LINHA, ArquivoRemessa, ErroRemessa
+
+LOTE = SimpleNamespace(id_lote="0f9e7b8a-0000-0000-0000-000000000001", exercicio=2026, versao=2)
+DATA = datetime(2026, 3, 15, 12, 0, tzinfo=timezone.utc)
+ITENS = [
+    ("00000000000001", "FULANO DE TAL", "RESIDENCIAL", Decimal("258.00")),
+    ("00000000000002", "X" * 80, "COMERCIO", Decimal("1600.08")),
+    ("00000000000003", "JOSÉ\r\nDA SILVA", None, Decimal("0.01")),
+]
+
+
+def gerar(monkeypatch, itens, total_registros, valor_total_centavos):
+    # Os itens chegam em blocos, como do cursor do lado do servidor
+    monkeypatch.setattr(lotes, "ler_em_blocos", lambda consulta, parametros: iter([itens[:2], itens[2:]]))
+    arquivo = ArquivoRemessa(LOTE, total_registros, valor_total_centavos, DATA)
+    conteudo = b"".join(arquivo)
+    linhas = conteudo.decode(lotes.CODIFICACAO).split(FIM_LINHA)
+    assert linhas[-1] == ""  # todas as linhas terminam com CRLF
+    return arquivo, conteudo, linhas[:-1]
+
+
+def test_linhas_com_150_posicoes(monkeypatch):
+    _, _, linhas = gerar(monkeypatch, ITENS, 3, 185809)
+    assert len(linhas) == 5
+    assert all(len(linha) == TAMANHO_LINHA for linha in linhas)
+    assert [linha[0] for linha in linhas] == ["0", "1", "1", "1", "9"]
+
+
+def test_header_e_trailer_com_totais(monkeypatch):
+    arquivo, _, linhas = gerar(monkeypatch, ITENS, 3, 185809)
+    header, trailer = linhas[0], linhas[-1]
+    assert header[1:21] == "REMESSA TLP".ljust(20)
+    assert header[21:25] == "2026"
+    assert header[25:28] == "002"
+    assert header[28:36] == "20260315"
+    assert header[36:45] == "000000003"
+    assert header[45:60] == "000000000185809"
+
+    assert (arquivo.registros, arquivo.valor_gerado_centavos) == (3, 185809)
+    assert trailer[1:10] == "000000003"
+    assert trailer[10:25] == "000000000185809"
+    assert trailer[25:33] == arquivo.checksum
+    assert trailer[33:].strip() == ""
+
+
+def test_detalhe_posicional(monkeypatch):
+    _, _, linhas = gerar(monkeypatch, ITENS, 3, 185809)
+    segundo, terceiro = linhas[2], linhas[3]
+    assert segundo[1:10] == "000000002"
+    assert segundo[10:30] == "00000000000002".ljust(20)
+    assert segundo[30:90] == "X" * 60  # contribuinte truncado em 60 posições
+    assert segundo[90:110] == "COMERCIO".ljust(20)
+    assert segundo[110:125] == "000000000160008"
+    assert terceiro[30:90] == "JOSÉ  DA SILVA".ljust(60)  # quebras de linha viram brancos
+    assert terceiro[90:110] == " " * 20
+
+
+def test_checksum_crc32_dos_detalhes(monkeypatch):
+    arquivo, conteudo, _ = gerar(monkeypatch, ITENS, 3, 185809)
+    linhas = conteudo.split(FIM_LINHA.encode())
+    crc = 0
+    for detalhe in linhas[1:4]:
+        crc = zlib.crc32(detalhe + FIM_LINHA.encode(), crc)
+    assert arquivo.checksum == f"{crc:08X}"
+
+
+def test_header_com_os_totais_informados_e_trailer_com_os_gerados(monkeypatch):
+    arquivo, _, linhas = gerar(monkeypatch, ITENS, 5, 999)
+    assert linhas[0][36:45] == "000000005"
+    assert linhas[-1][1:10] == "000000003"
+    assert (arquivo.registros, arquivo.valor_gerado_centavos) != (5, 999)
+
+
+def test_valor_que_nao_cabe_no_layout(monkeypatch):
+    itens = [("00000000000001", "A", "RESIDENCIAL", Decimal("10000000000000.00"))]
+    with pytest.raises(ErroRemessa, match="não cabe em 15 posições"):
+        gerar(monkeypatch, itens, 1, 1)
@@ -0,0 +1,42 @@
+import marshal
+import threading
+
+from perfil import PerfilExecucao
+
+
+def _trabalho():
+    return sum(i * i for i in range(20000))
+
+
+def test_cprofile_com_threads_do_pipeline():
+    registro = PerfilExecucao(cprofile=True)
+    registro.iniciar()
+
+    def estagio():
+        for _ in range(3):
+            with registro.medir("calculo.kernel"):
+                _trabalho()
+
+    threads = [threading.Thread(target=estagio) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with registro.medir("finalizacao"):
+        _trabalho()
+
+    dados, resumo_cprofile, dump = registro.finalizar()
+    assert dados["etapas"]["calculo.kernel"]["chamadas"] == 9
+    assert dados["etapas"]["finalizacao"]["chamadas"] == 1
+    assert "_trabalho" in resumo_cprofile
+    assert any(funcao[2] == "_trabalho" for funcao in marshal.loads(dump))
+
+
+def test_sem_perfil_ativo():
+    registro = PerfilExecucao()
+    registro.iniciar()
+    with registro.medir("etapa"):
+        pass
+    dados, resumo_cprofile, dump = registro.finalizar()
+    assert dados["etapas"] == {}
+    assert resumo_cprofile is None and dump is None
@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+
+import pytest
+
+import varredura
+from calculo_tlp import parametros_do_snapshot
+from varredura import ErroVarredura, montar_cenarios
+
+BASE = {"custo_tlp_base": 1000000, "limite_min_base": 50, "limite_max_base": 600}
+
+
+def test_valores_atualizados_derivados_como_no_frontend():
+    [snapshot] = montar_cenarios(cenarios=[{**BASE, "ipca_percentual": 4.5, "subsidio_percentual": 65}])
+    assert snapshot["custo_atualizado"] == 1045000.0
+    assert snapshot["valor_subsidio"] == 679250.0
+    assert snapshot["custo_final"] == 365750.0
+    assert snapshot["limite_min_atualizado"] == 52.25
+    assert snapshot["limite_max_atualizado"] == 627.0
+    assert parametros_do_snapshot(snapshot) == (36575000, 5225, 62700)
+
+
+def test_grade_de_ipca_e_subsidio_gera_parametros_distintos():
+    snapshots = montar_cenarios(
+        base=BASE,
+        grade={"ipca_percentual": {"inicio": 0, "fim": 10, "passo": 2.5}, "subsidio_percentual": [0, 50]}
+    )
+    assert len(snapshots) == 10
+    assert [s["ipca_percentual"] for s in snapshots[:4]] == [0.0, 0.0, 2.5, 2.5]
+    assert len({parametros_do_snapshot(s) for s in snapshots}) == 10
+
+
+def test_faixa_inclui_o_fim_sem_erro_de_float():
+    snapshots = montar_cenarios(base=BASE, grade={"limite_min_base": {"inicio": 0.1, "fim": 0.3, "passo": 0.1}})
+    assert [s["limite_min_base"] for s in snapshots] == [0.1, 0.2, 0.3]
+
+
+def test_limite_de_cenarios(monkeypatch):
+    monkeypatch.setattr(varredura, "MAX_CENARIOS", 6)
+    assert len(montar_cenarios(base=BASE, grade={"ipca_percentual": [1, 2, 3], "subsidio_percentual": [0, 10]})) == 6
+    with pytest.raises(ErroVarredura, match="gera 8 cenários"):
+        montar_cenarios(base=BASE, grade={"ipca_percentual": [1, 2, 3, 4], "subsidio_percentual": [0, 10]})
+    with pytest.raises(ErroVarredura, match="gera 11 valores"):
+        montar_cenarios(base=BASE, grade={"ipca_percentual": {"inicio": 0, "fim": 10, "passo": 1}})
+    with pytest.raises(ErroVarredura, match="7 cenários"):
+        montar_cenarios(cenarios=[BASE] * 7)
+
+
+@pytest.mark.parametrize("argumentos, mensagem", [
+    ({}, "um dos dois"),
+    ({"cenarios": [BASE], "grade": {"ipca_percentual": [1]}}, "um dos dois"),
+    ({"base": BASE, "grade": {"foo": [1]}}, "desconhecido"),
+    ({"base": BASE, "grade": {"limite_min_atualizado": [1]}}, "derivado"),
+    ({"cenarios": [{**BASE, "custo_final": 10}]}, "derivado"),
+    ({"base": BASE, "grade": {"ipca_percentual": []}}, "sem valores"),
+    ({"base": BASE, "grade": {"ipca_percentual": {"inicio": 1}}}, "inicio, fim e passo"),
+    ({"base": BASE, "grade": {"ipca_percentual": {"inicio": 1, "fim": 0, "passo": 1}}}, "passo deve ser positivo"),
+    ({"base": BASE, "grade": {"ipca_percentual": {"inicio": 0, "fim": 1, "passo": 0}}}, "passo deve ser positivo"),
+    ({"cenarios": [{"limite_max_base": 600}]}, "custo_tlp_base"),
+    ({"cenarios": [{"custo_tlp_base": 1000}]}, "limite_max_base"),
+    ({"cenarios": [{**BASE, "limite_min_base": 700}]}, "limite_max_base"),
+])
+def test_entradas_invalidas(argumentos, mensagem):
+    with pytest.raises(ErroVarredura, match=mensagem):
+        montar_cenarios(**argumentos)
+
+
+def test_resumo_sem_itens_usa_as_contagens_atuais(monkeypatch):
+    [snapshot] = montar_cenarios(cenarios=[BASE])
+    sim = SimpleNamespace(exercicio=2026, parametros_snapshot=snapshot)
+    contagens = {"grupos": [("residencial", False, 3), ("comercial", False, 1)]}
+    monkeypatch.setattr(varredura, "contagens_por_grupo", lambda db, exercicio: (1, contagens["grupos"]))
+
+    antes = varredura.resumo_sem_itens(None, sim)
+    contagens["grupos"] = [("residencial", False, 2), ("residencial", True, 1), ("comercial", False, 1)]
+    depois = varredura.resumo_sem_itens(None, sim)
+
+    assert antes["estatisticas"]["total_imoveis"] == depois["estatisticas"]["total_imoveis"] == 4
+    assert (antes["estatisticas"]["total_isentos"], depois["estatisticas"]["total_isentos"]) == (0, 1)
+    assert depois["estatisticas"]["total_arrecadado"] < antes["estatisticas"]["total_arrecadado"]
@@ -0,0 +1,370 @@
+"""Varredura de cenários: várias simulações calculadas em uma única passada pela base.
+
+POST /simulacoes/varredura recebe uma lista de conjuntos de parâmetros (ou uma
+grade sobre valores/faixas) e cria uma simulação por cenário, todas processadas
+por um único job VARREDURA:
+
+- sem itens (padrão): o resumo de /resultado de cada cenário sai das contagens
+  por (uso, isento) da base (base_imovel.contagens_por_grupo, uma agregação em
+  cache), como em /simulacoes/preview, e é gravado em tlp_simulacao_resumo. As
+  simulações continuam em RASCUNHO e podem ser processadas depois, se escolhidas;
+  enquanto em RASCUNHO, /resultado recalcula o resumo das contagens atuais
+  (resumo_sem_itens), que mudam com a versão da base e com a não incidência;
+- com itens (gravar_itens=true): a base é lida uma vez, em batches, pelo mesmo
+  pipeline de processamento.py. Cada batch é classificado uma vez (uso, fator,
+  não incidência: calculo_tlp.classificar_lote) e só a aplicação dos parâmetros
+  é repetida por cenário; os itens de todos os cenários do batch são gravados
+  na mesma transação. As simulações terminam CONCLUIDO, como no processamento
+  individual.
+
+Em ambos os casos a leitura da base e da não incidência não cresce com o número
+de cenários.
+"""
+import itertools
+import os
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy import text
+
+from bulk_copy import COLUNAS_SIMULACAO_ITEM, copiar_buffer, montar_buffer_itens_simulacao
+from cache import CACHE_SIMULACOES, invalidar_cache
+from base_imovel import contagens_por_grupo, garantir_versao
+from database import SessionLocal
+from metricas import BATCHES_SIMULACAO, ESTAGIOS_PIPELINE, EXECUCOES_SIMULACAO, ITENS_SIMULACAO
+from particoes import preparar_particao
+from pipeline import executar_pipeline
+from processamento import (
+    PROFUNDIDADE_FILA_PADRAO, ErroProcessamento, ProcessamentoCancelado, ler_base_em_lotes, ler_isencoes
+)
+from progresso import RegistroProgresso, marcar_erro
+from resumo import gravar_resumo, remover_resumo
+from calculo_tlp import (
+    ResumoSimulacao, aplicar_parametros, classificar_lote, estatisticas_por_grupos, linhas_para_copy,
+    parametros_do_snapshot
+)
+
+# Campos de entrada de cada cenário; os valores atualizados (custo final e limites)
+# são derivados deles em _snapshot, como no formulário de simulações do frontend
+CAMPOS_CENARIO = (
+    'custo_tlp_base',
+    'ipca_percentual',
+    'subsidio_percentual',
+    'limite_min_base',
+    'limite_max_base',
+)
+CAMPOS_DERIVADOS = ('limite_min_atualizado', 'limite_max_atualizado', 'custo_atualizado', 'valor_subsidio', 'custo_final')
+MAX_CENARIOS = int(os.getenv("TLP_VARREDURA_MAX_CENARIOS", "100"))
+
+ORIGEM_RESUMO = 'VARREDURA'
+
+
+class ErroVarredura(Exception):
+    """Cenários ou grade inválidos (campo desconhecido ou derivado, faixa vazia, cenários demais)."""
+
+
+def _valores_da_faixa(campo, faixa):
+    """Valores de inicio a fim (inclusive) com o passo informado, sem acúmulo de erro de float."""
+    if any(faixa.get(chave) is None for chave in ('inicio', 'fim', 'passo')):
+        raise ErroVarredura(f"Faixa de {campo} deve ter inicio, fim e passo")
+    inicio, fim, passo = (Decimal(str(faixa[chave])) for chave in ('inicio', 'fim', 'passo'))
+    if passo <= 0 or fim < inicio:
+        raise ErroVarredura(f"Faixa inválida para {campo}: passo deve ser positivo e fim >= inicio")
+    quantidade = int((fim - inicio) / passo) + 1
+    if quantidade > MAX_CENARIOS:
+        raise ErroVarredura(f"Faixa de {campo} gera {quantidade} valores (máximo {MAX_CENARIOS} cenários)")
+    return [float(inicio + passo * i) for i in range(quantidade)]
+
+
+def _validar_campos(campos, origem):
+    derivados = sorted(set(campos) & set(CAMPOS_DERIVADOS))
+    if derivados:
+        raise ErroVarredura(
+            f"Campo(s) derivado(s) em {origem}: {', '.join(derivados)}. "
+            f"Informe os valores base e ipca_percentual/subsidio_percentual"
+        )
+    desconhecidos = sorted(set(campos) - set(CAMPOS_CENARIO))
+    if desconhecidos:
+        raise ErroVarredura(
+            f"Campo(s) desconhecido(s) em {origem}: {', '.join(desconhecidos)}. Use {', '.join(CAMPOS_CENARIO)}"
+        )
+
+
+def _arredondar(valor):
+    """Duas casas, half-up (toFixed(2) do frontend)."""
+    return float(valor.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+
+
+def _snapshot(valores):
+    """parametros_snapshot completo, com os valores atualizados derivados dos valores base.
+
+    Mesmas contas do formulário de simulações (frontend/src/app/simulacoes/page.tsx):
+    custo_final = custo_tlp_base × (1 + IPCA) × (1 − subsídio) e
+    limite_*_atualizado = limite_*_base × (1 + IPCA).
+    """
+    def decimal(campo):
+        return Decimal(str(valores.get(campo) or 0))
+
+    custo_base = decimal('custo_tlp_base')
+    limite_min_base, limite_max_base = decimal('limite_min_base'), decimal('limite_max_base')
+    if custo_base <= 0:
+        raise ErroVarredura("custo_tlp_base deve ser positivo em cada cenário")
+    if limite_max_base <= 0 or limite_max_base < limite_min_base:
+        raise ErroVarredura("limite_max_base deve ser positivo e >= limite_min_base em cada cenário")
+
+    fator_ipca = 1 + decimal('ipca_percentual') / 100
+    custo_atualizado = custo_base * fator_ipca
+    subsidio = custo_atualizado * decimal('subsidio_percentual') / 100
+    snapshot = {campo: valores.get(campo) or 0 for campo in CAMPOS_CENARIO}
+    snapshot.update({
+        "limite_min_atualizado": _arredondar(limite_min_base * fator_ipca),
+        "limite_max_atualizado": _arredondar(limite_max_base * fator_ipca),
+        "custo_atualizado": _arredondar(custo_atualizado),
+        "valor_subsidio": _arredondar(subsidio),
+        "custo_final": _arredondar(custo_atualizado - subsidio),
+    })
+    return snapshot
+
+
+def montar_cenarios(cenarios=None, base=None, grade=None):
+    """Lista de parametros_snapshot: os `cenarios` informados ou o produto cartesiano da `grade`.
+
+    grade: {campo: [valores] ou {"inicio", "fim", "passo"}}, sobre CAMPOS_CENARIO; os
+    campos fora da grade vêm de `base`. ErroVarredura se a entrada for inválida.
+    """
+    if bool(cenarios) == bool(grade):
+        raise ErroVarredura("Informe a lista de cenários ou a grade (um dos dois)")
+
+    if cenarios:
+        for cenario in cenarios:
+            _validar_campos(cenario, "cenários")
+        snapshots = [_snapshot(cenario) for cenario in cenarios]
+    else:
+        base = base or {}
+        _validar_campos(base, "base")
+        _validar_campos(grade, "grade")
+        eixos = []
+        for campo, valores in grade.items():
+            if isinstance(valores, dict):
+                valores = _valores_da_faixa(campo, valores)
+            if not valores:
+                raise ErroVarredura(f"Grade sem valores para {campo}")
+            eixos.append([(campo, valor) for valor in valores])
+
+        quantidade = 1
+        for eixo in eixos:
+            quantidade *= len(eixo)
+        if quantidade > MAX_CENARIOS:
+            raise ErroVarredura(f"A grade gera {quantidade} cenários (máximo {MAX_CENARIOS})")
+        snapshots = [_snapshot({**base, **dict(combinacao)}) for combinacao in itertools.product(*eixos)]
+
+    if len(snapshots) > MAX_CENARIOS:
+        raise ErroVarredura(f"{len(snapshots)} cenários (máximo {MAX_CENARIOS})")
+    return snapshots
+
+
+def _varrer_base(cenarios, id_versao, total_imoveis, isencoes, progressos, profundidade_fila=None, deve_parar=None):
+    """Lê a base uma vez e grava os itens de todos os cenários. Retorna (resumos, estatísticas do pipeline).
+
+    cenarios: [(id_simulacao, (custo_final, limite_min, limite_max))], valores em centavos
+    """
+    leitor_db = SessionLocal()
+    escritor_db = SessionLocal()
+    resumos = [ResumoSimulacao() for _ in cenarios]
+    gravados = {"itens": 0}
+
+    def calcular(imoveis_batch):
+        if deve_parar is not None and deve_parar():
+            raise ProcessamentoCancelado("Varredura cancelada")
+
+        codigos, nomes, usos, atividades = zip(*imoveis_batch)
+        classificacao = classificar_lote(codigos, usos, isencoes)  # uma vez por batch, para todos os cenários
+        buffers = []
+        for (id_simulacao, (custo_final, limite_min, limite_max)), resumo in zip(cenarios, resumos):
+            resultado = aplicar_parametros(classificacao, custo_final, total_imoveis, limite_min, limite_max)
+            resumo.adicionar(resultado)
+            buffers.append(montar_buffer_itens_simulacao(id_simulacao, linhas_para_copy(resultado, nomes, atividades)))
+        return buffers
+
+    def gravar(buffers):
+        # Um COPY por cenário (cada um cai na partição da sua simulação), um commit por batch
+        for buffer, _ in buffers:
+            copiar_buffer(escritor_db, "tlp.tlp_simulacao_item", COLUNAS_SIMULACAO_ITEM, buffer)
+        escritor_db.commit()
+        quantidade = buffers[0][1]
+        gravados["itens"] += quantidade
+        ITENS_SIMULACAO.inc(quantidade * len(buffers), engine='varredura')
+        BATCHES_SIMULACAO.inc()
+        for progresso in progressos:
+            progresso.avancar(gravados["itens"])
+
+    try:
+        estatisticas = executar_pipeline(
+            ler_base_em_lotes(leitor_db, id_versao),
+            calcular,
+            gravar,
+            profundidade=profundidade_fila or PROFUNDIDADE_FILA_PADRAO
+        )
+    except BaseException:
+        escritor_db.rollback()
+        raise
+    finally:
+        leitor_db.close()
+        escritor_db.close()
+
+    estatisticas["itens_por_cenario"] = gravados["itens"]
+    return [resumo.como_dict() for resumo in resumos], estatisticas
+
+
+def _marcar_erro_cenarios(db, ids_simulacao, mensagem):
+    """Simulações da varredura ainda EM_PROCESSAMENTO vão para ERRO, com a mensagem no canal de progresso."""
+    from models import TlpSimulacao
+
+    try:
+        sims = db.query(TlpSimulacao).filter(
+            TlpSimulacao.id_simulacao.in_(ids_simulacao),
+            TlpSimulacao.status == 'EM_PROCESSAMENTO'
+        ).all()
+        for sim in sims:
+            sim.status = 'ERRO'
+            marcar_erro(db, sim.id_simulacao, mensagem)
+        db.commit()
+        if sims:
+            invalidar_cache(CACHE_SIMULACOES)
+    except Exception:
+        db.rollback()
+
+
+def resumo_sem_itens(db, sim):
+    """Resumo de um cenário sem itens (RASCUNHO), das contagens da base e da não incidência atuais.
+
+    O resumo gravado pela varredura reflete a base do momento em que ela rodou;
+    /resultado usa esta função para não servir números de uma base já substituída.
+    """
+    _, grupos = contagens_por_grupo(db, sim.exercicio)
+    total_imoveis = sum(quantidade for _, _, quantidade in grupos)
+    custo_final, limite_min, limite_max = parametros_do_snapshot(sim.parametros_snapshot)
+    return estatisticas_por_grupos(grupos, custo_final, total_imoveis, limite_min, limite_max)
+
+
+def processar_varredura(db, ids_simulacao, gravar_itens=False, deve_parar=None, profundidade_fila=None):
+    """Calcula todos os cenários (simulações) da varredura em uma única leitura da base.
+
+    Grava o resumo de cada cenário e, com gravar_itens=True, os itens (simulações
+    CONCLUIDO). `deve_parar` é consultado a cada batch, como em processar_simulacao.
+    """
+    from models import TlpSimulacao
+
+    encontradas = {
+        str(sim.id_simulacao): sim
+        for sim in db.query(TlpSimulacao).filter(TlpSimulacao.id_simulacao.in_(ids_simulacao)).all()
+    }
+    faltando = [id_simulacao for id_simulacao in ids_simulacao if str(id_simulacao) not in encontradas]
+    if faltando:
+        raise ErroProcessamento(f"Simulação não encontrada: {', '.join(map(str, faltando))}")
+    sims = [encontradas[str(id_simulacao)] for id_simulacao in ids_simulacao]
+
+    processadas = [sim.id_simulacao for sim in sims if sim.status in ('CONCLUIDO', 'CONVERTIDO_LOTE')]
+    if processadas:
+        raise ErroProcessamento(f"Simulação já foi processada: {', '.join(map(str, processadas))}")
+    exercicios = {sim.exercicio for sim in sims}
+    if len(exercicios) > 1:
+        raise ErroProcessamento("Os cenários de uma varredura devem ser do mesmo exercício")
+    exercicio = exercicios.pop()
+
+    progressos = [RegistroProgresso(sim.id_simulacao) for sim in sims] if gravar_itens else []
+    try:
+        if gravar_itens:
+            for sim in sims:
+                sim.status = 'EM_PROCESSAMENTO'
+            db.commit()
+            invalidar_cache(CACHE_SIMULACOES)
+            for progresso in progressos:
+                progresso.fase('PREPARANDO')
+
+        # Parâmetros de cada cenário, em centavos
+        parametros = [parametros_do_snapshot(sim.parametros_snapshot) for sim in sims]
+
+        versao = garantir_versao(db)
+        total_imoveis = versao.total_imoveis or 0
+        for sim in sims:
+            sim.id_versao_base = versao.id_versao
+        db.commit()
+        invalidar_cache(CACHE_SIMULACOES)
+
+        if total_imoveis == 0:
+            raise ErroProcessamento("Nenhum imóvel encontrado na base")
+
+        estatisticas_pipeline = None
+        if gravar_itens:
+            isencoes = ler_isencoes(db, exercicio)
+            for sim in sims:
+                preparar_particao(db, sim.id_simulacao)
+                remover_resumo(db, sim.id_simulacao)
+            db.commit()
+
+            for progresso in progressos:
+                progresso.fase('CALCULANDO', total_imoveis=total_imoveis)
+            resumos, estatisticas_pipeline = _varrer_base(
+                [(sim.id_simulacao, valores) for sim, valores in zip(sims, parametros)],
+                versao.id_versao, total_imoveis, isencoes, progressos, profundidade_fila, deve_parar
+            )
+            for estagio, valores in estatisticas_pipeline["estagios"].items():
+                ESTAGIOS_PIPELINE.inc(valores["ocupado_segundos"], estagio=estagio)
+            print(f"Varredura de {len(sims)} cenário(s): pipeline {estatisticas_pipeline}")
+        else:
+            # Só o resumo: uma agregação por (uso, isento) serve a todos os cenários
+            _, grupos = contagens_por_grupo(db, exercicio)
+            resumos = [
+                estatisticas_por_grupos(grupos, custo_final, total_imoveis, limite_min, limite_max)
+                for custo_final, limite_min, limite_max in parametros
+            ]
+
+        # Resumos e status de todos os cenários na mesma transação
+        if deve_parar is not None and deve_parar():
+            raise ProcessamentoCancelado("Varredura cancelada")
+        for sim, resumo in zip(sims, resumos):
+            # Só conclui cenários ainda EM_PROCESSAMENTO: um reset concorrente já removeu
+            # a partição e voltou o cenário para RASCUNHO
+            if gravar_itens and not db.execute(
+                text("""
+                    UPDATE tlp.tlp_simulacao SET status = 'CONCLUIDO'
+                    WHERE id_simulacao = :id AND status = 'EM_PROCESSAMENTO'
+                """),
+                {"id": str(sim.id_simulacao)}
+            ).rowcount:
+                raise ProcessamentoCancelado(f"Cenário {sim.id_simulacao} resetado durante a varredura")
+            gravar_resumo(db, sim.id_simulacao, resumo, ORIGEM_RESUMO)
+        db.commit()
+        invalidar_cache(CACHE_SIMULACOES)
+        for progresso in progressos:
+            progresso.concluir(estatisticas_pipeline["itens_por_cenario"])
+        EXECUCOES_SIMULACAO.inc(engine='varredura', resultado='CONCLUIDO')
+
+        resposta = {
+            "message": f"Varredura de {len(sims)} cenário(s) concluída",
+            "total_imoveis": total_imoveis,
+            "gravar_itens": gravar_itens,
+            "cenarios": [
+                {
+                    "id_simulacao": str(sim.id_simulacao),
+                    "parametros": sim.parametros_snapshot,
+                    "estatisticas": resumo["estatisticas"],
+                }
+                for sim, resumo in zip(sims, resumos)
+            ],
+        }
+        if estatisticas_pipeline is not None:
+            resposta["pipeline"] = estatisticas_pipeline
+        return resposta
+
+    except ProcessamentoCancelado:
+        db.rollback()
+        EXECUCOES_SIMULACAO.inc(engine='varredura', resultado='CANCELADO')
+        # Cenários resetados já voltaram a RASCUNHO; os demais não ficam presos em EM_PROCESSAMENTO
+        _marcar_erro_cenarios(db, ids_simulacao, "Varredura cancelada")
+        raise
+    except Exception as e:
+        db.rollback()
+        EXECUCOES_SIMULACAO.inc(engine='varredura', resultado='ERRO')
+        _marcar_erro_cenarios(db, ids_simulacao, str(e))
+        raise
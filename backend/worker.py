@@ -0,0 +1,328 @@
+"""Worker de jobs em background (fila persistente em tlp.tlp_job).
+
+Os endpoints apenas enfileiram jobs; este worker os executa fora da requisição HTTP.
+Pode rodar dentro do processo da API (thread iniciada no startup, ver main.py) ou
+como processo separado:
+
+    python -m worker
+
+Cada job em execução grava um heartbeat periódico. Jobs EXECUTANDO cujo heartbeat
+expirou (worker morto, deploy, OOM) são reivindicados novamente por qualquer worker,
+até MAX_TENTATIVAS.
+"""
+import json
+import os
+import socket
+import threading
+import uuid
+
+from sqlalchemy import or_, text
+
+from cache import CACHE_LOTES, CACHE_SIMULACOES, invalidar_cache
+from database import SessionLocal, engine
+from lotes import marcar_erro_remessa
+from progresso import marcar_erro
+
+JOB_PROCESSAR_SIMULACAO = 'PROCESSAR_SIMULACAO'
+JOB_ATUALIZAR_BASE = 'ATUALIZAR_BASE'
+JOB_GERAR_REMESSA = 'GERAR_REMESSA'
+JOB_VARREDURA = 'VARREDURA'
+
+STATUS_ATIVOS = ('PENDENTE', 'EXECUTANDO')
+
+HEARTBEAT_INTERVALO = int(os.getenv("TLP_JOB_HEARTBEAT_SEGUNDOS", "10"))
+HEARTBEAT_TIMEOUT = int(os.getenv("TLP_JOB_TIMEOUT_SEGUNDOS", "60"))
+POLL_INTERVALO = float(os.getenv("TLP_JOB_POLL_SEGUNDOS", "2"))
+MAX_TENTATIVAS = int(os.getenv("TLP_JOB_MAX_TENTATIVAS", "3"))
+
+
+def novo_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+# ============== FILA ==============
+
+def enfileirar_job(db, tipo, id_simulacao=None, parametros=None):
+    """Cria um job PENDENTE na sessão informada (o commit fica com quem chama)."""
+    from models import TlpJob
+
+    job = TlpJob(
+        tipo=tipo,
+        id_simulacao=id_simulacao,
+        parametros=parametros or {},
+        status='PENDENTE',
+        tentativas=0
+    )
+    db.add(job)
+    db.flush()
+    return job
+
+
+def job_ativo_da_simulacao(db, id_simulacao):
+    """Retorna o job PENDENTE/EXECUTANDO da simulação (inclusive varredura que a contém), se houver."""
+    from models import TlpJob
+
+    return db.query(TlpJob).filter(
+        or_(
+            TlpJob.id_simulacao == id_simulacao,
+            TlpJob.parametros['simulacoes'].contains([str(id_simulacao)])
+        ),
+        TlpJob.status.in_(STATUS_ATIVOS)
+    ).first()
+
+
+def job_ativo_do_lote(db, id_lote):
+    """Retorna o job GERAR_REMESSA PENDENTE/EXECUTANDO do lote, se houver."""
+    from models import TlpJob
+
+    return db.query(TlpJob).filter(
+        TlpJob.tipo == JOB_GERAR_REMESSA,
+        TlpJob.parametros['id_lote'].astext == str(id_lote),
+        TlpJob.status.in_(STATUS_ATIVOS)
+    ).first()
+
+
+def cancelar_jobs_da_simulacao(db, id_simulacao):
+    """Marca como CANCELADO os jobs ativos da simulação (o worker interrompe no próximo heartbeat)."""
+    db.execute(
+        text("""
+            UPDATE tlp.tlp_job
+            SET status = 'CANCELADO', finalizado_em = now()
+            WHERE (id_simulacao = :id OR parametros -> 'simulacoes' @> CAST(:ids AS jsonb))
+              AND status IN ('PENDENTE', 'EXECUTANDO')
+        """),
+        {"id": str(id_simulacao), "ids": json.dumps([str(id_simulacao)])}
+    )
+
+
+def expirar_jobs_abandonados():
+    """Jobs com heartbeat expirado e sem tentativas restantes vão para ERRO (e a simulação também)."""
+    with engine.begin() as conn:
+        expirados = conn.execute(
+            text("""
+                UPDATE tlp.tlp_job
+                SET status = 'ERRO', finalizado_em = now(),
+                    erro_mensagem = 'Worker parou de responder (heartbeat expirado) após ' || tentativas || ' tentativa(s)'
+                WHERE status = 'EXECUTANDO'
+                  AND heartbeat_em < now() - make_interval(secs => :timeout)
+                  AND tentativas >= :max_tentativas
+                RETURNING id_simulacao, parametros, erro_mensagem
+            """),
+            {"timeout": HEARTBEAT_TIMEOUT, "max_tentativas": MAX_TENTATIVAS}
+        ).fetchall()
+        for id_simulacao, parametros, mensagem in expirados:
+            # Varreduras não têm id_simulacao: as simulações estão nos parâmetros do job
+            ids = [id_simulacao] if id_simulacao is not None else (parametros or {}).get('simulacoes', [])
+            for id_afetada in ids:
+                atualizada = conn.execute(
+                    text("""
+                        UPDATE tlp.tlp_simulacao SET status = 'ERRO'
+                        WHERE id_simulacao = :id AND status = 'EM_PROCESSAMENTO'
+                    """),
+                    {"id": id_afetada}
+                ).rowcount
+                if atualizada:
+                    marcar_erro(conn, id_afetada, mensagem)
+            # Geração de remessa: o lote não fica preso em GERADO
+            if (parametros or {}).get('id_lote'):
+                marcar_erro_remessa(conn, parametros['id_lote'], mensagem)
+    if expirados:
+        invalidar_cache(CACHE_SIMULACOES, CACHE_LOTES)
+
+
+def reivindicar_job(worker_id):
+    """Reivindica atomicamente o próximo job: PENDENTE, ou EXECUTANDO com heartbeat expirado.
+
+    FOR UPDATE SKIP LOCKED permite vários workers concorrentes sem pegar o mesmo job.
+    """
+    with engine.begin() as conn:
+        return conn.execute(
+            text("""
+                UPDATE tlp.tlp_job
+                SET status = 'EXECUTANDO',
+                    worker_id = :worker_id,
+                    heartbeat_em = now(),
+                    iniciado_em = now(),
+                    tentativas = tentativas + 1
+                WHERE id_job = (
+                    SELECT id_job FROM tlp.tlp_job
+                    WHERE status = 'PENDENTE'
+                       OR (status = 'EXECUTANDO'
+                           AND heartbeat_em < now() - make_interval(secs => :timeout)
+                           AND tentativas < :max_tentativas)
+                    ORDER BY created_at
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING id_job, tipo, id_simulacao, parametros, tentativas
+            """),
+            {"worker_id": worker_id, "timeout": HEARTBEAT_TIMEOUT, "max_tentativas": MAX_TENTATIVAS}
+        ).fetchone()
+
+
+def finalizar_job(id_job, worker_id, status, resultado=None, erro_mensagem=None):
+    """Grava o status final, somente se o job ainda pertence a este worker e não foi cancelado."""
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+                UPDATE tlp.tlp_job
+                SET status = :status, finalizado_em = now(),
+                    resultado = CAST(:resultado AS jsonb), erro_mensagem = :erro
+                WHERE id_job = :id AND worker_id = :worker_id AND status = 'EXECUTANDO'
+            """),
+            {
+                "id": id_job,
+                "worker_id": worker_id,
+                "status": status,
+                "resultado": json.dumps(resultado) if resultado is not None else None,
+                "erro": erro_mensagem,
+            }
+        )
+
+
+class Heartbeat(threading.Thread):
+    """Atualiza heartbeat_em do job periodicamente e detecta cancelamento."""
+
+    def __init__(self, id_job, worker_id):
+        super().__init__(daemon=True, name=f"heartbeat-{id_job}")
+        self.id_job = id_job
+        self.worker_id = worker_id
+        self.cancelado = threading.Event()
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.wait(HEARTBEAT_INTERVALO):
+            try:
+                with engine.begin() as conn:
+                    row = conn.execute(
+                        text("""
+                            UPDATE tlp.tlp_job SET heartbeat_em = now()
+                            WHERE id_job = :id AND worker_id = :worker_id
+                            RETURNING status
+                        """),
+                        {"id": self.id_job, "worker_id": self.worker_id}
+                    ).fetchone()
+                # Cancelado pelo usuário ou reivindicado por outro worker: interromper
+                if row is None or row[0] != 'EXECUTANDO':
+                    self.cancelado.set()
+            except Exception as e:
+                print(f"Heartbeat falhou para job {self.id_job}: {e}")
+
+    def parar(self):
+        self._parar.set()
+
+
+# ============== EXECUÇÃO ==============
+
+def _executar_processar_simulacao(db, job, deve_parar):
+    from processamento import processar_simulacao
+
+    parametros = job.parametros or {}
+    return processar_simulacao(
+        db, job.id_simulacao,
+        engine=parametros.get('engine', 'python'),
+        deve_parar=deve_parar,
+        profundidade_fila=parametros.get('profundidade_fila'),
+        perfil=parametros.get('perfil', False),
+        cprofile=parametros.get('cprofile', False)
+    )
+
+
+def _executar_atualizar_base(db, job, deve_parar):
+    from base_imovel import atualizar_base
+
+    versao = atualizar_base(db)
+    return {"id_versao": versao.id_versao, "total_imoveis": versao.total_imoveis}
+
+
+def _executar_gerar_remessa(db, job, deve_parar):
+    from lotes import gerar_remessa
+
+    return gerar_remessa(db, (job.parametros or {})["id_lote"], deve_parar=deve_parar)
+
+
+def _executar_varredura(db, job, deve_parar):
+    from varredura import processar_varredura
+
+    parametros = job.parametros or {}
+    return processar_varredura(
+        db, parametros["simulacoes"],
+        gravar_itens=parametros.get('gravar_itens', False),
+        deve_parar=deve_parar,
+        profundidade_fila=parametros.get('profundidade_fila')
+    )
+
+
+EXECUTORES = {
+    JOB_PROCESSAR_SIMULACAO: _executar_processar_simulacao,
+    JOB_ATUALIZAR_BASE: _executar_atualizar_base,
+    JOB_GERAR_REMESSA: _executar_gerar_remessa,
+    JOB_VARREDURA: _executar_varredura,
+}
+
+
+def executar_job(job, worker_id):
+    """Executa um job reivindicado, com heartbeat, e grava o status final."""
+    from processamento import ProcessamentoCancelado
+
+    executor = EXECUTORES.get(job.tipo)
+    if executor is None:
+        finalizar_job(job.id_job, worker_id, 'ERRO', erro_mensagem=f"Tipo de job desconhecido: {job.tipo}")
+        return
+
+    heartbeat = Heartbeat(job.id_job, worker_id)
+    heartbeat.start()
+    db = SessionLocal()
+    try:
+        resultado = executor(db, job, heartbeat.cancelado.is_set)
+        finalizar_job(job.id_job, worker_id, 'CONCLUIDO', resultado=resultado)
+    except ProcessamentoCancelado:
+        print(f"Job {job.id_job} cancelado")
+    except Exception as e:
+        print(f"Job {job.id_job} falhou: {e}")
+        finalizar_job(job.id_job, worker_id, 'ERRO', erro_mensagem=str(e))
+    finally:
+        heartbeat.parar()
+        db.close()
+
+
+def loop_worker(parar=None, worker_id=None):
+    """Loop principal: reivindica e executa jobs até `parar` (threading.Event) ser sinalizado."""
+    parar = parar or threading.Event()
+    worker_id = worker_id or novo_worker_id()
+    print(f"Worker {worker_id} iniciado")
+
+    while not parar.is_set():
+        try:
+            expirar_jobs_abandonados()
+            job = reivindicar_job(worker_id)
+        except Exception as e:
+            print(f"Worker {worker_id}: erro ao buscar jobs: {e}")
+            parar.wait(POLL_INTERVALO)
+            continue
+
+        if job is None:
+            parar.wait(POLL_INTERVALO)
+            continue
+
+        executar_job(job, worker_id)
+
+    print(f"Worker {worker_id} finalizado")
+
+
+def iniciar_worker_embutido():
+    """Inicia o worker em uma thread daemon dentro do processo da API. Retorna o Event de parada."""
+    parar = threading.Event()
+    threading.Thread(target=loop_worker, args=(parar,), daemon=True, name="tlp-worker").start()
+    return parar
+
+
+if __name__ == "__main__":
+    if os.getenv("TLP_WORKER_METRICAS_PORTA"):
+        from metricas import servir_metricas
+        servir_metricas(int(os.getenv("TLP_WORKER_METRICAS_PORTA")))
+    parar = threading.Event()
+    try:
+        loop_worker(parar)
+    except KeyboardInterrupt:
+        parar.set()
@@ -13,6 +13,11 @@ interface Lote {
     id_simulacao_origem: string;
     created_at: string;
     parametros_snapshot: any;
+    total_itens?: number;
+    total_registros_remessa?: number;
+    valor_total_remessa?: number;
+    checksum_remessa?: string;
+    erro_remessa?: string;
 }
 
 export default function LotesPage() {
@@ -34,11 +39,21 @@ export default function LotesPage() {
         loadList();
     }, []);
 
+    const gerarRemessaNovamente = async (id_lote: string) => {
+        try {
+            await api.post(`/lotes/${id_lote}/remessa/gerar`);
+            loadList();
+        } catch (err: any) {
+            alert(err.response?.data?.detail || 'Erro ao gerar remessa');
+        }
+    };
+
     const statusColor = (status: string) => {
         switch (status) {
             case 'GERADO': return 'bg-blue-100 text-blue-700';
             case 'PROCESSADO': return 'bg-green-100 text-green-700';
             case 'ENVIADO': return 'bg-purple-100 text-purple-700';
+            case 'ERRO_REMESSA': return 'bg-red-100 text-red-700';
             default: return 'bg-gray-100';
         }
     };
@@ -71,8 +86,26 @@ export default function LotesPage() {
                                 <p style={{ color: 'var(--text-muted)', fontSize: '0.75rem', marginTop: '0.25rem' }}>
                                     Origem: Simulação {item.id_simulacao_origem?.substring(0, 8) || '-'}...
                                 </p>
+                                {item.checksum_remessa && (
+                                    <p style={{ color: 'var(--text-muted)', fontSize: '0.75rem', marginTop: '0.25rem' }}>
+                                        Remessa: {item.total_registros_remessa?.toLocaleString()} registros, {Number(item.valor_total_remessa || 0).toLocaleString('pt-BR', { style: 'currency', currency: 'BRL' })} (checksum {item.checksum_remessa})
+                                    </p>
+                                )}
+                                {item.status === 'ERRO_REMESSA' && item.erro_remessa && (
+                                    <p style={{ color: 'var(--danger)', fontSize: '0.75rem', marginTop: '0.25rem' }}>
+                                        Falha na remessa: {item.erro_remessa}
+                                    </p>
+                                )}
                             </div>
                             <div style={{ display: 'flex', gap: '0.5rem' }}>
+                                {item.status === 'ERRO_REMESSA' && (
+                                    <Button variant="outline" size="sm" onClick={() => gerarRemessaNovamente(item.id_lote)}>Gerar Remessa Novamente</Button>
+                                )}
+                                {item.status !== 'GERADO' && item.checksum_remessa && (
+                                    <a href={`${api.defaults.baseURL}/lotes/${item.id_lote}/remessa`}>
+                                        <Button variant="outline" size="sm">Baixar Remessa</Button>
+                                    </a>
+                                )}
                                 <Button variant="outline" size="sm">Exportar CSV</Button>
                                 <Button variant="outline" size="sm">Ver Detalhes</Button>
                             </div>
@@ -102,9 +102,40 @@ export default function SimulacoesPage() {
         setLimiteMaxAtualizado(Number((limiteMaxBase * fatorIpca).toFixed(2)));
     }, [custoBase, ipca, subsidioPerc, limiteMinBase, limiteMaxBase]);
 
+    // Prévia instantânea (totais calculados pela API a partir das contagens da base, sem gravar itens)
+    const [previa, setPrevia] = useState<any>(null);
+
+    useEffect(() => {
+        if (!showForm || custoBase <= 0) {
+            setPrevia(null);
+            return;
+        }
+        const timer = setTimeout(async () => {
+            try {
+                const response = await api.post('/simulacoes/preview', {
+                    exercicio: Number(exercicio),
+                    descricao: 'Prévia',
+                    custo_tlp_base: custoBase,
+                    ipca_percentual: ipca,
+                    subsidio_percentual: subsidioPerc,
+                    limite_min_base: limiteMinBase,
+                    limite_max_base: limiteMaxBase,
+                    limite_min_atualizado: limiteMinAtualizado,
+                    limite_max_atualizado: limiteMaxAtualizado
+                });
+                setPrevia(response.data);
+            } catch (err) {
+                console.error('Erro ao calcular prévia:', err);
+                setPrevia(null);
+            }
+        }, 400);
+        return () => clearTimeout(timer);
+    }, [showForm, exercicio, custoBase, ipca, subsidioPerc, limiteMinBase, limiteMaxBase, limiteMinAtualizado, limiteMaxAtualizado]);
+
     // Estado para mensagem de erro de simulação
     const [erroSimulacao, setErroSimulacao] = useState<{ id: string; mensagem: string } | null>(null);
     const pollingRef = useRef<ReturnType<typeof setInterval> | null>(null);
+    const streamRef = useRef<EventSource | null>(null);
     const startTimeRef = useRef<number>(0);
 
     const loadList = async () => {
@@ -115,11 +146,11 @@ export default function SimulacoesPage() {
             // Detectar simulação em processamento e iniciar polling
             const emProcessamento = response.data.find((s: Simulacao) => s.status === 'EM_PROCESSAMENTO');
             if (emProcessamento && !processingId) {
-                // Iniciar polling para esta simulação
+                // Acompanhar o progresso desta simulação
                 setProcessingId(emProcessamento.id_simulacao);
                 setProcessing(true);
                 startTimeRef.current = Date.now();
-                iniciarPolling(emProcessamento.id_simulacao);
+                iniciarAcompanhamento(emProcessamento.id_simulacao);
             }
         } catch (err) {
             console.error(err);
@@ -128,59 +159,73 @@ export default function SimulacoesPage() {
         }
     };
 
-    const iniciarPolling = (idSimulacao: string) => {
-        // Limpar polling anterior
+    const pararAcompanhamento = () => {
+        if (streamRef.current) {
+            streamRef.current.close();
+            streamRef.current = null;
+        }
         if (pollingRef.current) {
             clearInterval(pollingRef.current);
+            pollingRef.current = null;
         }
+    };
 
-        pollingRef.current = setInterval(async () => {
-            try {
-                const progressRes = await api.get(`/simulacoes/${idSimulacao}/progresso`);
-                const data = progressRes.data;
+    // Aplica um estado de progresso (SSE ou polling); encerra o acompanhamento ao concluir ou falhar
+    const tratarProgresso = async (idSimulacao: string, data: any) => {
+        // Usar timestamp do backend para calcular tempo decorrido real
+        let elapsed = 0;
+        if (data.inicio_processamento) {
+            const inicio = new Date(data.inicio_processamento).getTime();
+            elapsed = Math.round((Date.now() - inicio) / 1000);
+        }
 
-                // Usar timestamp do backend para calcular tempo decorrido real
-                let elapsed = 0;
-                if (data.inicio_processamento) {
-                    const inicio = new Date(data.inicio_processamento).getTime();
-                    elapsed = Math.round((Date.now() - inicio) / 1000);
-                }
+        setProgresso({
+            percentual: data.progresso_percentual || 0,
+            itens: data.itens_processados || 0,
+            total: data.total_imoveis || 0,
+            tempo: elapsed
+        });
 
-                setProgresso({
-                    percentual: data.progresso_percentual || 0,
-                    itens: data.itens_processados || 0,
-                    total: data.total_imoveis || 0,
-                    tempo: elapsed
-                });
+        if (data.concluido || data.status === 'CONCLUIDO') {
+            // Processamento concluído
+            pararAcompanhamento();
+            setProcessing(false);
+            setProcessingId(null);
+            setProgresso(null);
+            loadList();  // Recarregar lista
 
-                if (data.concluido || data.status === 'CONCLUIDO') {
-                    // Processamento concluído
-                    clearInterval(pollingRef.current!);
-                    pollingRef.current = null;
-                    setProcessing(false);
-                    setProcessingId(null);
-                    setProgresso(null);
-                    loadList();  // Recarregar lista
-
-                    // Buscar resultado
-                    const res = await api.get(`/simulacoes/${idSimulacao}/resultado`);
-                    setResultadoSimulacao(res.data);
-                    setShowResultado(true);
-                }
+            // Buscar resultado
+            const res = await api.get(`/simulacoes/${idSimulacao}/resultado`);
+            setResultadoSimulacao(res.data);
+            setShowResultado(true);
+        } else if (data.erro || data.status === 'ERRO') {
+            // Erro no processamento
+            pararAcompanhamento();
+            setProcessing(false);
+            setProcessingId(null);
+            setProgresso(null);
+            setErroSimulacao({
+                id: idSimulacao,
+                mensagem: data.erro_mensagem || 'Erro desconhecido'
+            });
+            loadList();  // Recarregar lista
+        } else if (data.status !== 'EM_PROCESSAMENTO') {
+            // Simulação resetada durante o processamento
+            pararAcompanhamento();
+            setProcessing(false);
+            setProcessingId(null);
+            setProgresso(null);
+            loadList();
+        }
+    };
 
-                if (data.erro || data.status === 'ERRO') {
-                    // Erro no processamento
-                    clearInterval(pollingRef.current!);
-                    pollingRef.current = null;
-                    setProcessing(false);
-                    setProcessingId(null);
-                    setProgresso(null);
-                    setErroSimulacao({
-                        id: idSimulacao,
-                        mensagem: data.erro_mensagem || 'Erro desconhecido'
-                    });
-                    loadList();  // Recarregar lista
-                }
+    const iniciarPolling = (idSimulacao: string) => {
+        pararAcompanhamento();
+
+        pollingRef.current = setInterval(async () => {
+            try {
+                const progressRes = await api.get(`/simulacoes/${idSimulacao}/progresso`);
+                await tratarProgresso(idSimulacao, progressRes.data);
             } catch (pollErr) {
                 // Ignorar erros de polling, continuar tentando
                 console.error('Erro no polling:', pollErr);
@@ -188,15 +233,36 @@ export default function SimulacoesPage() {
         }, 2000);
     };
 
-    useEffect(() => {
-        loadList();
+    // Acompanha o progresso via SSE (/progresso/stream); sem suporte ou em caso de falha, volta ao polling
+    const iniciarAcompanhamento = (idSimulacao: string) => {
+        pararAcompanhamento();
 
-        // Cleanup: limpar polling ao desmontar componente
-        return () => {
-            if (pollingRef.current) {
-                clearInterval(pollingRef.current);
+        if (typeof window === 'undefined' || !('EventSource' in window)) {
+            iniciarPolling(idSimulacao);
+            return;
+        }
+
+        const stream = new EventSource(`${api.defaults.baseURL}/simulacoes/${idSimulacao}/progresso/stream`);
+        streamRef.current = stream;
+        stream.addEventListener('progresso', (event) => {
+            tratarProgresso(idSimulacao, JSON.parse((event as MessageEvent).data)).catch((err) => {
+                console.error('Erro ao tratar progresso:', err);
+            });
+        });
+        stream.onerror = () => {
+            // Conexão caiu antes do fim do processamento: seguir por polling
+            if (streamRef.current === stream) {
+                console.error('Stream de progresso indisponível, usando polling');
+                iniciarPolling(idSimulacao);
             }
         };
+    };
+
+    useEffect(() => {
+        loadList();
+
+        // Cleanup: encerrar stream/polling ao desmontar componente
+        return () => pararAcompanhamento();
     }, []);
 
     const handleSubmit = async (e: React.FormEvent) => {
@@ -260,13 +326,11 @@ export default function SimulacoesPage() {
         setErroSimulacao(null);
 
         try {
-            // Iniciar processamento em background (não espera terminar)
-            api.post(`/simulacoes/${idSimulacao}/processar`).catch(() => {
-                // Ignorar erros aqui, o polling vai detectar o status ERRO
-            });
+            // Enfileira o processamento (a API responde 202 com o id do job, sem esperar o cálculo)
+            await api.post(`/simulacoes/${idSimulacao}/processar`);
 
-            // Iniciar polling para acompanhar progresso
-            iniciarPolling(idSimulacao);
+            // Acompanhar progresso (SSE, com polling como alternativa)
+            iniciarAcompanhamento(idSimulacao);
 
         } catch (err: any) {
             setProcessing(false);
@@ -286,6 +350,21 @@ export default function SimulacoesPage() {
         }
     };
 
+    const handleVerErro = async (item: any) => {
+        // O erro fica no canal de progresso; simulações antigas ainda o têm no snapshot
+        let mensagem = item.parametros_snapshot?.erro_mensagem;
+        try {
+            const res = await api.get(`/simulacoes/${item.id_simulacao}/progresso`);
+            mensagem = res.data.erro_mensagem || mensagem;
+        } catch (error) {
+            console.error('Erro ao buscar detalhes do erro:', error);
+        }
+        setErroSimulacao({
+            id: item.id_simulacao,
+            mensagem: mensagem || 'Erro desconhecido durante o processamento.'
+        });
+    };
+
     const handleResetarSimulacao = async (idSimulacao: string) => {
         if (!confirm('Deseja resetar esta simulação para RASCUNHO? Isso permitirá processá-la novamente.')) return;
         try {
@@ -429,6 +508,31 @@ export default function SimulacoesPage() {
                                     </div>
                                 </div>
 
+                                {/* Seção: Prévia do Resultado */}
+                                {previa && (
+                                    <div style={{ borderTop: '1px solid var(--border-color)', paddingTop: '1rem' }}>
+                                        <h4 style={{ fontSize: '0.875rem', fontWeight: 600, marginBottom: '0.75rem', color: 'var(--text-secondary)' }}>Prévia do Resultado</h4>
+                                        <div style={{ display: 'grid', gridTemplateColumns: 'repeat(4, 1fr)', gap: '1rem' }}>
+                                            <div style={{ padding: '0.75rem', backgroundColor: 'var(--bg-body)', borderRadius: 'var(--radius-sm)' }}>
+                                                <p style={{ fontSize: '0.7rem', color: 'var(--text-secondary)' }}>Total Arrecadado</p>
+                                                <p style={{ fontWeight: 600 }}>{formatCurrency(previa.estatisticas?.total_arrecadado || 0)}</p>
+                                            </div>
+                                            <div style={{ padding: '0.75rem', backgroundColor: 'var(--bg-body)', borderRadius: 'var(--radius-sm)' }}>
+                                                <p style={{ fontSize: '0.7rem', color: 'var(--text-secondary)' }}>Média TLP</p>
+                                                <p style={{ fontWeight: 600 }}>{formatCurrency(previa.estatisticas?.media_tlp || 0)}</p>
+                                            </div>
+                                            <div style={{ padding: '0.75rem', backgroundColor: 'var(--bg-body)', borderRadius: 'var(--radius-sm)' }}>
+                                                <p style={{ fontSize: '0.7rem', color: 'var(--text-secondary)' }}>Imóveis</p>
+                                                <p style={{ fontWeight: 600 }}>{previa.estatisticas?.total_imoveis?.toLocaleString() || 0}</p>
+                                            </div>
+                                            <div style={{ padding: '0.75rem', backgroundColor: 'var(--bg-body)', borderRadius: 'var(--radius-sm)' }}>
+                                                <p style={{ fontSize: '0.7rem', color: 'var(--text-secondary)' }}>Isentos</p>
+                                                <p style={{ fontWeight: 600 }}>{previa.estatisticas?.total_isentos?.toLocaleString() || 0}</p>
+                                            </div>
+                                        </div>
+                                    </div>
+                                )}
+
                                 <div style={{ display: 'flex', justifyContent: 'flex-end', gap: '0.5rem' }}>
                                     <Button type="button" variant="outline" onClick={() => setShowForm(false)}>Cancelar</Button>
                                     <Button type="submit">Criar Simulação</Button>
@@ -502,10 +606,7 @@ export default function SimulacoesPage() {
                                     <Button
                                         variant="outline"
                                         size="sm"
-                                        onClick={() => setErroSimulacao({
-                                            id: item.id_simulacao,
-                                            mensagem: item.parametros_snapshot?.erro_mensagem || 'Erro desconhecido durante o processamento.'
-                                        })}
+                                        onClick={() => handleVerErro(item)}
                                         style={{ color: 'orange', borderColor: 'orange' }}
                                     >
                                         ⚠️ Ver Erro